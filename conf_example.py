@@ -17,3 +17,26 @@ paths = {
     #'properties':   'grinder.properties',
 }
 
+
+# Settings for running several agents on this machine with 'start.py agents'.
+# Each agent gets its own properties file, derived from paths['properties'],
+# and all agents write their logs to the same directory.
+agents = {
+    # Number of agents to start
+    'count':            4,
+    # Number of CPUs to pin each agent to (with taskset, on Linux), starting
+    # at first_cpu; None to leave them unpinned
+    'cpus_per_agent':   8,
+    'first_cpu':        0,
+    # grinder.processes and grinder.threads for each agent; None to use
+    # those in paths['properties']
+    'processes':        1,
+    'threads':          None,
+    # Directory for the agents' properties files and logs
+    'log_directory':    'logs',
+    # Number of times to restart an agent that fails
+    'max_restarts':     3,
+    # Seconds to wait for agents to exit when stopped with Ctrl-C, before
+    # killing them
+    'stop_timeout':     10,
+}
@@ -7,29 +7,52 @@
 usage = """Usage:
 
   jython start.py [agent|console]
+  python start.py agents [COUNT]
 
 This script reads configuration from conf.py in the current directory.
 Please edit conf.py to fit your environment before running start.py.
+
+The 'agents' command starts COUNT agents (or the number given in conf.py) on
+this machine, each pinned to its own CPUs, and restarts any that fail. It
+needs the subprocess module, so run it with Python, or Jython 2.5 or later.
 """
 
 import os
 import sys
+import time
+
+try:
+    import subprocess
+except ImportError:
+    subprocess = None
 
 # Get configuration from conf.py
 from conf import paths
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print(usage)
-        sys.exit()
-
-    arg = sys.argv[1]
-    if arg not in ('agent', 'console'):
-        print(usage)
-        sys.exit()
-
-    abs = os.path.abspath
-
+try:
+    from conf import agents
+except ImportError:
+    agents = {}
+
+abs = os.path.abspath
+
+# Default settings for the 'agents' command, overridden by conf.py
+default_agents = {
+    'count':            2,
+    'cpus_per_agent':   None,
+    'first_cpu':        0,
+    'processes':        None,
+    'threads':          None,
+    'log_directory':    'logs',
+    'max_restarts':     3,
+    'stop_timeout':     10,
+}
+
+
+def java_command():
+    """Return the start of the command-line to run a Grinder class, as a list,
+    and set up the ``PATH`` to find ``java``.
+    """
     # Add java home directory to system path
     new_path = abs(paths['java']) + os.path.pathsep + os.getenv('PATH')
     os.putenv('PATH', new_path)
@@ -38,10 +61,181 @@ if __name__ == '__main__':
     grinder_jar = abs(os.path.join(paths['grinder'], 'lib', 'grinder.jar'))
     classpath = grinder_jar + os.path.pathsep + os.getenv('CLASSPATH', '')
 
-    # Assemble the command-line
-    cmd = 'java -cp ' + classpath
-    # Add Jython path
-    cmd += ' -Dgrinder.jvm.arguments=-Dpython.home=' + abs(paths['jython'])
+    # Assemble the command-line, with the Jython path
+    return ['java', '-cp', classpath,
+            '-Dgrinder.jvm.arguments=-Dpython.home=' + abs(paths['jython'])]
+
+
+def read_properties(filename):
+    """Return a dictionary of the properties in the given properties file.
+    Only ``name=value`` and ``name: value`` lines are understood.
+    """
+    properties = {}
+    for line in open(filename).readlines():
+        line = line.strip()
+        if not line or line[0] in '#!':
+            continue
+        for separator in ('=', ':'):
+            if separator in line:
+                name, value = line.split(separator, 1)
+                properties[name.strip()] = value.strip()
+                break
+    return properties
+
+
+def find_program(name):
+    """Return True if the given program is on the ``PATH``.
+    """
+    for directory in os.getenv('PATH', '').split(os.path.pathsep):
+        if os.path.isfile(os.path.join(directory, name)):
+            return True
+    return False
+
+
+def agent_cpus(number, settings):
+    """Return the list of CPUs that agent ``number`` is pinned to, or an empty
+    list if agents are not pinned.
+    """
+    per_agent = settings['cpus_per_agent']
+    if not per_agent:
+        return []
+    first = settings['first_cpu'] + number * per_agent
+    return range(first, first + per_agent)
+
+
+def write_agent_properties(number, count, settings):
+    """Write a properties file for agent ``number`` of ``count``, derived from
+    the one in ``paths['properties']``, and return its name.
+    """
+    base = abs(paths['properties'])
+    properties = read_properties(base)
+    log_directory = abs(settings['log_directory'])
+    # Grinder names each agent's log files after its host ID, so they can
+    # all be written to the same directory
+    overrides = [
+        ('grinder.hostID', 'agent%d' % number),
+        ('grinder.logDirectory', log_directory),
+        ('webtest.agent', number),
+        ('webtest.agents', count),
+    ]
+    # Relative script names are relative to the original properties file
+    if 'grinder.script' in properties:
+        script = os.path.join(os.path.dirname(base), properties['grinder.script'])
+        overrides.append(('grinder.script', abs(script)))
+    if settings['processes']:
+        overrides.append(('grinder.processes', settings['processes']))
+        overrides.append(('grinder.initialProcesses', settings['processes']))
+    if settings['threads']:
+        overrides.append(('grinder.threads', settings['threads']))
+
+    filename = os.path.join(log_directory, 'agent%d.properties' % number)
+    outfile = open(filename, 'w')
+    # Later properties override earlier ones with the same name
+    outfile.write(open(base).read())
+    outfile.write('\n\n# Overrides for agent %d of %d, written by start.py\n' %
+                  (number, count))
+    for name, value in overrides:
+        # Backslashes are escapes in properties files
+        outfile.write('%s=%s\n' % (name, str(value).replace('\\', '\\\\')))
+    outfile.close()
+    return filename
+
+
+def start_agent(number, count, settings):
+    """Start agent ``number`` of ``count``, and return its process.
+    """
+    cmd = java_command() + ['net.grinder.Grinder',
+                            write_agent_properties(number, count, settings)]
+    cpus = agent_cpus(number, settings)
+    if cpus:
+        cmd = ['taskset', '-c', ','.join([str(cpu) for cpu in cpus])] + cmd
+    print("Starting agent %d: %s" % (number, ' '.join(cmd)))
+    return subprocess.Popen(cmd)
+
+
+def stop_agents(processes, timeout):
+    """Terminate the given agent processes, and wait for them to exit. Any
+    still running after ``timeout`` seconds are killed.
+    """
+    for process in processes:
+        process.terminate()
+    deadline = time.time() + timeout
+    for process in processes:
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def run_agents(count=None):
+    """Start several agents, restart any that fail, and wait until they have
+    all finished.
+    """
+    if subprocess is None:
+        print("The agents command needs the subprocess module.")
+        sys.exit(1)
+    settings = default_agents.copy()
+    settings.update(agents)
+    if count is None:
+        count = settings['count']
+    if settings['cpus_per_agent'] and not find_program('taskset'):
+        print("taskset not found; agents will not be pinned to CPUs.")
+        settings['cpus_per_agent'] = None
+    if not os.path.isdir(settings['log_directory']):
+        os.makedirs(settings['log_directory'])
+
+    # Processes and number of restarts, indexed by agent number
+    processes = {}
+    restarts = {}
+    for number in range(count):
+        processes[number] = start_agent(number, count, settings)
+        restarts[number] = 0
+    try:
+        while processes:
+            time.sleep(1)
+            for number, process in processes.items():
+                status = process.poll()
+                if status is None:
+                    continue
+                del processes[number]
+                if status == 0:
+                    print("Agent %d finished" % number)
+                elif restarts[number] < settings['max_restarts']:
+                    restarts[number] += 1
+                    print("Agent %d failed with status %d; restarting" %
+                          (number, status))
+                    processes[number] = start_agent(number, count, settings)
+                else:
+                    print("Agent %d failed with status %d; giving up" %
+                          (number, status))
+    except KeyboardInterrupt:
+        stop_agents(processes.values(), settings['stop_timeout'])
+        print("Stopped Grinder agents")
+    print("Logs are in %s" % abs(settings['log_directory']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit()
+
+    arg = sys.argv[1]
+    if arg == 'agents':
+        if len(sys.argv) > 3 or (len(sys.argv) == 3 and not sys.argv[2].isdigit()):
+            print(usage)
+            sys.exit()
+        if len(sys.argv) == 3:
+            run_agents(int(sys.argv[2]))
+        else:
+            run_agents()
+        sys.exit()
+
+    if len(sys.argv) != 2 or arg not in ('agent', 'console'):
+        print(usage)
+        sys.exit()
+
+    cmd = ' '.join(java_command())
 
     # Add library name for agent or console
     # (Agent needs grinder.properties, but console does not)
@@ -57,4 +251,3 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         print("Stopped Grinder %s" % arg)
 
-
@@ -0,0 +1,495 @@
+# benchmark.py
+
+"""Benchmarks for the request path of the `webtest` modules.
+
+Run them from the top directory with::
+
+    $ python -m tests.benchmark -o results.json
+
+Each benchmark runs an operation many times, and the best of several
+repetitions is kept. Results are printed, and written as JSON, so results
+from two releases can be compared::
+
+    $ python -m tests.benchmark -o new.json --compare old.json
+
+Any benchmark more than ``--threshold`` percent slower than in the old results
+is reported as a regression, and the exit status is 1.
+
+Requests are sent to a server started in this process, on a local port. Its
+response latency and body size can be set with ``--latency`` (in
+milliseconds) and ``--body-size`` (in bytes); each body contains a capturable
+token and parameter names for the correlating runner to find. The full
+iteration benchmarks run through the `webtest.stub` Grinder objects (with
+their responses replaced by the same bodies the server sends), and through
+the standalone `webtest.engine.Engine` against the local server.
+
+The ``processes_N`` benchmarks run the engine in ``N`` processes with
+`webtest.engine.run_processes`, with the same number of users in each, and
+the scaling of their throughput against ``processes_1`` is printed. Scaling
+can only be near-linear with at least ``N`` spare cores. The server runs in
+this process, so give it some ``--latency`` to keep it from being the
+bottleneck::
+
+    $ python -m tests.benchmark --latency 5 processes_1 processes_2 processes_4
+
+This file is not named like a test module, so it is not run with the tests.
+"""
+
+import BaseHTTPServer
+import cgi
+import os
+import platform
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from webtest import correlate
+from webtest import engine
+from webtest import parser
+from webtest import runner
+from webtest import stub
+
+# Version of the results file format
+FORMAT_VERSION = 1
+
+
+def response_body(size):
+    """Return a response body of about ``size`` bytes, with a token to capture
+    and parameter names to correlate.
+    """
+    head = '<html><body><form>' \
+           '<input type="hidden" name="token" value="T0K3N">' \
+           '<input name="username"><input name="password">'
+    tail = '</form></body></html>'
+    filler = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing.</p>\n'
+    count = max(0, size - len(head) - len(tail)) // len(filler) + 1
+    return head + filler * count + tail
+
+
+class Handler (BaseHTTPServer.BaseHTTPRequestHandler):
+    """Responds to every request with the server's body, after its latency.
+    A ``size`` query parameter overrides the body size.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, without waiting for acknowledgements
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def respond(self):
+        query = cgi.parse_qs(urlparse.urlsplit(self.path)[3])
+        if 'size' in query:
+            body = response_body(int(query['size'][0]))
+        else:
+            body = self.server.body
+        if self.server.latency:
+            time.sleep(self.server.latency / 1000.0)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond()
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchmarkServer (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server, run in a background thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0, body_size=4096):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.latency = latency
+        self.body = response_body(body_size)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def address(self):
+        return '127.0.0.1:%d' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+WEBTEST_REQUEST = '''
+    <Request Method="GET" Url="http://{SERVER}/page/%(index)d">
+      <Description>Page %(index)d</Description>
+      <Headers>
+        <Header Name="Accept" Value="text/html" />
+      </Headers>
+      <Capture>
+        <![CDATA[{TOKEN = name="token" value="([^"]+)"}]]>
+      </Capture>
+    </Request>
+
+    <Request Method="POST" Url="http://{SERVER}/login/%(index)d">
+      <FormPostHttpBody>
+        <FormPostParameter Name="token" Value="{TOKEN}" UrlEncode="True" />
+        <FormPostParameter Name="username" Value="{USERNAME}" UrlEncode="True" />
+        <FormPostParameter Name="password" Value="secret" UrlEncode="True" />
+      </FormPostHttpBody>
+    </Request>
+'''
+
+def write_webtest(filename, pairs):
+    """Write a ``.webtest`` file with ``pairs`` of requests; a GET with a
+    capture, then a POST using the captured value.
+    """
+    outfile = open(filename, 'w')
+    outfile.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                  '<TestCase>\n  <Items>\n')
+    for index in range(pairs):
+        outfile.write(WEBTEST_REQUEST % {'index': index})
+    outfile.write('  </Items>\n</TestCase>\n')
+    outfile.close()
+
+
+class NullOutput:
+    """Discards everything written to it, in place of ``sys.stdout``.
+    """
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def measure(function, number, repeat):
+    """Call ``function`` ``number`` times, ``repeat`` times over, and return
+    the shortest time taken by ``number`` calls, in seconds. Output written
+    to ``sys.stdout`` by ``function`` is discarded.
+    """
+    best = None
+    stdout = sys.stdout
+    sys.stdout = NullOutput()
+    try:
+        for repetition in range(repeat):
+            start = time.time()
+            for call in range(number):
+                function()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        sys.stdout = stdout
+    return best
+
+
+class Benchmarks:
+    """The benchmarks, sharing a server and a directory of ``.webtest`` files.
+    """
+    def __init__(self, latency=0, body_size=4096, pairs=10, scale=1.0,
+                 repeat=3):
+        self.server = BenchmarkServer(latency, body_size)
+        self.body_size = body_size
+        self.pairs = pairs
+        self.scale = scale
+        self.repeat = repeat
+        self.temp_dir = tempfile.mkdtemp()
+        self.webtest_file = os.path.join(self.temp_dir, 'benchmark.webtest')
+        write_webtest(self.webtest_file, pairs)
+        self.variables = {'SERVER': self.server.address(),
+                          'USERNAME': 'wapcaplet'}
+
+
+    def close(self):
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+
+
+    def count(self, number):
+        """Return ``number`` scaled by ``scale``, at least 1.
+        """
+        return max(1, int(number * self.scale))
+
+
+    def test_runner(self, **kwargs):
+        """Return a quiet TestRunner class for the benchmark ``.webtest`` file.
+        """
+        return runner.get_test_runner([runner.TestSet(self.webtest_file)],
+            verbosity='error', think_time=0, scenario_think_time=0,
+            variables=self.variables, **kwargs)
+
+
+    def bench_parse(self):
+        """Parse the ``.webtest`` file.
+        """
+        number = self.count(200)
+        def parse():
+            parser.Webtest(self.webtest_file)
+        return number, measure(parse, number, self.repeat)
+
+
+    def bench_eval_expressions(self):
+        """Expand variables, assignments and macros in a value.
+        """
+        test_runner = self.test_runner()
+        instance = test_runner()
+        value = 'http://{SERVER}/path?user={USERNAME}&id={ID = 12345}' \
+                '&stamp={timestamp()}'
+        number = self.count(20000)
+        return number, measure(lambda: instance.eval_expressions(value),
+                               number, self.repeat)
+
+
+    def bench_eval_capture(self):
+        """Evaluate a request's capture expressions on a response body.
+        """
+        test_runner = self.test_runner()
+        instance = test_runner()
+        request = runner.WebtestRunner.webtest_requests[self.webtest_file][0][2]
+        response = stub.Response(response_body(self.body_size))
+        number = self.count(20000)
+        return number, measure(lambda: instance.eval_capture(request, response),
+                               number, self.repeat)
+
+
+    def bench_correlate(self):
+        """Correlate a request's parameters with the responses so far.
+        """
+        correlate.get_correlation_runner([runner.TestSet(self.webtest_file)],
+                                         think_time=0, verbosity='error')
+        instance = correlate.CorrelationRunner()
+        body = response_body(self.body_size)
+        instance.webtest_responses[self.webtest_file] = \
+            [(number, body) for number in range(self.pairs)]
+        request = runner.WebtestRunner.webtest_requests[self.webtest_file][1][2]
+        number = self.count(5000)
+        return number, measure(
+            lambda: instance.correlate(self.webtest_file, request),
+            number, self.repeat)
+
+
+    def bench_stub_iteration(self):
+        """Run full iterations through the stub Grinder objects, whose
+        responses carry the server's body.
+        """
+        test_runner = self.test_runner()
+        body = self.server.body
+        original_get = stub.Wrapper.GET
+        original_post = stub.Wrapper.POST
+        stub.Wrapper.GET = lambda self, *args: stub.Response(body)
+        stub.Wrapper.POST = lambda self, *args: stub.Response(body)
+        try:
+            instance = test_runner()
+            number = self.count(200)
+            seconds = measure(instance, number, self.repeat)
+        finally:
+            stub.Wrapper.GET = original_get
+            stub.Wrapper.POST = original_post
+        return number * self.pairs * 2, seconds
+
+
+    def bench_engine(self):
+        """Run iterations with the standalone engine, against the local
+        server.
+        """
+        test_runner = self.test_runner()
+        users = self.count(20)
+        iterations = 5
+        def run():
+            engine.Engine(test_runner, users=users, iterations=iterations,
+                          sleep_variation=0).run()
+        return users * iterations * self.pairs * 2, \
+               measure(run, 1, self.repeat)
+
+
+    def _bench_processes(self, processes):
+        """Run iterations with `webtest.engine.run_processes`, with the same
+        number of users in each of ``processes`` processes.
+        """
+        test_runner = self.test_runner()
+        users = self.count(20) * processes
+        iterations = 5
+        def run():
+            engine.run_processes(test_runner, processes=processes, users=users,
+                                 iterations=iterations, sleep_variation=0)
+        return users * iterations * self.pairs * 2, \
+               measure(run, 1, self.repeat)
+
+
+    def bench_processes_1(self):
+        """Run iterations with one engine process.
+        """
+        return self._bench_processes(1)
+
+
+    def bench_processes_2(self):
+        """Run twice as many iterations with two engine processes.
+        """
+        return self._bench_processes(2)
+
+
+    def bench_processes_4(self):
+        """Run four times as many iterations with four engine processes.
+        """
+        return self._bench_processes(4)
+
+
+    def names(self):
+        """Return the names of all benchmarks, in the order they're run.
+        """
+        names = [name[len('bench_'):] for name in dir(self)
+                 if name.startswith('bench_')]
+        return names
+
+
+    def run(self, names=None, output=None):
+        """Run the named benchmarks (or all of them), and return their
+        results, indexed by name. If ``output`` is given, a line is written
+        to it as each benchmark finishes.
+        """
+        results = {}
+        for name in names or self.names():
+            operations, seconds = getattr(self, 'bench_' + name)()
+            results[name] = {
+                'operations': operations,
+                'seconds': seconds,
+                'microseconds_per_operation': seconds * 1e6 / operations,
+                'operations_per_second': operations / seconds,
+            }
+            if output:
+                output.write('%-20s %10d ops %10.3f s %12.1f ops/s\n' %
+                             (name, operations, seconds, operations / seconds))
+        return results
+
+
+def environment():
+    """Return a description of the environment the benchmarks ran in.
+    """
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def scaling(results):
+    """Return a line for each ``processes_N`` benchmark in ``results``, giving
+    its throughput as a multiple of ``processes_1``'s, and as a percentage of
+    ``N`` times it (perfectly linear scaling).
+    """
+    if 'processes_1' not in results:
+        return []
+    base = results['processes_1']['operations_per_second']
+    lines = []
+    counts = [int(name[len('processes_'):]) for name in results
+              if name.startswith('processes_')]
+    counts.sort()
+    for count in counts[1:]:
+        speedup = results['processes_%d' % count]['operations_per_second'] / base
+        lines.append('%-20s %8.2fx %8.1f%% of linear' %
+                     ('processes_%d' % count, speedup, 100.0 * speedup / count))
+    return lines
+
+
+def compare(old, new, threshold=10.0):
+    """Compare two sets of results (as written to the JSON file), and return
+    ``(lines, regressions)``; a line for each benchmark in both, and the names
+    of those more than ``threshold`` percent slower in ``new``.
+    """
+    lines = []
+    regressions = []
+    names = [name for name in new['benchmarks'] if name in old['benchmarks']]
+    names.sort()
+    for name in names:
+        before = old['benchmarks'][name]['microseconds_per_operation']
+        after = new['benchmarks'][name]['microseconds_per_operation']
+        change = 100.0 * (after - before) / before
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append('%-20s %12.2f us %12.2f us %+8.1f%%%s' %
+                     (name, before, after, change, flag))
+    return lines, regressions
+
+
+def main(args):
+    """Run the benchmarks, and write and compare their results.
+    """
+    from optparse import OptionParser
+    usage = "python -m tests.benchmark [options] [BENCHMARK ...]"
+    option_parser = OptionParser(usage=usage)
+    option_parser.add_option('-o', '--output', dest='output',
+                             help="Write the results to OUTPUT, as JSON")
+    option_parser.add_option('-c', '--compare', dest='compare',
+                             help="Compare the results with those in COMPARE")
+    option_parser.add_option('--threshold', dest='threshold', type='float',
+                             default=10.0,
+                             help="Percent slowdown counted as a regression")
+    option_parser.add_option('--latency', dest='latency', type='float',
+                             default=0, help="Server latency in milliseconds")
+    option_parser.add_option('--body-size', dest='body_size', type='int',
+                             default=4096, help="Response body size in bytes")
+    option_parser.add_option('--pairs', dest='pairs', type='int', default=10,
+                             help="Pairs of requests in the .webtest file")
+    option_parser.add_option('--scale', dest='scale', type='float',
+                             default=1.0, help="Multiply operation counts")
+    option_parser.add_option('--repeat', dest='repeat', type='int', default=3,
+                             help="Repetitions of each benchmark")
+    options, names = option_parser.parse_args(args)
+    if json is None:
+        option_parser.error("The json module is needed (Python 2.6 or later)")
+
+    benchmarks = Benchmarks(options.latency, options.body_size, options.pairs,
+                            options.scale, options.repeat)
+    try:
+        for name in names:
+            if name not in benchmarks.names():
+                option_parser.error("Unknown benchmark: %s" % name)
+        results = {
+            'format': FORMAT_VERSION,
+            'environment': environment(),
+            'options': {
+                'latency': options.latency,
+                'body_size': options.body_size,
+                'pairs': options.pairs,
+                'scale': options.scale,
+                'repeat': options.repeat,
+            },
+            'benchmarks': benchmarks.run(names, sys.stdout),
+        }
+    finally:
+        benchmarks.close()
+    lines = scaling(results['benchmarks'])
+    if lines:
+        print('\n'.join(lines))
+
+    if options.output:
+        outfile = open(options.output, 'w')
+        json.dump(results, outfile, indent=2, sort_keys=True)
+        outfile.close()
+    if options.compare:
+        old = json.load(open(options.compare))
+        lines, regressions = compare(old, results, options.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            print("%d regressions: %s" % (len(regressions),
+                                          ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -18,3 +18,62 @@ class TestCorrelationRunner (unittest.TestCase):
         )
         self.assertEqual(type(corr_runner), type(correlate.CorrelationRunner))
 
+
+
+    def test_transactions(self):
+        """Requests in a transaction are correlated and recorded, and the
+        transaction is timed by its own test.
+        """
+        webtest_file = os.path.join(data_dir, 'transactions.webtest')
+        corr_runner = correlate.get_correlation_runner(
+            [runner.TestSet(webtest_file)], think_time=0, verbosity='quiet',
+            variables={'SERVER': 'www.google.com', 'USERNAME': 'wapcaplet'})
+        transactions = []
+        original_run_transaction = correlate.CorrelationRunner.run_transaction
+        def run_transaction(self, transaction):
+            transactions.append(transaction.name)
+            return original_run_transaction(self, transaction)
+        correlate.CorrelationRunner.run_transaction = run_transaction
+        try:
+            instance = corr_runner()
+            instance()
+        finally:
+            correlate.CorrelationRunner.run_transaction = original_run_transaction
+        self.assertEqual(transactions, ['Home page', 'Account page'])
+        requests = runner.WebtestRunner.webtest_requests[webtest_file]
+        self.assertEqual(
+            [number for number, body in instance.webtest_responses[webtest_file]],
+            [test.getNumber() for test, wrapper, request in requests])
+
+
+    def test_replay_speed(self):
+        """The correlation runner sleeps for recorded pauses when replaying.
+        """
+        timed_file = os.path.join(data_dir, 'timed.webtest')
+        corr_runner = correlate.get_correlation_runner(
+            [runner.TestSet(timed_file)], think_time=0, verbosity='error',
+            variables={'SERVER': 'www.google.com'}, replay_speed=2.0)
+        self.assertEqual(runner.WebtestRunner.replay_speed, 2.0)
+        self.assertEqual(runner.WebtestRunner.verbosity, 'error')
+        slept = []
+        original_sleep = correlate.CorrelationRunner._sleep
+        def sleep(self, milliseconds, exact=False):
+            slept.append((milliseconds, exact))
+        correlate.CorrelationRunner._sleep = sleep
+        try:
+            corr_runner()()
+        finally:
+            correlate.CorrelationRunner._sleep = original_sleep
+            runner.WebtestRunner.replay_speed = None
+        steps = runner.WebtestRunner.webtest_steps[timed_file]
+        recorded = [runner._recorded_think_time(step) for step in steps]
+        # Recorded pauses are halved and slept exactly, if not zero; the
+        # others use think_time
+        expected = []
+        for time in recorded:
+            if time is None:
+                expected.append((0, False))
+            elif long(time / 2.0) > 0:
+                expected.append((long(time / 2.0), True))
+        self.assertTrue([exact for milliseconds, exact in expected if exact])
+        self.assertEqual(slept, expected)
@@ -0,0 +1,153 @@
+# test_data.py
+
+"""Unit tests for the `webtest.data` module.
+"""
+
+import os
+import unittest
+from webtest import data, runner, stub
+from . import data_dir
+
+users_csv = os.path.join(data_dir, 'users.csv')
+
+class FakeUser:
+    """Stands in for a WebtestRunner instance.
+    """
+    def __init__(self, worker=0, workers=1):
+        self.partition = (worker, workers)
+
+    def worker(self):
+        return self.partition
+
+
+class TestSplitRow (unittest.TestCase):
+    def test_split_row(self):
+        """split_row splits plain and quoted fields.
+        """
+        self.assertEqual(data.split_row('a,b,,c'), ['a', 'b', '', 'c'])
+        self.assertEqual(data.split_row('"a,b",c'), ['a,b', 'c'])
+        self.assertEqual(data.split_row('a,"say ""hi""",'), ['a', 'say "hi"', ''])
+        self.assertEqual(data.split_row('a\t"b"', '\t'), ['a', 'b'])
+        self.assertRaises(ValueError, data.split_row, 'a,"b')
+
+
+class TestDataFile (unittest.TestCase):
+    def check_data_file(self, data_file):
+        self.assertEqual(data_file.columns, ['username', 'password', 'note'])
+        self.assertEqual(len(data_file), 4)
+        self.assertEqual(data_file.row(0), ['phil', 'secret', 'says "hi", twice'])
+        self.assertEqual(data_file.row(1), ['sarah', 's3cret', ''])
+        self.assertEqual(data_file.row(3), ['ann', 'pw', 'y'])
+        self.assertEqual(data_file.column('password'), 1)
+        self.assertRaises(ValueError, data_file.column, 'email')
+
+
+    def test_data_file(self):
+        """DataFile indexes the rows of a CSV file, skipping blank lines.
+        """
+        data_file = data.DataFile(users_csv)
+        try:
+            self.check_data_file(data_file)
+        finally:
+            data_file.close()
+
+
+    def test_data_file_unmapped(self):
+        """DataFile reads rows from the file when mmap is not available.
+        """
+        original_mmap = data.mmap
+        data.mmap = None
+        try:
+            data_file = data.DataFile(users_csv)
+        finally:
+            data.mmap = original_mmap
+        try:
+            self.assertEqual(data_file._map, None)
+            self.check_data_file(data_file)
+        finally:
+            data_file.close()
+
+
+    def test_get_data_file(self):
+        """get_data_file opens each file once per process.
+        """
+        data_file = data.get_data_file(users_csv)
+        self.assertTrue(data.get_data_file(users_csv) is data_file)
+        self.assertFalse(data.get_data_file(users_csv, ';') is data_file)
+
+
+class TestValue (unittest.TestCase):
+    def test_same_row(self):
+        """Columns come from the same row until one is read again.
+        """
+        user = FakeUser()
+        first = data.value(user, users_csv, 'username', 'random')
+        password = data.value(user, users_csv, 'password', 'random')
+        row = data.get_data_file(users_csv).row(
+            ['phil', 'sarah', 'bob', 'ann'].index(first))
+        self.assertEqual(password, row[1])
+        # Reading username again takes a new row
+        data.value(user, users_csv, 'username', 'random')
+        self.assertEqual(user.data_rows[users_csv][1], {'username': True})
+
+
+    def test_sequential(self):
+        """Sequential mode shares a counter, and starts over at the end.
+        """
+        users = [FakeUser(), FakeUser()]
+        data.get_data_file(users_csv)._next = 0
+        names = []
+        for index in range(5):
+            names.append(data.value(users[index % 2], users_csv, 'username'))
+        self.assertEqual(names, ['phil', 'sarah', 'bob', 'ann', 'phil'])
+
+
+    def test_unique(self):
+        """Unique mode gives each worker its own rows, until they run out.
+        """
+        self.assertEqual(data.partition(4, 0, 3), (0, 1))
+        self.assertEqual(data.partition(4, 1, 3), (1, 2))
+        self.assertEqual(data.partition(4, 2, 3), (2, 4))
+        first, second = FakeUser(0, 2), FakeUser(1, 2)
+        self.assertEqual(data.value(first, users_csv, 'username', 'unique'), 'phil')
+        self.assertEqual(data.value(second, users_csv, 'username', 'unique'), 'bob')
+        self.assertEqual(data.value(first, users_csv, 'username', 'unique'), 'sarah')
+        self.assertEqual(data.value(second, users_csv, 'username', 'unique'), 'ann')
+        self.assertRaises(data.DataExhausted,
+                          data.value, first, users_csv, 'username', 'unique')
+
+
+    def test_errors(self):
+        """Unknown modes and columns raise ValueError.
+        """
+        user = FakeUser()
+        self.assertRaises(ValueError, data.value, user, users_csv, 'username', 'all')
+        self.assertRaises(ValueError, data.value, user, users_csv, 'email')
+
+
+    def test_worker(self):
+        """Runners are numbered by the webtest.agent property when not started
+        by the console.
+        """
+        properties = {'webtest.agent': 1, 'webtest.agents': 2}
+        original_get_int = stub.Properties.getInt
+        stub.Properties.getInt = lambda self, name, default: \
+            properties.get(name, default)
+        try:
+            tr = runner.get_test_runner([])()
+            self.assertEqual(tr.worker(), (1, 2))
+        finally:
+            stub.Properties.getInt = original_get_int
+
+
+    def test_macro(self):
+        """The data macro sets variables from the runner's current row.
+        """
+        tr = runner.get_test_runner([])()
+        self.assertEqual(tr.worker(), (0, 1))
+        username = tr.eval_expressions('{USERNAME = data(%s, username, unique)}' %
+                                       users_csv)
+        password = tr.eval_expressions('{PASSWORD = data(%s, password, unique)}' %
+                                       users_csv)
+        self.assertEqual((username, password), ('phil', 'secret'))
+        self.assertEqual(tr.variables['USERNAME'], 'phil')
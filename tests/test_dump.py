@@ -0,0 +1,133 @@
+# test_dump.py
+
+"""Unit tests for the `webtest.dump` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from . import data_dir
+from webtest import dump
+from webtest import parser
+from webtest import runner
+from webtest import stub
+
+class TestFailureDumper (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.temp_dir, 'failures')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_dump_and_deduplicate(self):
+        """Bodies are saved once per distinct hash.
+        """
+        dumper = dump.FailureDumper(self.directory)
+        message = dumper.dump('Server Error', 'first')
+        self.assertTrue(message.startswith('Response body saved to '))
+        filename = message.split(' to ')[1]
+        self.assertEqual(open(filename).read(), 'first\n\nServer Error')
+        self.assertEqual(dumper.dump('Server Error', 'second'),
+                         'Response body same as %s' % filename)
+        # Another dumper (such as in another process) finds the same file
+        other = dump.FailureDumper(self.directory)
+        self.assertEqual(other.dump(u'Server Error'),
+                         'Response body same as %s' % filename)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+
+    def test_rate_limit(self):
+        """No more than burst files are written at once.
+        """
+        dumper = dump.FailureDumper(self.directory, rate=0.001, burst=2)
+        messages = [dumper.dump('Error %d' % number) for number in range(4)]
+        self.assertEqual(messages[2],
+                         'Response body not saved (rate limit reached)')
+        self.assertEqual(dumper.suppressed, 2)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+    def test_size_limit(self):
+        """No more than max_bytes are written in total.
+        """
+        dumper = dump.FailureDumper(self.directory, max_bytes=30)
+        dumper.dump('x' * 20)
+        self.assertEqual(dumper.dump('y' * 20),
+                         'Response body not saved (size limit reached)')
+        self.assertEqual(dumper.bytes_written, 22)
+
+
+    def test_saved_limit(self):
+        """The saved filenames are forgotten when there are too many, and
+        bodies saved earlier are then found on disk.
+        """
+        max_saved = dump._MAX_SAVED
+        dump._MAX_SAVED = 2
+        try:
+            dumper = dump.FailureDumper(self.directory)
+            saved = [dumper.dump('Error %d' % number) for number in range(3)]
+            self.assertEqual(len(dumper._saved), 1)
+            filename = saved[0].split(' to ')[1]
+            self.assertEqual(dumper.dump('Error 0'),
+                             'Response body same as %s' % filename)
+            self.assertEqual(len(os.listdir(self.directory)), 3)
+        finally:
+            dump._MAX_SAVED = max_saved
+
+
+    def test_write_error(self):
+        """A body that could not be written is reported, not remembered, and
+        its size does not count towards max_bytes.
+        """
+        dumper = dump.FailureDumper(self.directory)
+        # A file where the directory should be
+        open(self.directory, 'w').close()
+        message = dumper.dump('Server Error')
+        self.assertTrue(message.startswith('Response body not saved ('))
+        self.assertEqual(dumper._saved, {})
+        self.assertEqual(dumper.bytes_written, 0)
+        self.assertEqual(dumper.suppressed, 1)
+
+
+    def test_runner_failure_dump(self):
+        """eval_capture logs a reference to the saved body.
+        """
+        webtest_file = os.path.join(data_dir, 'captures.webtest')
+        dumper = dump.FailureDumper(self.directory)
+        tr = runner.get_test_runner([runner.TestSet(webtest_file)],
+                                    failure_dumper=dumper)()
+        request = parser.Webtest(webtest_file).requests[1]
+        response = stub.Response('<NOT_SID>314159265</NOT_SID>')
+
+        logged = []
+        original_log = runner.log
+        runner.log = logged.append
+        try:
+            self.assertRaises(runner.CaptureFailed,
+                              tr.eval_capture, request, response)
+        finally:
+            runner.log = original_log
+        self.assertTrue(logged[-1].startswith('!!!!!! Response body saved to'))
+        self.assertFalse(response.getText() in logged)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        # The capture still fails if the body can't be saved
+        shutil.rmtree(self.directory)
+        open(self.directory, 'w').close()
+        runner.WebtestRunner.failure_dumper = dump.FailureDumper(self.directory)
+        logged = []
+        runner.log = logged.append
+        try:
+            self.assertRaises(runner.CaptureFailed,
+                              tr.eval_capture, request, response)
+        finally:
+            runner.log = original_log
+            runner.WebtestRunner.failure_dumper = None
+        self.assertTrue(logged[-1].startswith('!!!!!! Response body not saved ('))
+        # Invalid failure_dumper
+        self.assertRaises(ValueError, runner.get_test_runner, [],
+                          failure_dumper='blah')
+
@@ -0,0 +1,428 @@
+# test_engine.py
+
+"""Unit tests for the `webtest.engine` module.
+"""
+
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import unittest
+from . import data_dir
+from webtest import engine
+from webtest import histogram
+from webtest import parser
+from webtest import record
+from webtest import runner
+from webtest import session
+from webtest import timeline
+
+class Handler (BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves a login form, a login, a chunked response, a malformed chunked
+    response, and 404s.
+    """
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.client_address)
+
+    def send(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/login':
+            self.send(200, '<input name="token" value="T123">',
+                      [('Set-Cookie', 'session=abc; Path=/')])
+        elif self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in ('hello ', 'world'):
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+        elif self.path == '/bad-chunk':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write('zz\r\nhello\r\n0\r\n\r\n')
+        else:
+            self.send(404, 'Not found')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts.append((self.headers.get('Cookie'), body))
+        if self.headers.get('Cookie') == 'session=abc' and 'token=T123' in body:
+            self.send(200, 'Welcome')
+        else:
+            self.send(403, 'Forbidden')
+
+    def log_message(self, *args):
+        pass
+
+
+class Server (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestEngine (unittest.TestCase):
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.connections = []
+        self.server.posts = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.webtest_file = os.path.join(data_dir, 'engine.webtest')
+        self.variables = {
+            'SERVER': '127.0.0.1:%d' % self.server.server_address[1],
+            'USERNAME': 'wapcaplet',
+        }
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_run(self):
+        """Engine runs all users' iterations, with captures, cookies,
+        transactions and keep-alive connections.
+        """
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=1, scenario_think_time=1, variables=self.variables)
+        eng = engine.Engine(test_runner, users=5, iterations=3)
+        eng.run()
+        self.assertEqual(eng.finished, 15)
+        self.assertEqual(eng.aborted, 0)
+        # Each user logged in with its own cookie and captured token
+        self.assertEqual(len(self.server.posts), 15)
+        for cookie, body in self.server.posts:
+            self.assertEqual(cookie, 'session=abc')
+            self.assertEqual(body, 'token=T123&username=wapcaplet')
+        # One connection per user
+        self.assertEqual(len(self.server.connections), 5)
+
+        steps = runner.WebtestRunner.webtest_steps[self.webtest_file]
+        load, login, missing = steps
+        self.assertEqual(eng.stats[load[0].getNumber()].count, 15)
+        self.assertEqual(eng.stats[load[0].getNumber()].errors, 0)
+        self.assertEqual(eng.stats[login.test.getNumber()].count, 15)
+        self.assertEqual(eng.stats[login.test.getNumber()].errors, 0)
+        self.assertTrue(eng.stats[login.test.getNumber()].transaction)
+        self.assertEqual(eng.stats[missing[0].getNumber()].errors, 15)
+        summary = eng.summary()
+        self.assertTrue(summary.startswith('60 requests, 15 errors, 900 bytes'))
+        self.assertTrue('15 iterations by 5 users, 0 stopped' in summary)
+
+
+    def test_discard_bodies(self):
+        """With discard_bodies=True, bodies without captures are counted, but
+        not kept.
+        """
+        responses = []
+        original_read_response = engine.Connection.read_response
+        def read_response(connection, method, discard=False):
+            response = yield original_read_response(connection, method, discard)
+            responses.append((response.getData(), response.length))
+            yield engine.Return(response)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=0, scenario_think_time=0, variables=self.variables,
+            discard_bodies=True)
+        engine.Connection.read_response = read_response
+        try:
+            eng = engine.Engine(test_runner, users=1, iterations=2)
+            eng.run()
+        finally:
+            engine.Connection.read_response = original_read_response
+            runner.WebtestRunner.discard_bodies = False
+        self.assertEqual(eng.aborted, 0)
+        # Login form, welcome, chunked greeting, not found
+        self.assertEqual(responses[:4], [
+            ('<input name="token" value="T123">', 33), (None, 7),
+            ('hello world', 11), (None, 9)])
+        self.assertEqual(responses[4:], responses[:4])
+        missing = runner.WebtestRunner.webtest_steps[self.webtest_file][2]
+        self.assertEqual(eng.stats[missing[0].getNumber()].bytes, 18)
+        self.assertTrue('120 bytes received' in eng.summary())
+
+
+    def test_failures(self):
+        """Failed captures and connection errors stop the iteration.
+        """
+        # Capture fails when the login form is missing
+        self.variables['SERVER'] += '/nowhere'
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=0, scenario_think_time=0, variables=self.variables)
+        eng = engine.Engine(test_runner, users=2, iterations=2)
+        eng.run()
+        self.assertEqual(eng.aborted, 4)
+        self.assertEqual(len(eng.stats), 1)
+        self.assertEqual(eng.stats.values()[0].errors, 4)
+        self.assertEqual(self.server.posts, [])
+
+        # Nothing is listening on the port
+        self.tearDown()
+        self.variables['SERVER'] = self.variables['SERVER'].split('/')[0]
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            variables=self.variables)
+        eng = engine.Engine(test_runner, users=2, iterations=1, timeout=5)
+        eng.run()
+        self.assertEqual(eng.aborted, 2)
+        self.assertEqual(eng.stats.values()[0].errors, 2)
+        self.setUp()
+
+
+    def test_duration(self):
+        """With a duration, users stop starting iterations when it's over.
+        """
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=0, scenario_think_time=50, variables=self.variables)
+        eng = engine.Engine(test_runner, users=2, iterations=None,
+                            duration=0.2, ramp_up=0.1)
+        eng.run()
+        self.assertTrue(eng.finished >= 2)
+        self.assertTrue(eng.elapsed < 5)
+        self.assertRaises(ValueError, engine.Engine, test_runner, users=0)
+        self.assertRaises(ValueError, engine.Engine, test_runner,
+                          iterations=None)
+
+
+    def test_run_processes(self):
+        """run_processes splits users between processes, and merges their
+        statistics.
+        """
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=0, scenario_think_time=0, variables=self.variables)
+        eng = engine.run_processes(test_runner, processes=2, users=5,
+                                   iterations=2)
+        self.assertEqual(eng.users, 5)
+        self.assertEqual(eng.finished, 10)
+        self.assertEqual(len(self.server.posts), 10)
+        # One connection per user, in whichever process
+        self.assertEqual(len(self.server.connections), 5)
+        load = runner.WebtestRunner.webtest_steps[self.webtest_file][0]
+        self.assertEqual(eng.stats[load[0].getNumber()].count, 10)
+        self.assertEqual(eng.stats[load[0].getNumber()].times.total, 10)
+        self.assertTrue(eng.summary().startswith('40 requests, 10 errors'))
+
+
+    def test_run_processes_files(self):
+        """run_processes merges histograms into one file, and gives each
+        process its own recorder file.
+        """
+        temp_dir = tempfile.mkdtemp()
+        hist_file = os.path.join(temp_dir, 'latency.hist')
+        rec_file = os.path.join(temp_dir, 'responses.rec')
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=0, scenario_think_time=0, variables=self.variables,
+            histograms=histogram.HistogramRecorder(hist_file),
+            recorder=record.Recorder(rec_file))
+        try:
+            engine.run_processes(test_runner, processes=2, users=4,
+                                 iterations=1)
+            filenames = os.listdir(temp_dir)
+            filenames.sort()
+            histograms = histogram.read_file(hist_file)
+            records = len(record.RecordReader(
+                os.path.join(temp_dir, 'responses-0.rec')))
+            records += len(record.RecordReader(
+                os.path.join(temp_dir, 'responses-1.rec')))
+        finally:
+            runner.WebtestRunner.histograms = None
+            runner.WebtestRunner.recorder = None
+            shutil.rmtree(temp_dir)
+        self.assertEqual(filenames, ['latency.hist', 'responses-0.rec',
+            'responses-0.rec.idx', 'responses-1.rec', 'responses-1.rec.idx'])
+        load = runner.WebtestRunner.webtest_steps[self.webtest_file][0]
+        self.assertEqual(histograms[(load[0].getNumber(), 'service')].total, 4)
+        # Four requests by each of four users
+        self.assertEqual(records, 16)
+
+
+    def test_run_processes_dead_worker(self):
+        """run_processes reports a worker that dies without results, instead
+        of waiting for it forever.
+        """
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=0, scenario_think_time=0, variables=self.variables)
+        original_run = engine.Engine.run
+        def run(self):
+            if self.first_user == 0:
+                os._exit(3)
+            original_run(self)
+        poll_interval = engine._POLL_INTERVAL
+        engine.Engine.run = run
+        engine._POLL_INTERVAL = 0.1
+        try:
+            try:
+                engine.run_processes(test_runner, processes=2, users=2,
+                                     iterations=1)
+            except RuntimeError, error:
+                message = str(error)
+            else:
+                self.fail("RuntimeError not raised")
+        finally:
+            engine.Engine.run = original_run
+            engine._POLL_INTERVAL = poll_interval
+        self.assertTrue(message.startswith("1 of 2 worker processes failed"))
+        self.assertTrue("Worker process 0 exited with code 3" in message)
+
+
+    def test_session_pool(self):
+        """Users share sessions from a pool, logging in only to create or
+        refresh them.
+        """
+        pool = session.SessionPool(size=2, max_uses=2)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(os.path.join(data_dir, 'session.webtest'))],
+            before_set=runner.TestSet(self.webtest_file), session_pool=pool,
+            verbosity='error', think_time=0, scenario_think_time=0,
+            variables=self.variables)
+        try:
+            # A single user always gets the same session back, so it logs in
+            # again exactly every max_uses iterations
+            eng = engine.Engine(test_runner, users=1, iterations=6)
+            eng.run()
+            self.assertEqual(eng.finished, 6)
+            self.assertEqual(pool.logins, 3)
+            self.assertEqual(pool.sessions, 1)
+
+            # With several users, which session each one gets depends on how
+            # they interleave, and the last login of each session may be used
+            # fewer than max_uses times; but there are never fewer logins than
+            # if every login was used max_uses times
+            pool = session.SessionPool(size=2, max_uses=2)
+            runner.WebtestRunner.session_pool = pool
+            self.server.posts = []
+            eng = engine.Engine(test_runner, users=4, iterations=3)
+            eng.run()
+        finally:
+            runner.WebtestRunner.session_pool = None
+        self.assertEqual(eng.finished, 12)
+        self.assertEqual(eng.aborted, 0)
+        self.assertTrue(pool.logins >= 6)
+        self.assertEqual(pool.sessions, 2)
+        # Iterations post with the session's cookie and token
+        sessions = [body for cookie, body in self.server.posts
+                    if body == 'token=T123']
+        self.assertEqual(len(sessions), 12)
+
+
+    def test_fetch_error(self):
+        """A connection is closed after a malformed response, so the next
+        request does not read the rest of it.
+        """
+        test_runner = runner.get_test_runner([], verbosity='error')
+        eng = engine.Engine(test_runner)
+        user = eng.user_class(0)
+        port = self.server.server_address[1]
+        results = []
+        def fetch(path):
+            try:
+                response = yield eng.fetch(user, 'GET', 'http', '127.0.0.1',
+                                           port, path, [], None)
+                results.append(response.getText())
+            except engine.HTTPError, error:
+                results.append(error.__class__)
+        for path in ('/bad-chunk', '/chunked'):
+            eng._tasks += 1
+            eng._call_at(0, engine.Task(fetch(path), path), None)
+            while eng._tasks:
+                eng._run_once()
+        user.close_connections()
+        self.assertEqual(results, [engine.HTTPError, 'hello world'])
+        self.assertEqual(len(self.server.connections), 2)
+
+
+    def test_prepare_headers(self):
+        """Repeated request headers are all sent, and override the defaults.
+        """
+        test_runner = runner.get_test_runner([], verbosity='error')
+        eng = engine.Engine(test_runner)
+        user = eng.user_class(0)
+        request = parser.Request({'Url': 'http://example.com/'})
+        request.headers = [('Accept', 'text/html'), ('Accept', 'text/plain'),
+                           ('user-agent', 'test')]
+        headers = eng.prepare(user, request)[5]
+        self.assertEqual(headers[:4], [
+            ('Host', 'example.com'), ('Accept', 'text/html'),
+            ('Accept', 'text/plain'), ('user-agent', 'test')])
+        names = [name.lower() for name, value in headers]
+        self.assertEqual(names.count('user-agent'), 1)
+        self.assertTrue('accept-language' in names)
+
+
+    def test_tracer(self):
+        """Each virtual user is traced as its own track.
+        """
+        temp_dir = tempfile.mkdtemp()
+        filename = os.path.join(temp_dir, 'trace.json')
+        tracer = timeline.TraceWriter(filename, sample=1.0)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(self.webtest_file)], verbosity='error',
+            think_time=1, scenario_think_time=0, variables=self.variables,
+            tracer=tracer)
+        try:
+            # Without variation, so every think time is slept
+            eng = engine.Engine(test_runner, users=3, iterations=1,
+                                sleep_variation=0)
+            eng.run()
+            tracer.flush()
+            events = eval(open(filename).read() + ']')
+        finally:
+            runner.WebtestRunner.tracer = None
+            shutil.rmtree(temp_dir)
+        names = {}
+        for event in events:
+            if event['name'] == 'thread_name':
+                names[event['tid']] = event['args']['name']
+        self.assertEqual(names, {0: 'User 0', 1: 'User 1', 2: 'User 2'})
+        for category in ('request', 'http', 'sleep'):
+            tracks = {}
+            for event in events:
+                if event.get('cat') == category:
+                    tracks[event['tid']] = True
+            self.assertEqual(sorted(tracks.keys()), [0, 1, 2])
+
+
+    def test_cookie_jar(self):
+        """CookieJar stores, matches and expires cookies.
+        """
+        jar = engine.CookieJar()
+        response = engine.Response('HTTP/1.1', 200, 'OK', [
+            ('Set-Cookie', 'a=1'),
+            ('Set-Cookie', 'b=2; Path=/app; Domain=.example.com'),
+            ('Set-Cookie', 'c=3; Max-Age=0'),
+        ], '')
+        jar.update('www.example.com', '/dir/page?x=1', response)
+        self.assertEqual(jar.header('www.example.com', '/dir/other'), 'a=1')
+        self.assertEqual(jar.header('www.example.com', '/'), None)
+        self.assertEqual(jar.header('api.example.com', '/app/x'), 'b=2')
+        self.assertEqual(jar.header('www.example.com', '/application'), None)
+        self.assertEqual(jar.header('www.example.com', '/dir/x'), 'a=1')
+        response.headers = [('set-cookie', 'a=1; Path=/dir/; '
+                             'Expires=Thu, 01 Jan 1970 00:00:00 GMT')]
+        jar.update('www.example.com', '/dir/', response)
+        self.assertEqual(jar.header('www.example.com', '/dir/x'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# test_export.py
+
+"""Unit tests for the `webtest.export` module.
+"""
+
+import os
+import socket
+import unittest
+from . import data_dir
+from webtest import export
+from webtest import runner
+from webtest import stub
+
+class TestMetricsExporter (unittest.TestCase):
+    def setUp(self):
+        # Local UDP listener, standing in for statsd or InfluxDB
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.settimeout(5)
+        self.port = self.listener.getsockname()[1]
+
+
+    def tearDown(self):
+        self.listener.close()
+
+
+    def receive_lines(self, exporter):
+        """Return all the lines received in the datagrams sent by exporter.
+        """
+        lines = []
+        for i in range(exporter.sent):
+            datagram = self.listener.recv(65536)
+            self.assertTrue(len(datagram) <= exporter.max_datagram)
+            lines.extend(datagram.split('\n'))
+        return lines
+
+
+    def test_statsd(self):
+        """Metrics are aggregated per test, and sent in statsd format.
+        """
+        exporter = export.MetricsExporter(port=self.port, interval=3600)
+        ok = stub.Response('x' * 100)
+        error = stub.Response('oops')
+        error.getStatusCode = lambda: 500
+        for microseconds in range(1000, 11000, 1000):
+            exporter.record(1001, microseconds, ok)
+        exporter.record(1002, 5000, error)
+        exporter.close()
+        lines = self.receive_lines(exporter)
+        self.assertTrue('webtest.1001.count:10|c' in lines)
+        self.assertTrue('webtest.1001.errors:0|c' in lines)
+        self.assertTrue('webtest.1001.bytes:1000|c' in lines)
+        self.assertTrue('webtest.1001.max:10.000|g' in lines)
+        self.assertTrue('webtest.1001.mean:5.500|g' in lines)
+        self.assertTrue('webtest.1002.errors:1|c' in lines)
+        names = [line.split(':')[0] for line in lines]
+        self.assertTrue('webtest.1001.p99_9' in names)
+        # Metrics are reset after each flush
+        self.assertEqual(exporter.take(), {})
+
+
+    def test_influx(self):
+        """Metrics are sent in InfluxDB line protocol.
+        """
+        exporter = export.MetricsExporter(port=self.port, protocol='influx',
+                                          prefix='load', interval=3600)
+        exporter.record(1001, 2000, stub.Response('abc'))
+        exporter.close()
+        lines = self.receive_lines(exporter)
+        self.assertEqual(len(lines), 1)
+        measurement, fields, timestamp = lines[0].split(' ')
+        self.assertEqual(measurement, 'load,test=1001')
+        self.assertTrue(fields.startswith('count=1i,errors=0i,bytes=3i,mean=2.000,'))
+        self.assertTrue(long(timestamp) > 0)
+        self.assertRaises(ValueError, export.MetricsExporter, protocol='foo')
+
+
+    def test_batch(self):
+        """Lines are batched into datagrams no larger than max_datagram.
+        """
+        exporter = export.MetricsExporter(max_datagram=20)
+        self.assertEqual(exporter.batch(['a' * 9, 'b' * 10, 'c' * 25, 'd']),
+                         ['a' * 9 + '\n' + 'b' * 10, 'c' * 25, 'd'])
+        self.assertEqual(exporter.batch([]), [])
+
+
+    def test_response_length(self):
+        """Discarded bodies are counted from the engine, or Content-Length.
+        """
+        class Response:
+            def __init__(self, data, headers):
+                self.data = data
+                self.headers = headers
+            def getData(self):
+                return self.data
+            def getHeader(self, name):
+                return self.headers.get(name)
+        self.assertEqual(export._response_length(stub.Response('abc')), 3)
+        self.assertEqual(export._response_length(Response('abcd', {})), 4)
+        self.assertEqual(export._response_length(
+            Response(None, {'Content-Length': '1234'})), 1234)
+        self.assertEqual(export._response_length(Response(None, {})), 0)
+        response = Response(None, {})
+        response.length = 99
+        self.assertEqual(export._response_length(response), 99)
+
+
+    def test_runner_export(self):
+        """WebtestRunner records every request in the exporter.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        my_vars = {
+            'SERVER': 'www.google.com',
+            'USERNAME': 'wapcaplet',
+            'PASSWORD': 'f00b4r',
+        }
+        exporter = export.MetricsExporter(port=self.port, interval=3600)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='quiet', variables=my_vars,
+            exporter=exporter)
+        try:
+            test_runner()()
+        finally:
+            runner.WebtestRunner.exporter = None
+        metrics = exporter.take()
+        exporter.close()
+        requests = runner.WebtestRunner.webtest_requests[login_file]
+        self.assertEqual(len(metrics), len(requests))
+        for test, wrapper, request in requests:
+            self.assertEqual(metrics[test.getNumber()].count, 1)
+        # Invalid exporter
+        self.assertRaises(ValueError, runner.get_test_runner, [], exporter='foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
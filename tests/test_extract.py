@@ -0,0 +1,140 @@
+# test_extract.py
+
+"""Unit tests for the `webtest.extract` module.
+"""
+
+import unittest
+from webtest import extract
+from webtest import pretty
+
+class TestJSONPath (unittest.TestCase):
+    def setUp(self):
+        self.json = '{"total": 2, "orders": [' \
+            '{"id": 17, "items": [], "note": null},' \
+            '{"id": 42, "items": [{"sku": "A-1"}], "note": "caf\\u00e9 \\"b\\""}' \
+            '], "next page": {"href": "/orders?page=2"}}'
+
+
+    def test_json_path(self):
+        """json_path returns the value at a path.
+        """
+        self.assertEqual(extract.json_path(self.json, '$.total'), '2')
+        self.assertEqual(extract.json_path(self.json, 'total'), '2')
+        self.assertEqual(extract.json_path(self.json, '$.orders[1].id'), '42')
+        self.assertEqual(extract.json_path(self.json, '$.orders[0].note'), 'null')
+        self.assertEqual(extract.json_path(self.json, '$.orders[1].items[0].sku'),
+                         'A-1')
+        self.assertEqual(extract.json_path(self.json, '$["next page"].href'),
+                         '/orders?page=2')
+
+
+    def test_json_path_strings(self):
+        """json_path decodes escapes in strings, returning the same kind of
+        string it was given.
+        """
+        self.assertEqual(extract.json_path(self.json, '$.orders[1].note'),
+                         'caf\xc3\xa9 "b"')
+        self.assertEqual(extract.json_path(unicode(self.json), '$.orders[1].note'),
+                         u'caf\xe9 "b"')
+
+
+    def test_json_path_containers(self):
+        """json_path returns objects and arrays as compact JSON.
+        """
+        self.assertEqual(extract.json_path(self.json, '$.orders[1].items'),
+                         '[{"sku":"A-1"}]')
+        self.assertEqual(extract.json_path(self.json, '$.orders[0].items'), '[]')
+
+
+    def test_json_path_not_found(self):
+        """json_path returns None for missing members and indexes.
+        """
+        self.assertEqual(extract.json_path(self.json, '$.missing'), None)
+        self.assertEqual(extract.json_path(self.json, '$.orders[2]'), None)
+        self.assertEqual(extract.json_path(self.json, '$.total.id'), None)
+        self.assertEqual(extract.json_path(self.json, '$.orders.id'), None)
+
+
+    def test_json_path_stops(self):
+        """json_path stops reading once the value is found.
+        """
+        json = '{"id": 1, "rest": [' + '{"a": [1, 2]},' * 100000
+        self.assertEqual(extract.json_path(json, '$.id'), '1')
+        self.assertRaises(ValueError, extract.json_path, json, '$.missing')
+
+
+    def test_json_path_errors(self):
+        """json_path raises ValueError for bad paths and malformed JSON.
+        """
+        self.assertRaises(ValueError, extract.json_path, self.json, '$.orders[x]')
+        self.assertRaises(ValueError, extract.json_path, self.json, '$..id')
+        self.assertRaises(ValueError, extract.json_path, '{"a" 1}', '$.a')
+        self.assertRaises(ValueError, extract.json_path, '{"a": [1', '$.a')
+
+
+class TestXPath (unittest.TestCase):
+    def setUp(self):
+        self.xml = '<?xml version="1.0"?>\n<feed>' \
+            '<link rel="self" href="/p1"/><link rel="next" href="/p2"/>' \
+            '<entry><id>1</id><title>First</title></entry>' \
+            '<entry><id>2</id><title>Second <b>one</b></title></entry>' \
+            '<x:meta xmlns:x="urn:x">m</x:meta></feed>'
+
+
+    def test_xpath(self):
+        """xpath returns the text of the first matching element.
+        """
+        self.assertEqual(extract.xpath(self.xml, '/feed/entry/id'), '1')
+        self.assertEqual(extract.xpath(self.xml, '/feed/entry[2]/id'), '2')
+        self.assertEqual(extract.xpath(self.xml, '//title/text()'), 'First')
+        self.assertEqual(extract.xpath(self.xml, '//entry[2]/title'), 'Second one')
+        self.assertEqual(extract.xpath(self.xml, 'feed/*[4]/id'), '2')
+        self.assertEqual(extract.xpath(self.xml, '//x:meta'), 'm')
+
+
+    def test_xpath_attribute(self):
+        """xpath returns attribute values.
+        """
+        self.assertEqual(extract.xpath(self.xml, '/feed/link[2]/@href'), '/p2')
+        self.assertEqual(extract.xpath(self.xml, '//link/@rel'), 'self')
+        self.assertEqual(extract.xpath(self.xml, '//entry/@rel'), None)
+
+
+    def test_xpath_not_found(self):
+        """xpath returns None when nothing matches.
+        """
+        self.assertEqual(extract.xpath(self.xml, '/entry'), None)
+        self.assertEqual(extract.xpath(self.xml, '/feed/entry[3]'), None)
+        self.assertEqual(extract.xpath(self.xml, '//id/title'), None)
+
+
+    def test_xpath_stops(self):
+        """xpath stops parsing once the value is found.
+        """
+        xml = '<a><b>found</b>' + '<c>text</c>' * 100000
+        self.assertEqual(extract.xpath(xml, '/a/b'), 'found')
+        self.assertRaises(ValueError, extract.xpath, xml, '/a/d')
+
+
+    def test_xpath_unicode(self):
+        """xpath encodes unicode text a chunk at a time, without splitting
+        characters between chunks.
+        """
+        chunk_size = pretty._CHUNK_SIZE
+        # On narrow unicode builds, the first chunk ends between the halves
+        # of the emoji's surrogate pair
+        pretty._CHUNK_SIZE = 7
+        try:
+            xml = u'<a><b>\U0001f600 caf\xe9</b></a>'
+            self.assertEqual(extract.xpath(xml, '/a/b'), u'\U0001f600 caf\xe9')
+        finally:
+            pretty._CHUNK_SIZE = chunk_size
+
+
+    def test_xpath_errors(self):
+        """xpath raises ValueError for bad paths and malformed XML.
+        """
+        self.assertRaises(ValueError, extract.xpath, self.xml, '//@href')
+        self.assertRaises(ValueError, extract.xpath, self.xml, '//a/@href/b')
+        self.assertRaises(ValueError, extract.xpath, self.xml, '//a[x]')
+        self.assertRaises(ValueError, extract.xpath, '<a><b></a>', '//c')
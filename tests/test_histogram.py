@@ -0,0 +1,201 @@
+# test_histogram.py
+
+"""Unit tests for the `webtest.histogram` module.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from . import data_dir
+from webtest import histogram
+from webtest import runner
+from webtest import stub
+
+class TestHistogram (unittest.TestCase):
+    def test_percentiles(self):
+        """Histogram percentiles are accurate to the given precision.
+        """
+        hist = histogram.Histogram(significant_digits=2)
+        for value in range(1, 100001):
+            hist.record(value)
+        self.assertEqual(hist.total, 100000)
+        self.assertEqual(hist.min, 1)
+        self.assertEqual(hist.max, 100000)
+        self.assertAlmostEqual(hist.mean(), 50000.5)
+        for percent in (50, 90, 99, 99.9):
+            expected = 1000 * percent
+            actual = hist.percentile(percent)
+            self.assertTrue(abs(actual - expected) <= expected / 100.0,
+                            (percent, actual))
+        self.assertEqual(hist.percentile(100), 100000)
+        # Small values are exact
+        small = histogram.Histogram()
+        for value in (3, 3, 7):
+            small.record(value)
+        self.assertEqual(small.percentile(50), 3)
+        self.assertEqual(small.percentile(100), 7)
+        self.assertEqual(histogram.Histogram().percentile(99), 0)
+
+
+    def test_record_corrected(self):
+        """record_corrected back-fills values longer than the interval.
+        """
+        hist = histogram.Histogram()
+        hist.record_corrected(1000, 300)
+        self.assertEqual(hist.total, 3)
+        self.assertEqual((hist.min, hist.max), (400, 1000))
+        hist.record_corrected(200, 300)
+        self.assertEqual(hist.total, 4)
+
+
+    def test_merge_and_encode(self):
+        """Histograms can be merged, encoded and decoded.
+        """
+        first = histogram.Histogram()
+        second = histogram.Histogram()
+        for value in range(1000):
+            first.record(random.randint(0, 10000000))
+            second.record(random.randint(0, 10000000))
+        merged = first.copy()
+        merged.merge(second)
+        self.assertEqual(merged.total, 2000)
+        self.assertEqual(merged.max, max(first.max, second.max))
+
+        decoded, offset = histogram.Histogram.decode(merged.encode())
+        self.assertEqual(offset, len(merged.encode()))
+        self.assertEqual(decoded.counts, merged.counts)
+        self.assertEqual((decoded.total, decoded.min, decoded.max),
+                         (merged.total, merged.min, merged.max))
+        self.assertEqual(decoded.percentile(99), merged.percentile(99))
+
+        self.assertRaises(ValueError, first.merge,
+                          histogram.Histogram(significant_digits=3))
+
+
+class TestHistogramRecorder (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_threads_and_files(self):
+        """Per-thread histograms are merged, written and read back.
+        """
+        filenames = []
+        for process in range(2):
+            filename = os.path.join(self.temp_dir, '%d.hist' % process)
+            filenames.append(filename)
+            recorder = histogram.HistogramRecorder(filename)
+            def record():
+                for value in range(100):
+                    recorder.record(1001, value)
+                    recorder.record(1002, value * 10)
+            threads = [threading.Thread(target=record) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            recorder.close()
+
+        from_file = histogram.read_file(filenames[0])
+        self.assertEqual(from_file[(1001, 'service')].total, 400)
+        merged = histogram.merge_files(filenames)
+        self.assertEqual(merged[(1002, 'service')].total, 800)
+        self.assertEqual(merged[(1002, 'service')].max, 990)
+        table = histogram.format_table(merged)
+        self.assertTrue(table.startswith('Test'))
+        self.assertEqual(len(table.splitlines()), 3)
+
+        self.assertRaises(histogram.BadHistogramFile, histogram.read_file,
+                          os.path.join(data_dir, 'login.webtest'))
+
+
+    def test_thread_finished(self):
+        """Histograms are written once, when the last thread finishes, and
+        concurrent writes do not collide.
+        """
+        filename = os.path.join(self.temp_dir, 'latency.hist')
+        recorder = histogram.HistogramRecorder(filename)
+        writes = []
+        original_write_file = histogram.write_file
+        def write_file(filename, histograms):
+            writes.append(filename)
+            original_write_file(filename, histograms)
+        # Keep all threads alive until they have all recorded, so that their
+        # identifiers are distinct
+        ready = []
+        go = threading.Event()
+        def run():
+            recorder.record(1001, 10)
+            ready.append(True)
+            go.wait()
+            recorder.write()
+            recorder.thread_finished()
+        histogram.write_file = write_file
+        try:
+            threads = [threading.Thread(target=run) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            while len(ready) < 8:
+                time.sleep(0.001)
+            go.set()
+            for thread in threads:
+                thread.join()
+            # Eight explicit writes, and one when the last thread finished
+            self.assertEqual(len(writes), 9)
+            # Threads that never recorded anything don't count
+            recorder.thread_finished()
+            self.assertEqual(len(writes), 9)
+            recorder.close()
+        finally:
+            histogram.write_file = original_write_file
+        self.assertEqual(os.listdir(self.temp_dir), ['latency.hist'])
+        self.assertEqual(histogram.read_file(filename)[(1001, 'service')].total, 8)
+
+
+    def test_runner_histograms(self):
+        """WebtestRunner records request latencies when given histograms.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        recorder = histogram.HistogramRecorder()
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)],
+            variables={'SERVER': 'example.com', 'USERNAME': 'x', 'PASSWORD': 'y'},
+            histograms=recorder)
+        test_runner()()
+        merged = recorder.merged()
+        self.assertEqual(len(merged), 3)
+        for hist in merged.values():
+            self.assertEqual(hist.total, 1)
+        # Invalid histograms
+        self.assertRaises(ValueError, runner.get_test_runner, [],
+                          histograms='blah')
+
+
+    def test_runner_pacing(self):
+        """When pacing, response times are measured from the schedule.
+        """
+        recorder = histogram.HistogramRecorder()
+        tr = runner.get_test_runner([], pacing=100, histograms=recorder)()
+        test = stub.Test(1001, 'Test')
+        ms = 1000000
+        # On time: response and service times are the same
+        tr._schedule(test, 0, 50 * ms)
+        self.assertEqual(tr.next_start, 100 * ms)
+        # Started 20ms late, and took 350ms; the scheduled starts at 200,
+        # 300 and 400ms were missed, and 270 and 170ms are back-filled
+        tr._schedule(test, 120 * ms, 470 * ms)
+        self.assertEqual(tr.next_start, 500 * ms)
+        response = recorder.merged()[(1001, 'response')]
+        self.assertEqual(response.total, 4)
+        self.assertEqual(response.max, 370000)
+        self.assertEqual(response.min, 50000)
+        # Invalid pacing
+        self.assertRaises(ValueError, runner.get_test_runner, [], pacing=0)
+
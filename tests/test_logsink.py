@@ -0,0 +1,100 @@
+# test_logsink.py
+
+"""Unit tests for the `webtest.logsink` module.
+"""
+
+import os
+import unittest
+from . import data_dir
+from webtest import logsink
+from webtest import runner
+
+class TestRingBuffer (unittest.TestCase):
+    def test_put_and_take(self):
+        """RingBuffer returns items in order, overwriting the oldest items
+        when full, and counts overwritten items.
+        """
+        buffer = logsink.RingBuffer(3)
+        for item in 'abc':
+            self.assertTrue(buffer.put(item))
+        self.assertFalse(buffer.put('d'))
+        self.assertFalse(buffer.put('e'))
+        self.assertEqual(buffer.take_all(), (['c', 'd', 'e'], 2))
+        self.assertEqual(buffer.take_all(), ([], 0))
+        buffer.put('f')
+        self.assertEqual(buffer.take_all(), (['f'], 0))
+
+
+class TestLogSink (unittest.TestCase):
+    def test_flush(self):
+        """LogSink formats buffered messages and writes them in batches.
+        """
+        batches = []
+        sink = logsink.LogSink(output=batches.append, buffer_size=10,
+                               interval=60, batch_size=2)
+        sink.write("plain")
+        sink.write("%s = %d", ('answer', 42))
+        sink.write("100%")
+        sink.flush()
+        self.assertEqual(batches, ["plain\nanswer = 42", "100%"])
+        sink.close()
+
+
+    def test_dropped(self):
+        """LogSink counts and reports dropped messages.
+        """
+        lines = []
+        sink = logsink.LogSink(output=lines.append, buffer_size=2,
+                               interval=60, batch_size=1)
+        for number in range(5):
+            sink.write("line %d", (number,))
+        sink.close()
+        self.assertEqual(sink.dropped, 3)
+        self.assertEqual(lines,
+            ["LogSink: 3 messages dropped", "line 3", "line 4"])
+
+
+    def test_error(self):
+        """LogSink writes error messages immediately, after the messages
+        already buffered by the same thread, and never drops them.
+        """
+        batches = []
+        sink = logsink.LogSink(output=batches.append, buffer_size=2,
+                               interval=60)
+        sink.write("line 1")
+        sink.write("line 2")
+        sink.write("!!!!!! %s", ('failed',), error=True)
+        self.assertEqual(batches, ["line 1\nline 2\n!!!!!! failed"])
+        for number in range(10):
+            sink.write("!!!!!! error %d", (number,), error=True)
+        self.assertEqual(len(batches), 11)
+        self.assertEqual(batches[-1], "!!!!!! error 9")
+        self.assertEqual(sink.dropped, 0)
+        sink.flush()
+        self.assertEqual(len(batches), 11)
+        sink.close()
+
+
+    def test_runner_log_sink(self):
+        """WebtestRunner logs through a LogSink when given one.
+        """
+        lines = []
+        sink = logsink.LogSink(output=lines.append, interval=60)
+        login_file = os.path.join(data_dir, 'login.webtest')
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='info',
+            variables={'SERVER': 'example.com', 'USERNAME': 'x', 'PASSWORD': 'y'},
+            log_sink=sink)
+        try:
+            test_runner()()
+            sink.flush()
+        finally:
+            runner.WebtestRunner.log_sink = None
+        output = '\n'.join(lines)
+        self.assertTrue("==== Executing: %s" % login_file in output)
+        self.assertTrue("SERVER => 'example.com'" in output)
+        sink.close()
+        # Invalid log_sink
+        self.assertRaises(ValueError, runner.get_test_runner, [],
+                          log_sink='blah')
+
@@ -108,6 +108,33 @@ class TestParser (unittest.TestCase):
         ])
 
 
+    def test_transactions(self):
+        """Requests inside a TransactionTimer are part of a transaction.
+        """
+        webtest_file = os.path.join(data_dir, 'transactions.webtest')
+        w = parser.Webtest(webtest_file)
+        self.assertEqual([request.transaction for request in w.requests],
+                         [u'Home page', u'Home page', None, u'Account page'])
+
+
+    def test_think_times(self):
+        """Requests get their recorded pauses from ThinkTime attributes, or
+        from a timing file.
+        """
+        w = parser.Webtest(os.path.join(data_dir, 'think_times.webtest'))
+        self.assertEqual([request.think_time for request in w.requests],
+                         [2000, 0, 500, None])
+        # The timing file overrides ThinkTime attributes
+        w = parser.Webtest(os.path.join(data_dir, 'timed.webtest'))
+        self.assertEqual([round(request.think_time) for request in
+                          w.requests[:2]], [1500, 0])
+        self.assertEqual(w.requests[2].think_time, None)
+        # Timing files must have a time for each request
+        w = parser.Webtest(os.path.join(data_dir, 'think_times.webtest'))
+        self.assertRaises(ValueError, w.load_timing,
+                          os.path.join(data_dir, 'timed.timing'))
+
+
     def test_malformed(self):
         """Test the `Webtest` class with malformed .webtest files.
         """
@@ -0,0 +1,136 @@
+# test_phases.py
+
+"""Unit tests for the `webtest.phases` module.
+"""
+
+import os
+import threading
+import unittest
+from . import data_dir
+from webtest import phases
+from webtest import runner
+
+class TestPhaseTimer (unittest.TestCase):
+    def test_counters(self):
+        """PhaseTimer keeps separate counters for each thread and test.
+        """
+        timer = phases.PhaseTimer(output=lambda message: None)
+        first = timer.counters(1001)
+        self.assertEqual(first, [0] * (len(phases.PHASES) + 1))
+        self.assertTrue(timer.counters(1001) is first)
+        self.assertFalse(timer.counters(1002) is first)
+        first[phases.HTTP] += 3000000
+        first[phases.CAPTURE] += 1000000
+        first[phases.COUNT] += 2
+
+        def other_thread():
+            counters = timer.counters(1001)
+            counters[phases.HTTP] += 1000000
+            counters[phases.COUNT] += 1
+        thread = threading.Thread(target=other_thread, name='other')
+        thread.start()
+        thread.join()
+
+        by_test, by_thread = timer.totals()
+        self.assertEqual(by_test[1001][phases.COUNT], 3)
+        self.assertEqual(by_test[1001][phases.HTTP], 4000000)
+        self.assertEqual(by_thread['other'][phases.COUNT], 1)
+
+
+    def test_duplicate_thread_names(self):
+        """Threads with the same name are added together in one row.
+        """
+        timer = phases.PhaseTimer(output=lambda message: None)
+        def count():
+            counters = timer.counters(1001)
+            counters[phases.HTTP] += 1000000
+            counters[phases.COUNT] += 1
+        threads = [threading.Thread(target=count, name='TestRunner')
+                   for number in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        by_test, by_thread = timer.totals()
+        self.assertEqual(by_test[1001][phases.COUNT], 3)
+        self.assertEqual(by_thread.keys(), ['TestRunner'])
+        self.assertEqual(by_thread['TestRunner'][phases.COUNT], 3)
+        self.assertEqual(by_thread['TestRunner'][phases.HTTP], 3000000)
+
+
+    def test_lap(self):
+        """lap adds the elapsed time to a phase counter.
+        """
+        counters = [0] * (len(phases.PHASES) + 1)
+        mark = phases.clock.nanotime() - 5000
+        now = phases.lap(counters, phases.NVPAIRS, mark)
+        self.assertEqual(counters[phases.NVPAIRS], now - mark)
+        self.assertTrue(counters[phases.NVPAIRS] >= 5000)
+
+
+    def test_format_table(self):
+        """format_table has a row per test, a total, and a row per thread.
+        """
+        timer = phases.PhaseTimer()
+        counters = timer.counters(1001)
+        counters[phases.HTTP] = 9000000
+        counters[phases.EXPRESSIONS] = 1000000
+        counters[phases.COUNT] = 4
+        lines = timer.format_table().split('\n')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[0].split(),
+                         ['Test', 'Count'] + list(phases.PHASES) + ['overhead'])
+        self.assertEqual(lines[1].split(),
+                         ['1001', '4', '0.0', '1.0', '0.0', '9.0', '0.0', '0.0',
+                          '10.0%'])
+        self.assertEqual(lines[2].split()[:2], ['Total', '4'])
+        self.assertEqual(lines[4].split()[0], 'Thread')
+
+
+    def test_report_once(self):
+        """The report is written once, when all threads have finished.
+        """
+        output = []
+        timer = phases.PhaseTimer(output=output.append)
+        timer.counters(1001)
+        timer.thread_finished()
+        timer.thread_finished()
+        timer.report()
+        self.assertEqual(len(output), 1)
+        self.assertTrue(output[0].startswith('Time spent in each phase'))
+
+
+    def test_runner_phases(self):
+        """WebtestRunner times each phase of execute() when given a PhaseTimer.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        my_vars = {
+            'SERVER': 'www.google.com',
+            'USERNAME': 'wapcaplet',
+            'PASSWORD': 'f00b4r',
+        }
+        output = []
+        timer = phases.PhaseTimer(output=output.append)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='quiet', variables=my_vars,
+            phase_timer=timer)
+        try:
+            runner_instance = test_runner()
+            runner_instance()
+            by_test, by_thread = timer.totals()
+            requests = runner.WebtestRunner.webtest_requests[login_file]
+            self.assertEqual(len(by_test), len(requests))
+            for test, wrapper, request in requests:
+                self.assertEqual(by_test[test.getNumber()][phases.COUNT], 1)
+            del runner_instance
+            self.assertEqual(len(output), 1)
+        finally:
+            runner.WebtestRunner.phase_timer = None
+        # Invalid phase_timer
+        self.assertRaises(ValueError, runner.get_test_runner, [],
+                          phase_timer='foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
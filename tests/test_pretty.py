@@ -0,0 +1,92 @@
+# test_pretty.py
+
+"""Unit tests for the `webtest.pretty` module.
+"""
+
+import unittest
+from webtest import pretty
+
+class TestPrettyXML (unittest.TestCase):
+    def test_pretty_xml(self):
+        """pretty_xml puts each element on its own line.
+        """
+        xml = '<?xml version="1.0"?>\n<Envelope>\n\t<Body id="1">' \
+              '<SID>314159265</SID><Empty></Empty></Body></Envelope>'
+        self.assertEqual(pretty.pretty_xml(xml),
+            '<Envelope>\n'
+            '  <Body id="1">\n'
+            '    <SID>314159265</SID>\n'
+            '    <Empty/>\n'
+            '  </Body>\n'
+            '</Envelope>')
+
+
+    def test_pretty_xml_limit(self):
+        """pretty_xml stops at the limit, and adds a truncation marker.
+        """
+        xml = '<a>' + '<b>text</b>' * 100000 + '</a>'
+        result = pretty.pretty_xml(xml, limit=100)
+        output, marker = result.split('\n... ')
+        self.assertEqual(len(output), 100)
+        self.assertEqual(marker, '[truncated, %d characters total]' % len(xml))
+
+
+    def test_pretty_xml_unicode(self):
+        """pretty_xml accepts unicode text, encoding it a chunk at a time.
+        """
+        chunk_size = pretty._CHUNK_SIZE
+        pretty._CHUNK_SIZE = 5
+        try:
+            xml = u'<a><b>caf\xe9 \u20ac</b></a>'
+            self.assertEqual(pretty.pretty_xml(xml),
+                             u'<a>\n  <b>caf\xe9 \u20ac</b>\n</a>')
+            self.assertEqual(list(pretty._encoded_chunks(u'caf\xe9 \u20ac')),
+                             ['caf\xc3\xa9 ', '\xe2\x82\xac'])
+        finally:
+            pretty._CHUNK_SIZE = chunk_size
+
+
+    def test_pretty_xml_malformed(self):
+        """pretty_xml returns malformed XML unchanged.
+        """
+        self.assertEqual(pretty.pretty_xml('<a><b></a>'), '<a><b></a>')
+
+
+class TestPrettyJSON (unittest.TestCase):
+    def test_iter_json_tokens(self):
+        """iter_json_tokens splits JSON into tokens.
+        """
+        tokens = list(pretty.iter_json_tokens('{"a b": [1.5, "x\\"y"], "c": null}'))
+        self.assertEqual(tokens, [
+            ('{', '{'), ('"', '"a b"'), (':', ':'), ('[', '['),
+            (0, '1.5'), (',', ','), ('"', '"x\\"y"'), (']', ']'), (',', ','),
+            ('"', '"c"'), (':', ':'), (0, 'null'), ('}', '}'),
+        ])
+        self.assertRaises(pretty.MalformedJSON, list,
+                          pretty.iter_json_tokens('{"unterminated}'))
+
+
+    def test_pretty_json(self):
+        """pretty_json puts each value on its own line.
+        """
+        self.assertEqual(pretty.pretty_json('{"id":42,"tags":["a"],"e":{}}'),
+            '{\n'
+            '  "id": 42,\n'
+            '  "tags": [\n'
+            '    "a"\n'
+            '  ],\n'
+            '  "e": {}\n'
+            '}')
+        result = pretty.pretty_json('[' + '1,' * 10000 + '1]', limit=50)
+        self.assertTrue(result.endswith('[truncated, 20003 characters total]'))
+
+
+    def test_prettify(self):
+        """prettify chooses a pretty-printer by content type or content.
+        """
+        self.assertEqual(pretty.prettify('<a><b/></a>', 'text/xml'),
+                         '<a>\n  <b/>\n</a>')
+        self.assertEqual(pretty.prettify('[1]'), '[\n  1\n]')
+        self.assertEqual(pretty.prettify('plain text', 'text/plain', limit=5),
+                         'plain\n... [truncated, 10 characters total]')
+
@@ -0,0 +1,138 @@
+# test_profiler.py
+
+"""Unit tests for the `webtest.profiler` module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from . import data_dir
+from webtest import profiler
+from webtest import runner
+
+def inner(count):
+    total = 0
+    for i in range(count):
+        total += len(str(i))
+    return total
+
+def outer(count):
+    return inner(count) + inner(count)
+
+
+class TestProfiler (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'profile.folded')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_run(self):
+        """Profiler.run returns the result, and accumulates call stacks.
+        """
+        prof = profiler.Profiler(self.filename, sample=1.0)
+        self.assertTrue(prof.sampled())
+        self.assertEqual(prof.run(outer, 1000), 2 * inner(1000))
+        self.assertEqual(prof.profiled, 1)
+        stacks = prof.stacks.keys()
+        outer_label = profiler._frame_label(self._frame(outer))
+        outer_stacks = [key for key in stacks if key.endswith(';' + outer_label)]
+        self.assertEqual(len(outer_stacks), 1)
+        self.assertTrue(outer_stacks[0].startswith(profiler.ROOT + ';'))
+        inner_stack = outer_stacks[0] + ';' + \
+                      profiler._frame_label(self._frame(inner))
+        self.assertTrue(inner_stack in stacks)
+        # Built-in functions get their own frames
+        self.assertTrue(inner_stack + ';range' in stacks)
+        prof.write()
+        self.assertTrue(os.path.exists(self.filename))
+
+
+    def _frame(self, function):
+        """Return a fake frame object for the given function.
+        """
+        class Frame:
+            f_code = function.func_code
+        return Frame()
+
+
+    def test_write(self):
+        """Profiler.write writes collapsed stacks, with integer times.
+        """
+        prof = profiler.Profiler(self.filename)
+        prof.write()
+        self.assertFalse(os.path.exists(self.filename))
+        prof.run(outer, 100)
+        prof.run(outer, 100)
+        self.assertEqual(prof.profiled, 2)
+        prof.write()
+        lines = open(self.filename).read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, microseconds = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith(profiler.ROOT))
+            self.assertTrue(int(microseconds) > 0)
+        # Not rewritten if nothing has changed
+        os.remove(self.filename)
+        prof.write()
+        self.assertFalse(os.path.exists(self.filename))
+        # Never sampled
+        self.assertFalse(profiler.Profiler(sample=0.0).sampled())
+
+
+    def test_thread_finished(self):
+        """The file is written when the last thread that profiled an
+        iteration finishes.
+        """
+        prof = profiler.Profiler(self.filename)
+        prof.run(outer, 10)
+        def run():
+            prof.run(outer, 10)
+            prof.thread_finished()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        # Threads that never profiled anything don't count
+        finished = threading.Thread(target=prof.thread_finished)
+        finished.start()
+        finished.join()
+        self.assertFalse(os.path.exists(self.filename))
+        prof.thread_finished()
+        self.assertTrue(os.path.exists(self.filename))
+
+
+    def test_runner_profile(self):
+        """WebtestRunner profiles sampled iterations.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        my_vars = {
+            'SERVER': 'www.google.com',
+            'USERNAME': 'wapcaplet',
+            'PASSWORD': 'f00b4r',
+        }
+        prof = profiler.Profiler(self.filename, sample=1.0)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='quiet', variables=my_vars,
+            profile=prof)
+        try:
+            runner_instance = test_runner()
+            self.assertEqual(runner_instance(), True)
+            self.assertEqual(prof.profiled, 1)
+            execute = [key for key in prof.stacks.keys()
+                       if key.split(';')[-1].startswith('execute ')]
+            self.assertTrue(execute)
+            del runner_instance
+            self.assertTrue(os.path.exists(self.filename))
+        finally:
+            runner.WebtestRunner.profile = None
+        # Invalid profile
+        self.assertRaises(ValueError, runner.get_test_runner, [], profile='foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# test_record.py
+
+"""Unit tests for the `webtest.record` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from . import data_dir
+from webtest import record
+from webtest import runner
+from webtest import stub
+
+class TestRecorder (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'responses.rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_record_and_read(self):
+        """Recorded responses can be read back with a RecordReader.
+        """
+        for compress in (False, True):
+            filename = self.filename + str(compress)
+            recorder = record.Recorder(filename, compress=compress)
+            recorder.record(1001, 0, 100.0, 0.25, stub.Response('<p>one</p>'))
+            recorder.record(1002, 1, 101.0, 0.5, stub.Response(u'two'))
+            recorder.close()
+            self.assertEqual(recorder.written, 2)
+
+            reader = record.RecordReader(filename)
+            self.assertEqual(len(reader), 2)
+            first, second = list(reader)
+            self.assertEqual(first.test_number, 1001)
+            self.assertEqual(first.thread_number, 0)
+            self.assertEqual(first.start, 100.0)
+            self.assertEqual(first.elapsed, 0.25)
+            self.assertEqual(first.status, 200)
+            self.assertEqual(first.headers, [
+                ('Content-Type', 'text/plain; charset=UTF-8'),
+            ])
+            self.assertEqual(first.body, '<p>one</p>')
+            self.assertEqual(second.body, 'two')
+            self.assertEqual(reader[1].test_number, 1002)
+            reader.close()
+
+
+    def test_append_and_select(self):
+        """Archives are appended to, and records can be selected by test.
+        """
+        for test_number in (1001, 1002, 1001):
+            recorder = record.Recorder(self.filename)
+            recorder.record(test_number, 0, 0.0, 0.0, stub.Response('x'))
+            recorder.close()
+        reader = record.RecordReader(self.filename)
+        self.assertEqual(len(reader), 3)
+        selected = list(reader.select(test_number=1001))
+        self.assertEqual(len(selected), 2)
+        self.assertEqual(list(reader.select(status=404)), [])
+        reader.close()
+
+
+    def test_missing_index(self):
+        """The index is rebuilt if it is missing.
+        """
+        recorder = record.Recorder(self.filename, compress=True)
+        for test_number in range(1001, 1006):
+            recorder.record(test_number, 0, 0.0, 0.0, stub.Response('x'))
+        recorder.close()
+        os.remove(self.filename + '.idx')
+        reader = record.RecordReader(self.filename)
+        self.assertEqual([rec.test_number for rec in reader],
+                         range(1001, 1006))
+        reader.close()
+
+
+    def test_bad_archive(self):
+        """BadArchive is raised for files that are not record archives.
+        """
+        self.assertRaises(record.BadArchive, record.RecordReader,
+                          os.path.join(data_dir, 'login.webtest'))
+
+
+    def test_sampled(self):
+        """Recorder.sampled honors the sampling fraction.
+        """
+        self.assertTrue(record.Recorder(self.filename).sampled())
+        never = record.Recorder(self.filename, sample=0.0)
+        self.assertFalse(never.sampled())
+
+
+    def test_write_error(self):
+        """When writing fails, flush and close return instead of waiting, and
+        later records are dropped.
+        """
+        filename = os.path.join(self.temp_dir, 'missing', 'responses.rec')
+        recorder = record.Recorder(filename, queue_size=2, timeout=5)
+        response = stub.Response('hello')
+        for i in range(5):
+            recorder.record(1001, 0, 0, 10, response)
+        self.assertEqual(recorder.flush(), False)
+        self.assertTrue(isinstance(recorder.error, IOError))
+        self.assertEqual(recorder.record(1001, 0, 0, 10, response), False)
+        recorder.close()
+        self.assertEqual(recorder.written, 0)
+        self.assertEqual(recorder.dropped, 6)
+
+
+    def test_runner_recording(self):
+        """WebtestRunner records responses when given a Recorder.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        recorder = record.Recorder(self.filename)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)],
+            variables={'SERVER': 'example.com', 'USERNAME': 'x', 'PASSWORD': 'y'},
+            recorder=recorder)
+        test_runner()()
+        recorder.close()
+        reader = record.RecordReader(self.filename)
+        self.assertEqual(len(reader), 3)
+        reader.close()
+        # Invalid recorder
+        self.assertRaises(ValueError, runner.get_test_runner, [],
+                          recorder='blah')
+
@@ -47,6 +47,39 @@ class TestWebtestRunner (unittest.TestCase):
         self.assertEqual(test_runner.sequence, 'weighted')
         self.assertEqual(test_runner.think_time, 123)
         self.assertEqual(test_runner.scenario_think_time, 456)
+        self.assertEqual(test_runner.log_tests, True)
+        self.assertEqual(test_runner.log_info, True)
+        self.assertEqual(test_runner.log_debug, True)
+
+
+    def test_quiet_logging(self):
+        """At 'quiet' verbosity, only the prebuilt headings are logged.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        my_vars = {
+            'SERVER': 'www.google.com',
+            'USERNAME': 'wapcaplet',
+            'PASSWORD': 'f00b4r',
+        }
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='quiet', variables=my_vars)
+        self.assertEqual(test_runner.log_info, False)
+        self.assertEqual(test_runner.log_debug, False)
+
+        logged = []
+        original_log = runner.log
+        runner.log = logged.append
+        try:
+            test_runner()()
+        finally:
+            runner.log = original_log
+
+        headings = [runner.WebtestRunner.file_headings[login_file]]
+        for test, wrapper, request in \
+                runner.WebtestRunner.webtest_requests[login_file]:
+            headings.append(runner.WebtestRunner.test_headings[test.getNumber()])
+        self.assertEqual(logged, headings)
+        self.assertTrue(logged[1].startswith('------ Test'))
 
 
     def test_get_test_runner_exceptions(self):
@@ -116,6 +149,142 @@ class TestWebtestRunner (unittest.TestCase):
         self.assertEqual(stub.grinder.statistics.forLastTest.success, False)
 
 
+    def test_transactions(self):
+        """Requests in a transaction are grouped, and timed by their own test.
+        """
+        webtest_file = os.path.join(data_dir, 'transactions.webtest')
+        my_vars = {'SERVER': 'www.google.com', 'USERNAME': 'wapcaplet'}
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(webtest_file)], verbosity='quiet', variables=my_vars)
+        requests = runner.WebtestRunner.webtest_requests[webtest_file]
+        steps = runner.WebtestRunner.webtest_steps[webtest_file]
+        self.assertEqual(len(steps), 3)
+        home, login, account = steps
+        self.assertEqual(home.name, 'Home page')
+        self.assertEqual(home.requests, requests[:2])
+        self.assertEqual(login, requests[2])
+        self.assertEqual(account.requests, requests[3:])
+        # Transactions are numbered after the requests
+        last = requests[-1][0].getNumber()
+        self.assertEqual(home.test.getNumber(), last + 1)
+        self.assertEqual(account.test.getNumber(), last + 2)
+        self.assertEqual(runner.WebtestRunner.test_headings[last + 1],
+                         '------ Transaction %d: Home page' % (last + 1))
+
+        # Requests and transactions are executed in order
+        executed = []
+        original_execute = runner.WebtestRunner.execute
+        def execute(self, test, wrapper, request):
+            executed.append(request)
+            return original_execute(self, test, wrapper, request)
+        runner.WebtestRunner.execute = execute
+        try:
+            self.assertEqual(test_runner()(), True)
+        finally:
+            runner.WebtestRunner.execute = original_execute
+        self.assertEqual(executed, [request for test, wrapper, request in requests])
+
+
+    def test_transactions_test_number_skip(self):
+        """Requests and transactions together must fit in test_number_skip.
+        """
+        webtest_file = os.path.join(data_dir, 'transactions.webtest')
+        # Four requests and two transactions
+        runner.WebtestRunner.test_number_skip = 5
+        try:
+            self.assertRaises(ValueError, runner.get_test_runner,
+                              [runner.TestSet(webtest_file)], verbosity='quiet')
+            runner.WebtestRunner.test_number_skip = 6
+            runner.get_test_runner([runner.TestSet(webtest_file)],
+                                   verbosity='quiet')
+        finally:
+            runner.WebtestRunner.test_number_skip = 1000
+
+
+    def test_transactions_without_request_stats(self):
+        """With request_stats=False, requests in transactions are unrecorded,
+        and their failures fail the transaction.
+        """
+        webtest_file = os.path.join(data_dir, 'transactions.webtest')
+        my_vars = {'SERVER': 'www.google.com', 'USERNAME': 'wapcaplet'}
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(webtest_file)], verbosity='quiet', variables=my_vars,
+            request_stats=False)
+        requests = runner.WebtestRunner.webtest_requests[webtest_file]
+        recorded = [isinstance(test, runner.UnrecordedTest)
+                    for test, wrapper, request in requests]
+        self.assertEqual(recorded, [True, True, False, True])
+
+        statistics = stub.grinder.statistics
+        statistics.forLastTest.success = True
+        statistics.forCurrentTest.success = True
+        original_status = stub.Response.getStatusCode
+        stub.Response.getStatusCode = lambda self: 500
+        try:
+            runner_instance = test_runner()
+            runner_instance._run_request(requests[0], first_transaction(webtest_file))
+        finally:
+            stub.Response.getStatusCode = original_status
+        self.assertEqual(statistics.forLastTest.success, True)
+        self.assertEqual(statistics.forCurrentTest.success, False)
+        statistics.forCurrentTest.success = True
+
+
+    def test_replay_speed(self):
+        """With a replay_speed, runners sleep for recorded pauses divided by
+        the speed, or think_time if there is none.
+        """
+        webtest_file = os.path.join(data_dir, 'think_times.webtest')
+        GTR = runner.get_test_runner
+        test_sets = [runner.TestSet(webtest_file)]
+        self.assertRaises(ValueError, GTR, test_sets, replay_speed=0)
+        try:
+            test_runner = GTR(test_sets, replay_speed=4, think_time=100,
+                              verbosity='error')
+            runner_instance = test_runner()
+            think_times = [runner_instance._think_time(step) for step in
+                           runner.WebtestRunner.webtest_steps[webtest_file]]
+            # The transaction uses the pause after its last request
+            self.assertEqual(think_times, [(500, True), (125, True),
+                                           (100, False)])
+        finally:
+            runner.WebtestRunner.replay_speed = None
+
+
+    def test_discard_bodies(self):
+        """With discard_bodies=True, only requests without captures skip
+        reading their response bodies.
+        """
+        created = []
+        class FakeHTTPRequest:
+            def __init__(self):
+                self.read_body = True
+                created.append(self)
+            def setReadResponseBody(self, read_body):
+                self.read_body = read_body
+        webtest_file = os.path.join(data_dir, 'transactions.webtest')
+        capture_file = os.path.join(data_dir, 'captures.webtest')
+        test_sets = [runner.TestSet(webtest_file, capture_file)]
+        original_request = runner.HTTPRequest
+        runner.HTTPRequest = FakeHTTPRequest
+        try:
+            runner.get_test_runner(test_sets, discard_bodies=True)
+            self.assertEqual(runner.WebtestRunner.discard_bodies, True)
+            # Requests in captures.webtest all have captures
+            self.assertEqual([request.read_body for request in created],
+                             [False] * 4 + [True] * 4)
+            # Bodies are kept when they're logged or recorded
+            del created[:]
+            runner.get_test_runner(test_sets, discard_bodies=True,
+                                   verbosity='debug')
+            self.assertEqual(runner.WebtestRunner.discard_bodies, False)
+            self.assertEqual([request.read_body for request in created],
+                             [True] * 8)
+        finally:
+            runner.HTTPRequest = original_request
+            runner.WebtestRunner.discard_bodies = False
+
+
     def test_eval_expressions(self):
         """WebtestRunner correctly evaluates expressions.
         """
@@ -174,6 +343,14 @@ class TestWebtestRunner (unittest.TestCase):
         # TODO: Macro eval, macro assignment, custom macro
 
 
+def first_transaction(webtest_file):
+    """Return the first transaction in the given .webtest file.
+    """
+    for step in runner.WebtestRunner.webtest_steps[webtest_file]:
+        if isinstance(step, runner.Transaction):
+            return step
+
+
 class TestWebtestRunnerEvalCapture (unittest.TestCase):
     def setUp(self):
         # Dummy response to test capture evaluation
@@ -308,3 +485,136 @@ class TestWebtestRunnerEvalCapture (unittest.TestCase):
         self.assertRaises(runner.CaptureFailed, tr.eval_capture, request, response)
 
 
+    def test_eval_capture_header(self):
+        """eval_capture can capture from response headers and the status code,
+        without looking at the body.
+        """
+        webtest_file = os.path.join(data_dir, 'header_captures.webtest')
+        webtest_test = runner.TestSet(webtest_file)
+
+        tr = runner.get_test_runner([webtest_test], verbosity='debug')()
+        request, both = parser.Webtest(webtest_file).requests
+
+        # The body is never fetched for header and status captures
+        response = stub.Response(None)
+        response.headers = {'Location': 'http://www.example.com/welcome?id=3'}
+        captured = tr.eval_capture(request, response)
+        self.assertEqual(captured, 2)
+        self.assertEqual(tr.variables,
+                         {'NEXT_PAGE': '/welcome?id=3', 'STATUS': '200'})
+
+        # Header and body captures can be combined
+        captured = tr.eval_capture(both, self.response)
+        self.assertEqual(captured, 2)
+        self.assertEqual(tr.variables['CONTENT_TYPE'],
+                         'text/plain; charset=UTF-8')
+        self.assertEqual(tr.variables['SID_CONTENT'], '314159265')
+
+        # Missing headers fail, and the header is named in the log
+        response.headers = {}
+        logged = []
+        original_log = runner.log
+        runner.log = logged.append
+        try:
+            self.assertRaises(runner.CaptureFailed, tr.eval_capture, request,
+                              response)
+        finally:
+            runner.log = original_log
+        self.assertTrue("Looking in Location header for match to regexp: "
+                        "http://[^/]+(/.*)" in logged)
+        self.assertEqual(logged[-1], "!!!!!! Value of Location header: None")
+
+
+    def test_eval_capture_path(self):
+        """eval_capture can capture values at JSON paths and XPaths.
+        """
+        webtest_file = os.path.join(data_dir, 'path_captures.webtest')
+        webtest_test = runner.TestSet(webtest_file)
+
+        tr = runner.get_test_runner([webtest_test], verbosity='debug',
+                                    variables={'INDEX': '1'})()
+        json, xml = parser.Webtest(webtest_file).requests
+
+        response = stub.Response('{"orders": [{"id": 17}, {"id": 42}]}')
+        self.assertEqual(tr.eval_capture(json, response), 2)
+        self.assertEqual(tr.variables['ORDER_ID'], '42')
+        self.assertEqual(tr.variables['ORDERS'], '[{"id":17},{"id":42}]')
+
+        response = stub.Response(
+            '<SessionData version="2"><SID>314159265</SID></SessionData>')
+        self.assertEqual(tr.eval_capture(xml, response), 2)
+        self.assertEqual(tr.variables['SID'], '314159265')
+        self.assertEqual(tr.variables['VERSION'], '2')
+
+        # Missing values and malformed documents fail
+        tr.variables['INDEX'] = '2'
+        response = stub.Response('{"orders": [{"id": 17}, {"id": 42}]}')
+        self.assertRaises(runner.CaptureFailed, tr.eval_capture, json, response)
+        response = stub.Response('<SessionData><SID>314159265</SessionData>')
+        self.assertRaises(runner.CaptureFailed, tr.eval_capture, xml, response)
+        self.assertEqual(runner._captures_body(json), True)
+
+
+    def test_literal_prefix(self):
+        """_literal_prefix finds the literal text that starts every match.
+        """
+        self.assertEqual(runner._literal_prefix('<SID>([^<]+)</SID>'), '<SID>')
+        self.assertEqual(runner._literal_prefix(r'id="a\.b" value=(\d+)'),
+                         'id="a.b" value=')
+        self.assertEqual(runner._literal_prefix('abc?d'), 'ab')
+        self.assertEqual(runner._literal_prefix('abc{2}'), 'ab')
+        self.assertEqual(runner._literal_prefix(r'\d+x'), '')
+        self.assertEqual(runner._literal_prefix('.*x'), '')
+        self.assertEqual(runner._literal_prefix('a|b'), '')
+        self.assertEqual(runner._literal_prefix('ab(?i)c'), '')
+
+
+    def test_prefix_scanner(self):
+        """_PrefixScanner finds the first offset of each prefix, even when
+        they overlap.
+        """
+        scanner = runner._PrefixScanner(['abc', 'bcd', 'cd', 'x', 'abc'])
+        self.assertEqual(scanner.prefixes, ['abc', 'bcd', 'cd', 'x'])
+        self.assertEqual(scanner.scan('..abcd..cd..x'),
+                         {'abc': 2, 'bcd': 3, 'cd': 4, 'x': 12})
+        self.assertEqual(scanner.scan('bcdabc'),
+                         {'abc': 3, 'bcd': 0, 'cd': 1, 'x': -1})
+
+
+    def test_eval_capture_scanned(self):
+        """eval_capture finds the same matches when the body is scanned for
+        the captures' prefixes first.
+        """
+        webtest_file = os.path.join(data_dir, 'captures.webtest')
+        webtest_test = runner.TestSet(webtest_file)
+
+        tr = runner.get_test_runner([webtest_test], verbosity='debug')()
+        req = parser.Webtest(webtest_file).requests[2]
+        response = stub.Response('<SID>x<FOO>1</FOO></SID><SID>2</SID>')
+
+        captured = tr.eval_capture(req, response)
+        self.assertNotEqual(req.capture_scanner, None)
+        self.assertEqual(captured, 2)
+        self.assertEqual(tr.variables, {'SID_CONTENT': '2', 'FOO_CONTENT': '1'})
+
+        response = stub.Response('<SID>1</SID><FOO></FOO>')
+        self.assertRaises(runner.CaptureFailed, tr.eval_capture, req, response)
+
+
+    def test_captures_body(self):
+        """_captures_body is False only for requests whose captures all look
+        at headers or the status code.
+        """
+        webtest_file = os.path.join(data_dir, 'header_captures.webtest')
+        headers, both = parser.Webtest(webtest_file).requests
+        self.assertEqual(runner._captures_body(headers), False)
+        self.assertEqual(runner._captures_body(both), True)
+        self.assertEqual(headers.capture_specs[0],
+                         ('NEXT_PAGE', 'header', 'Location', 'http://[^/]+(/.*)'))
+        self.assertEqual(headers.capture_specs[1], ('STATUS', 'status', None, '.*'))
+
+        webtest_file = os.path.join(data_dir, 'malformed_capture.webtest')
+        request = parser.Webtest(webtest_file).requests[0]
+        self.assertRaises(SyntaxError, runner._captures_body, request)
+
+
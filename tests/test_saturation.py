@@ -0,0 +1,117 @@
+# test_saturation.py
+
+"""Unit tests for the `webtest.saturation` module.
+"""
+
+import os
+import random
+import unittest
+from . import data_dir
+from webtest import runner
+from webtest import saturation
+
+MS = 1000000
+
+class TestSaturationMonitor (unittest.TestCase):
+    def test_vary(self):
+        """vary returns sleep times within the configured variation.
+        """
+        # Seed a random number generator of the monitor's own, so the sleep
+        # times are repeatable without changing the global one
+        monitor = saturation.SaturationMonitor(rng=random.Random(1))
+        monitor.variation = 0.2
+        # About 99.7% of sleep times are within the variation
+        for i in range(100):
+            varied = monitor.vary(1000)
+            self.assertTrue(700 <= varied <= 1300, varied)
+        self.assertEqual(monitor.vary(0), 0)
+        monitor.variation = 0.0
+        self.assertEqual(monitor.vary(1000), 1000)
+
+
+    def test_intervals(self):
+        """Intervals with a mean lag over the threshold are reported.
+        """
+        output = []
+        monitor = saturation.SaturationMonitor(threshold=10, interval=3600,
+                                                 output=output.append)
+        # Sleeping less than requested is not negative lag
+        monitor.record_sleep(100, 90 * MS)
+        monitor.record_sleep(100, 130 * MS)
+        self.assertEqual(monitor.current.count, 2)
+        self.assertEqual(monitor.current.max_lag, 30 * MS)
+        self.assertEqual(monitor.current.mean_lag(), 15.0)
+        self.assertEqual(output, [])
+        # Start a new interval; the finished one is reported
+        monitor.current.start -= monitor.interval
+        monitor.record_sleep(100, 101 * MS)
+        self.assertEqual(len(monitor.intervals), 1)
+        self.assertEqual(len(output), 1)
+        self.assertTrue(output[0].startswith('WARNING: load generator lagging'))
+        # A good interval is not reported
+        monitor.current.start -= monitor.interval
+        monitor.record_sleep(100, 100 * MS)
+        self.assertEqual(len(monitor.intervals), 2)
+        self.assertEqual(len(output), 1)
+
+        monitor.thread_finished()
+        self.assertEqual(len(output), 2)
+        self.assertTrue('RESULTS UNTRUSTWORTHY' in output[1])
+        self.assertTrue('1 of 3 intervals' in output[1])
+        # Only reported once
+        monitor.report()
+        self.assertEqual(len(output), 2)
+
+
+    def test_cpu_time(self):
+        """CPU time is measured where the platform supports it.
+        """
+        cpu_times = [0, 50 * MS]
+        original = saturation._thread_cpu_time
+        saturation._thread_cpu_time = lambda: cpu_times.pop(0)
+        try:
+            monitor = saturation.SaturationMonitor(interval=3600)
+            monitor.record_sleep(0, 0)
+            monitor.record_sleep(0, 0)
+        finally:
+            saturation._thread_cpu_time = original
+        self.assertEqual(monitor.current.cpu_time, 50 * MS)
+        self.assertTrue(monitor.current.elapsed > 0)
+        self.assertTrue('% of elapsed time' in monitor.summary())
+        self.assertTrue('No intervals' in monitor.summary())
+
+
+    def test_runner_sleeps(self):
+        """WebtestRunner times its sleeps when given a SaturationMonitor.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        my_vars = {
+            'SERVER': 'www.google.com',
+            'USERNAME': 'wapcaplet',
+            'PASSWORD': 'f00b4r',
+        }
+        output = []
+        monitor = saturation.SaturationMonitor(output=output.append)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='quiet', variables=my_vars,
+            saturation_monitor=monitor)
+        try:
+            runner_instance = test_runner()
+            runner_instance()
+            requests = runner.WebtestRunner.webtest_requests[login_file]
+            # One sleep after each request, and one after the scenario
+            count = 0
+            for interval in monitor.all_intervals():
+                count += interval.count
+            self.assertEqual(count, len(requests) + 1)
+            del runner_instance
+            self.assertEqual(len(output), 1)
+        finally:
+            runner.WebtestRunner.saturation_monitor = None
+        # Invalid saturation_monitor
+        self.assertRaises(ValueError, runner.get_test_runner, [],
+                          saturation_monitor='foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
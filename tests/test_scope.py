@@ -0,0 +1,71 @@
+# test_scope.py
+
+"""Unit tests for the `webtest.scope` module.
+"""
+
+import os
+import unittest
+from webtest import runner, scope
+from . import data_dir
+
+class TestScope (unittest.TestCase):
+    def test_layers(self):
+        """Scope looks names up from the innermost layer out, and sets them in
+        the innermost layer.
+        """
+        defaults = {'SERVER': 'localhost', 'USERNAME': 'phil'}
+        variables = scope.Scope(defaults, {'SID': '1'})
+        self.assertEqual(variables['USERNAME'], 'phil')
+        variables.push()
+        variables['USERNAME'] = 'sarah'
+        variables['TOKEN'] = 'abc'
+        self.assertEqual(variables['USERNAME'], 'sarah')
+        self.assertEqual(variables, {'SERVER': 'localhost', 'USERNAME': 'sarah',
+                                     'SID': '1', 'TOKEN': 'abc'})
+        self.assertEqual(variables.pop(), {'USERNAME': 'sarah', 'TOKEN': 'abc'})
+        self.assertEqual(variables['USERNAME'], 'phil')
+        self.assertEqual('TOKEN' in variables, False)
+        self.assertEqual(variables.get('TOKEN'), None)
+        self.assertRaises(KeyError, lambda: variables['TOKEN'])
+        self.assertRaises(IndexError, variables.pop)
+        # Defaults are never changed
+        variables['SERVER'] = 'example.com'
+        self.assertEqual(defaults['SERVER'], 'localhost')
+        del variables['SERVER']
+        self.assertEqual(variables['SERVER'], 'localhost')
+        self.assertRaises(KeyError, variables.__delitem__, 'SERVER')
+        self.assertEqual(len(variables), 3)
+        self.assertEqual(dict(variables), variables.copy())
+
+
+    def test_variable_scope(self):
+        """WebtestRunner discards variables at the end of their scope, but
+        keeps those set by the before_set.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        login = runner.TestSet(login_file)
+        self.assertRaises(ValueError, runner.get_test_runner,
+                          [login], variable_scope='forever')
+        try:
+            # COUNT seen at the start of each test set, in two iterations
+            for variable_scope, expected in [
+                    ('runner', [None, '1', '2', '3']),
+                    ('iteration', [None, '1', None, '3']),
+                    ('test_set', [None, None, None, None])]:
+                test_runner = runner.get_test_runner(
+                    [login, login], variable_scope=variable_scope,
+                    verbosity='error', variables={'SERVER': 'localhost'})
+                runner_instance = test_runner()
+                runner_instance.variables['SID'] = 'before'
+                found = []
+                def run_test_set(test_set):
+                    found.append(runner_instance.variables.get('COUNT'))
+                    runner_instance.variables['COUNT'] = str(len(found))
+                runner_instance.run_test_set = run_test_set
+                runner_instance()
+                runner_instance()
+                self.assertEqual(found, expected)
+                self.assertEqual(runner_instance.variables['SID'], 'before')
+                self.assertEqual(runner_instance.variables['SERVER'], 'localhost')
+        finally:
+            runner.WebtestRunner.variable_scope = 'runner'
@@ -0,0 +1,94 @@
+# test_session.py
+
+"""Unit tests for the `webtest.session` module.
+"""
+
+import os
+import unittest
+from webtest import runner, session, stub
+from . import data_dir
+
+class TestSessionPool (unittest.TestCase):
+    def test_acquire_release(self):
+        """SessionPool creates sessions up to its size, then reuses them.
+        """
+        pool = session.SessionPool(size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertEqual((first.number, second.number), (1, 2))
+        self.assertEqual(pool.acquire(False), None)
+        pool.release(second)
+        self.assertEqual(pool.acquire(False), second)
+        self.assertEqual(second.uses, 1)
+        # Discarded sessions are replaced by new ones
+        pool.release(first, valid=False)
+        self.assertEqual(pool.discarded, 1)
+        self.assertEqual(pool.acquire(False).number, 3)
+        self.assertRaises(ValueError, session.SessionPool, size=0)
+
+
+    def test_needs_login(self):
+        """Sessions need logging in when new, or when they expire.
+        """
+        pool = session.SessionPool(size=1, max_uses=2)
+        pooled = pool.acquire()
+        self.assertEqual(pool.needs_login(pooled), True)
+        pooled.variables = {}
+        pool.logged_in(pooled)
+        self.assertEqual(pool.logins, 1)
+        self.assertEqual(pool.needs_login(pooled), False)
+        pool.release(pooled)
+        pool.release(pool.acquire())
+        self.assertEqual(pool.needs_login(pooled), True)
+        pool.max_uses = None
+        pool.max_age = 60
+        self.assertEqual(pool.needs_login(pooled), False)
+        pooled.login_time -= 60
+        self.assertEqual(pool.needs_login(pooled), True)
+
+
+    def test_runner(self):
+        """WebtestRunner runs the before_set to create and refresh sessions,
+        and restores each session's variables and cookies.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        login, logout = runner.TestSet(login_file), runner.TestSet(login_file)
+        pool = session.SessionPool(size=1, max_uses=2)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], before_set=login, after_set=logout,
+            session_pool=pool, verbosity='error',
+            variables={'SERVER': 'localhost', 'USERNAME': 'x', 'PASSWORD': 'y'})
+        self.assertRaises(ValueError, runner.get_test_runner,
+                          [login], session_pool=pool)
+        try:
+            runner_instance = test_runner()
+            runs = []
+            def run_test_set(test_set):
+                runs.append(test_set)
+                if test_set is login:
+                    runner_instance.variables['SID'] = str(pool.logins)
+                    runner_instance._set_cookies(['cookie%d' % pool.logins])
+                else:
+                    runs.append(runner_instance.variables.get('SID'))
+            runner_instance.run_test_set = run_test_set
+            self.assertEqual(runs, [])
+            for iteration in range(3):
+                runner_instance()
+            main = runner.WebtestRunner.test_sets[0]
+            # The logout runs with the expired session
+            self.assertEqual(runs, [login, main, '0', main, '0',
+                                    logout, '0', login, main, '1'])
+            self.assertEqual(pool.logins, 2)
+            pooled = pool.idle[0]
+            self.assertEqual(pooled.variables['SID'], '1')
+            self.assertEqual(pooled.cookies, ['cookie1'])
+            # Failed iterations discard the session
+            def fail(test_set):
+                raise RuntimeError("Failed")
+            runner_instance.run_test_set = fail
+            self.assertRaises(RuntimeError, runner_instance)
+            self.assertEqual(pool.discarded, 1)
+            self.assertEqual(pool.sessions, 0)
+        finally:
+            runner.WebtestRunner.session_pool = None
+            runner_instance._set_cookies([])
@@ -0,0 +1,193 @@
+# test_start.py
+
+"""Unit tests for the ``agents`` command of ``start.py``.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from StringIO import StringIO
+
+# start.py reads its configuration from conf.py when it is imported
+conf = types.ModuleType('conf')
+conf.paths = {'java': 'java', 'jython': 'jython', 'grinder': 'grinder',
+              'properties': 'grinder.properties'}
+_original_conf = sys.modules.get('conf')
+sys.modules['conf'] = conf
+try:
+    import start
+finally:
+    if _original_conf is None:
+        del sys.modules['conf']
+    else:
+        sys.modules['conf'] = _original_conf
+
+
+class FakeTime:
+    """Stands in for the ``time`` module, with a clock that only moves when
+    ``sleep`` is called. If ``interrupt`` is True, the first ``sleep`` raises
+    `KeyboardInterrupt`.
+    """
+    def __init__(self, interrupt=False):
+        self.now = 0.0
+        self.interrupt = interrupt
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if self.interrupt:
+            self.interrupt = False
+            raise KeyboardInterrupt()
+        self.now += seconds
+
+
+class FakeProcess:
+    """Stands in for a ``subprocess.Popen`` agent process, which exits with
+    ``status``, or keeps running if it is ``None``. A ``stubborn`` process
+    ignores ``terminate``.
+    """
+    def __init__(self, cmd, status=None, stubborn=False):
+        self.cmd = cmd
+        self.returncode = status
+        self.stubborn = stubborn
+        self.events = []
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.events.append('terminate')
+        if not self.stubborn:
+            self.returncode = -15
+
+    def kill(self):
+        self.events.append('kill')
+        self.returncode = -9
+
+    def wait(self):
+        self.events.append('wait')
+        return self.returncode
+
+
+class FakeSubprocess:
+    """Stands in for the ``subprocess`` module. Each agent's processes exit
+    with the next of its ``statuses``, indexed by agent number.
+    """
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.processes = []
+
+    def Popen(self, cmd):
+        # The agent's properties file is the last argument
+        number = int(os.path.basename(cmd[-1])[len('agent'):-len('.properties')])
+        process = FakeProcess(cmd, self.statuses[number].pop(0))
+        self.processes.append(process)
+        return process
+
+
+class TestAgents (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.properties = os.path.join(self.temp_dir, 'grinder.properties')
+        outfile = open(self.properties, 'w')
+        outfile.write('# Base properties\n'
+                      'grinder.script = script.py\n'
+                      'grinder.threads=5\n')
+        outfile.close()
+        self.log_directory = os.path.join(self.temp_dir, 'logs')
+        os.mkdir(self.log_directory)
+        self.settings = start.default_agents.copy()
+        self.settings['log_directory'] = self.log_directory
+        self.original = (start.paths['properties'], start.agents,
+                         start.subprocess, start.time, sys.stdout)
+        start.paths['properties'] = self.properties
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        start.paths['properties'], start.agents, start.subprocess, \
+            start.time, sys.stdout = self.original
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_write_agent_properties(self):
+        """Each agent's properties file overrides the base file's settings.
+        """
+        self.settings['processes'] = 2
+        filename = start.write_agent_properties(1, 3, self.settings)
+        self.assertEqual(filename,
+                         os.path.join(self.log_directory, 'agent1.properties'))
+        properties = start.read_properties(filename)
+        self.assertEqual(properties['grinder.hostID'], 'agent1')
+        self.assertEqual(properties['grinder.logDirectory'],
+                         os.path.abspath(self.log_directory))
+        self.assertEqual(properties['webtest.agent'], '1')
+        self.assertEqual(properties['webtest.agents'], '3')
+        # Relative to the base properties file
+        self.assertEqual(properties['grinder.script'],
+                         os.path.join(self.temp_dir, 'script.py'))
+        self.assertEqual(properties['grinder.processes'], '2')
+        self.assertEqual(properties['grinder.initialProcesses'], '2')
+        # Not overridden
+        self.assertEqual(properties['grinder.threads'], '5')
+
+
+    def test_start_agent_taskset(self):
+        """Agents are pinned to their own CPUs with taskset.
+        """
+        start.subprocess = FakeSubprocess({1: [None], 2: [None]})
+        self.settings['cpus_per_agent'] = 2
+        self.settings['first_cpu'] = 4
+        process = start.start_agent(1, 3, self.settings)
+        self.assertEqual(process.cmd[:3], ['taskset', '-c', '6,7'])
+        self.assertEqual(process.cmd[3], 'java')
+        self.assertEqual(process.cmd[-2:], ['net.grinder.Grinder',
+            os.path.join(self.log_directory, 'agent1.properties')])
+        # Not pinned
+        self.settings['cpus_per_agent'] = None
+        process = start.start_agent(2, 3, self.settings)
+        self.assertEqual(process.cmd[0], 'java')
+
+
+    def test_restart(self):
+        """Failed agents are restarted up to max_restarts times.
+        """
+        start.agents = {'count': 2, 'max_restarts': 1,
+                        'log_directory': self.log_directory}
+        start.subprocess = FakeSubprocess({0: [1, 0], 1: [1, 2]})
+        start.time = FakeTime()
+        start.run_agents()
+        self.assertEqual(len(start.subprocess.processes), 4)
+        output = sys.stdout.getvalue()
+        self.assertTrue("Agent 0 failed with status 1; restarting" in output)
+        self.assertTrue("Agent 0 finished" in output)
+        self.assertTrue("Agent 1 failed with status 1; restarting" in output)
+        self.assertTrue("Agent 1 failed with status 2; giving up" in output)
+
+
+    def test_interrupt(self):
+        """On Ctrl-C, agents are terminated and waited for.
+        """
+        start.agents = {'count': 2, 'log_directory': self.log_directory}
+        start.subprocess = FakeSubprocess({0: [None], 1: [None]})
+        start.time = FakeTime(interrupt=True)
+        start.run_agents()
+        for process in start.subprocess.processes:
+            self.assertEqual(process.events, ['terminate', 'wait'])
+            self.assertEqual(process.returncode, -15)
+        self.assertTrue("Stopped Grinder agents" in sys.stdout.getvalue())
+
+
+    def test_stop_agents(self):
+        """Agents that don't exit when terminated are killed.
+        """
+        start.time = FakeTime()
+        polite = FakeProcess([])
+        stubborn = FakeProcess([], stubborn=True)
+        start.stop_agents([polite, stubborn], 5)
+        self.assertEqual(polite.events, ['terminate', 'wait'])
+        self.assertEqual(stubborn.events, ['terminate', 'kill', 'wait'])
+        self.assertTrue(start.time.now >= 5)
@@ -0,0 +1,109 @@
+# test_timeline.py
+
+"""Unit tests for the `webtest.timeline` module.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from . import data_dir
+from webtest import runner
+from webtest import timeline
+
+def read_trace(filename):
+    """Return the events in a trace file, closing the event array.
+    """
+    text = open(filename).read()
+    return json.loads(text.rstrip().rstrip(',') + ']')
+
+
+class TestTraceWriter (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'trace.json')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_spans(self):
+        """Spans are written as Chrome trace events, in batches.
+        """
+        tracer = timeline.TraceWriter(self.filename, sample=1.0, buffer_size=3)
+        self.assertTrue(tracer.sampled())
+        tracer.span('GET "/" \\ \n', 'request', 1000000, 3500000, {'test': 1001})
+        self.assertFalse(os.path.exists(self.filename))
+        tracer.span('http', 'http', 1500000, 3000000)
+        # Buffer full: metadata and two spans are written
+        events = read_trace(self.filename)
+        self.assertEqual(len(events), 4)
+        self.assertEqual(events[0]['name'], 'process_name')
+        self.assertEqual(events[1]['name'], 'thread_name')
+        self.assertEqual(events[1]['args']['name'],
+                         threading.currentThread().getName())
+        request = events[2]
+        self.assertEqual(request['name'], 'GET "/" \\ \n')
+        self.assertEqual((request['ph'], request['cat']), ('X', 'request'))
+        self.assertEqual((request['ts'], request['dur']), (1000.0, 2500.0))
+        self.assertEqual(request['args'], {'test': 1001})
+        self.assertEqual(events[3]['tid'], request['tid'])
+
+        tracer.span('sleep', 'sleep', 3500000, 4500000)
+        tracer.flush()
+        events = read_trace(self.filename)
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[4]['dur'], 1000.0)
+
+
+    def test_sampling(self):
+        """Threads are sampled once, when they first ask.
+        """
+        tracer = timeline.TraceWriter(self.filename, sample=0.0)
+        self.assertFalse(tracer.sampled())
+        tracer.sample = 1.0
+        self.assertFalse(tracer.sampled())
+        tracer.flush()
+        self.assertFalse(os.path.exists(self.filename))
+
+
+    def test_runner_spans(self):
+        """WebtestRunner writes request, http and sleep spans.
+        """
+        login_file = os.path.join(data_dir, 'login.webtest')
+        my_vars = {
+            'SERVER': 'www.google.com',
+            'USERNAME': 'wapcaplet',
+            'PASSWORD': 'f00b4r',
+        }
+        tracer = timeline.TraceWriter(self.filename, sample=1.0)
+        test_runner = runner.get_test_runner(
+            [runner.TestSet(login_file)], verbosity='quiet', variables=my_vars,
+            tracer=tracer)
+        try:
+            runner_instance = test_runner()
+            runner_instance()
+            del runner_instance
+        finally:
+            runner.WebtestRunner.tracer = None
+        events = read_trace(self.filename)
+        categories = {}
+        for event in events:
+            if event['ph'] == 'X':
+                categories.setdefault(event['cat'], []).append(event)
+        requests = runner.WebtestRunner.webtest_requests[login_file]
+        self.assertEqual(len(categories['request']), len(requests))
+        self.assertEqual(len(categories['http']), len(requests))
+        self.assertEqual(len(categories['sleep']), len(requests) + 1)
+        for (test, wrapper, request), event in zip(requests, categories['request']):
+            self.assertEqual(event['name'], str(request))
+            self.assertEqual(event['args']['test'], test.getNumber())
+        # Invalid tracer
+        self.assertRaises(ValueError, runner.get_test_runner, [], tracer='foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
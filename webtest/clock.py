@@ -0,0 +1,26 @@
+# clock.py
+
+"""Provides a high-resolution clock for timing requests.
+
+Under Jython, `nanotime` uses Java's ``System.nanoTime``, which is monotonic
+and far more precise than ``time.time`` (only millisecond resolution on the
+JVM). Elsewhere, it falls back to ``time.time``.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+try:
+    from java.lang import System
+except ImportError:
+    import time
+
+    def nanotime():
+        """Return the current time in nanoseconds, from an arbitrary origin.
+        """
+        return long(time.time() * 1000000000)
+else:
+    def nanotime():
+        """Return the current time in nanoseconds, from an arbitrary origin.
+        """
+        return System.nanoTime()
+
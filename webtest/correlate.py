@@ -26,10 +26,10 @@ except ImportError:
     print("Grinder module import failed.")
     print("You may need to add grinder.jar to your classpath.")
     print("Continuing blissfully onward...")
-else:
-    log = grinder.logger.output
+    from stub import grinder
 
-from runner import WebtestRunner
+# Log through the runner, so a LogSink is used if one is configured
+from runner import WebtestRunner, Transaction, _log as log
 
 class CorrelationRunner (WebtestRunner):
     """A WebtestRunner that correlates requests and responses.
@@ -39,6 +39,8 @@ class CorrelationRunner (WebtestRunner):
         # (This must be initialized before WebtestRunner.__init__,
         # since __init__ may run before_set tests)
         self.webtest_responses = {}
+        # Name of the webtest file being run
+        self.filename = None
         WebtestRunner.__init__(self, **variables)
 
 
@@ -47,35 +49,53 @@ class CorrelationRunner (WebtestRunner):
         response for each request.
         """
         for filename in test_set.filenames:
-            log("========== Executing: %s ==========" % filename)
+            log("========== Executing: %s ==========", filename)
             # Add an empty list to the responses dict, if it doesn't exist
             if filename not in self.webtest_responses:
                 self.webtest_responses[filename] = []
+            self._run_webtest_file(filename)
 
-            # Execute all requests in this test set, in order
-            for test, wrapper, request in WebtestRunner.webtest_requests[filename]:
-                # Try to correlate this request with previous responses
-                # in the current webtest file
-                self.correlate(filename, request)
 
-                # Execute this request
-                try:
-                    response = self.execute(test, wrapper, request)
-                # If problems occurred, report an error and re-raise
-                except RuntimeError:
-                    grinder.statistics.forLastTest.success = False
-                    raise
-                # Otherwise, store the test number and response body
-                else:
-                    body = response.getText()
-                    self.webtest_responses[filename].append((test.getNumber(), body))
+    def _run_webtest_file(self, filename):
+        """Overridden from WebtestRunner base class, to keep track of the
+        file whose requests are being correlated.
+        """
+        self.filename = filename
+        # Execute all requests and transactions in this file, in order
+        for step in WebtestRunner.webtest_steps[filename]:
+            if isinstance(step, Transaction):
+                self.run_transaction(step)
+            else:
+                self._run_request(step)
 
-                # If response was not valid, report an error
-                if response.getStatusCode() >= 400:
-                    grinder.statistics.forLastTest.success = False
+            # Sleep, for the recorded pause if replaying
+            self._think(step)
 
-                # Sleep
-                grinder.sleep(WebtestRunner.think_time)
+
+    def _run_request(self, step, transaction=None):
+        """Overridden from WebtestRunner base class, to correlate each
+        request with the responses before it, and record its response.
+        """
+        test, wrapper, request = step
+        # Try to correlate this request with previous responses
+        # in the current webtest file
+        self.correlate(self.filename, request)
+
+        # Execute this request
+        try:
+            response = self.execute(test, wrapper, request)
+        # If problems occurred, report an error and re-raise
+        except RuntimeError:
+            self._request_failed(test, transaction)
+            raise
+        # Otherwise, store the test number and response body
+        else:
+            body = response.getText()
+            self.webtest_responses[self.filename].append((test.getNumber(), body))
+
+        # If response was not valid, report an error
+        if response.getStatusCode() >= 400:
+            self._request_failed(test, transaction)
 
 
     def correlate(self, filename, request):
@@ -96,12 +116,12 @@ class CorrelationRunner (WebtestRunner):
         for name, value in request.parameters:
             # Don't look for parameters that already have a variable set
             if name in self.variables:
-                log(":-) '%s' parameter already set or captured, skipping" % name)
+                log(":-) '%s' parameter already set or captured, skipping", name)
                 continue
 
             # Don't bother looking for parameters that have an empty value
             if value == '':
-                log("... '%s' value is empty, skipping" % name)
+                log("... '%s' value is empty, skipping", name)
                 continue
 
             # Which test numbers have a response containing this parameter?
@@ -114,10 +134,10 @@ class CorrelationRunner (WebtestRunner):
 
             # Log which test numbers this parameter was found in
             if found_in_tests:
-                log("+++ '%s' found in response from test number(s): %s" % \
-                    (name, ', '.join(found_in_tests)))
+                log("+++ '%s' found in response from test number(s): %s",
+                    name, ', '.join(found_in_tests))
             else:
-                log("--- '%s' not found in any response" % name)
+                log("--- '%s' not found in any response", name)
 
         log("====== End of correlation")
 
@@ -129,7 +149,8 @@ def get_correlation_runner(test_sets,
                            sequence='sequential',
                            think_time=500,
                            verbosity='debug',
-                           variables={}):
+                           variables={},
+                           replay_speed=None):
     """Return a `TestRunner` base class that runs ``.webtest`` files in the
     given list of `~webtest.runner.TestSet`\s, and does correlation of request
     parameters with responses.
@@ -140,7 +161,8 @@ def get_correlation_runner(test_sets,
     output about found correlations regardless of the ``verbosity`` setting.
     """
     WebtestRunner.set_class_attributes(test_sets,
-        before_set, after_set, sequence, think_time, verbosity)
+        before_set, after_set, sequence, think_time, verbosity=verbosity,
+        replay_speed=replay_speed)
 
     # Define the actual TestRunner wrapper class. This allows us to delay
     # instantiation of the class until the Grinder threads run, while still
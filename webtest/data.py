@@ -0,0 +1,310 @@
+# data.py
+
+"""This module provides CSV data sources, for giving each request its own
+input data, such as a different username and password for each worker thread.
+Values are read with the built-in ``data`` macro (see `webtest.macro`)::
+
+    <FormPostParameter Name="UID" Value="{USERNAME = data(users.csv, username)}" />
+    <FormPostParameter Name="PWD" Value="{PASSWORD = data(users.csv, password)}" />
+
+The first line of the CSV file names its columns; each following line is a
+row of values. Fields may be enclosed in double quotes (with any quotes
+inside them doubled), but may not contain line breaks.
+
+Each `~webtest.runner.WebtestRunner` instance (each worker thread, that is)
+reads values from one row at a time, so the username and password above come
+from the same row. The next row is taken when a column of the current row is
+read a second time--normally, in the next iteration.
+
+Rows are handed out in one of three modes, given as an optional third
+argument, like ``data(users.csv, username, unique)``:
+
+    ``sequential``
+        Threads share a counter, and take rows in order, starting over at the
+        first row after the last one. This is the default.
+    ``random``
+        Each row is chosen at random.
+    ``unique``
+        The rows are split into equal ranges, one for each worker thread in
+        the whole test, across all processes and agents, and each thread
+        takes the rows in its own range in order. No row is ever used twice,
+        and no locking is needed. When a thread runs out of rows, a
+        `DataExhausted` is raised, and the thread stops.
+
+In ``unique`` mode, threads are numbered using the ``grinder.threads`` and
+``grinder.processes`` properties, and the agent number. Since Grinder does not
+know how many agents there are, set the ``webtest.agents`` property to the
+number of agents running the test. Agents that are not started by the console
+do not have a number, so set the ``webtest.agent`` property of each to a
+different number, counting from 0. ``start.py agents`` sets both.
+
+A fourth argument gives the delimiter, if it is not a comma, such as ``;`` or
+``tab``.
+
+Each file is indexed once per process, the first time it is used, by finding
+the offset of each line; its contents are not loaded. Under CPython, the file
+is memory-mapped and shared by all threads; otherwise, each row is read from
+the file when it is needed.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+from __future__ import generators
+
+import os
+import random
+import threading
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+try:
+    from array import array
+except ImportError:
+    array = None
+
+# Modes of choosing rows
+MODES = ('sequential', 'random', 'unique')
+
+# DataFiles, indexed by absolute filename and delimiter
+_files = {}
+_files_lock = threading.Lock()
+
+
+class DataExhausted (Exception):
+    """Raised when a worker thread has used all of its rows in ``unique``
+    mode."""
+    pass
+
+
+def split_row(line, delimiter=','):
+    """Return a list of the fields in a single line of CSV text.
+    """
+    if '"' not in line:
+        return line.split(delimiter)
+    fields = []
+    start = 0
+    while True:
+        if line[start:start + 1] == '"':
+            # Quoted field, with any quotes inside it doubled
+            parts = []
+            index = start + 1
+            while True:
+                end = line.find('"', index)
+                if end < 0:
+                    raise ValueError("Unterminated quote in CSV line: %s" % line)
+                parts.append(line[index:end])
+                if line[end + 1:end + 2] != '"':
+                    break
+                parts.append('"')
+                index = end + 2
+            fields.append(''.join(parts))
+            end = line.find(delimiter, end + 1)
+        else:
+            end = line.find(delimiter, start)
+            if end < 0:
+                fields.append(line[start:])
+            else:
+                fields.append(line[start:end])
+        if end < 0:
+            return fields
+        start = end + len(delimiter)
+
+
+class DataFile:
+    """A CSV file, indexed by the offset of each row.
+    """
+    def __init__(self, filename, delimiter=','):
+        """Open and index the given CSV file.
+        """
+        self.filename = filename
+        self.delimiter = delimiter
+        self._file = open(filename, 'rb')
+        self._map = None
+        self._lock = threading.Lock()
+        if mmap is not None and os.path.getsize(filename) > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        # Offset of the start of each row
+        if array is not None:
+            self.offsets = array('l')
+        else:
+            self.offsets = []
+        self.columns = []
+        self._index()
+        # Next row for sequential mode
+        self._next = 0
+
+
+    def _lines(self):
+        """Iterate over ``(offset, line)`` for each line of the file, without
+        its line ending.
+        """
+        if self._map is not None:
+            data = self._map
+            size = len(data)
+            start = 0
+            while start < size:
+                end = data.find('\n', start)
+                if end < 0:
+                    end = size
+                yield start, data[start:end].rstrip('\r')
+                start = end + 1
+        else:
+            self._file.seek(0)
+            offset = 0
+            line = self._file.readline()
+            while line:
+                yield offset, line.rstrip('\r\n')
+                offset += len(line)
+                line = self._file.readline()
+
+
+    def _index(self):
+        """Read the column names, and find the offset of each row.
+        """
+        lines = self._lines()
+        for offset, line in lines:
+            if line.strip():
+                self.columns = split_row(line, self.delimiter)
+                break
+        for offset, line in lines:
+            # Skip blank lines
+            if line.strip():
+                self.offsets.append(offset)
+
+
+    def __len__(self):
+        """Return the number of rows.
+        """
+        return len(self.offsets)
+
+
+    def column(self, name):
+        """Return the index of the column with the given name.
+        """
+        try:
+            return self.columns.index(name)
+        except ValueError:
+            raise ValueError("No column '%s' in %s" % (name, self.filename))
+
+
+    def row(self, index):
+        """Return a list of the values in the row with the given index.
+        """
+        offset = self.offsets[index]
+        if self._map is not None:
+            end = self._map.find('\n', offset)
+            if end < 0:
+                end = len(self._map)
+            line = self._map[offset:end]
+        else:
+            self._lock.acquire()
+            try:
+                self._file.seek(offset)
+                line = self._file.readline()
+            finally:
+                self._lock.release()
+        return split_row(line.rstrip('\r\n'), self.delimiter)
+
+
+    def next_index(self):
+        """Return the index of the next row in sequential mode, shared by all
+        threads.
+        """
+        self._lock.acquire()
+        try:
+            index = self._next
+            self._next = (index + 1) % len(self.offsets)
+        finally:
+            self._lock.release()
+        return index
+
+
+    def close(self):
+        """Close the file.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+def get_data_file(filename, delimiter=','):
+    """Return the `DataFile` for the given filename and delimiter, opening
+    and indexing it if this is the first time it is used in this process.
+    """
+    key = (os.path.abspath(filename), delimiter)
+    try:
+        return _files[key]
+    except KeyError:
+        pass
+    _files_lock.acquire()
+    try:
+        if key not in _files:
+            _files[key] = DataFile(filename, delimiter)
+        return _files[key]
+    finally:
+        _files_lock.release()
+
+
+def partition(rows, worker, workers):
+    """Return ``(start, end)``, the range of row indexes used by the given
+    ``worker`` number out of ``workers`` in ``unique`` mode.
+    """
+    return rows * worker // workers, rows * (worker + 1) // workers
+
+
+def value(user, filename, column, mode='sequential', delimiter=','):
+    """Return the value in the given column of the current row for ``user``
+    (a `~webtest.runner.WebtestRunner` instance), taking the next row if this
+    column has already been read from the current one.
+    """
+    if mode not in MODES:
+        raise ValueError("Data mode must be one of %s" % ', '.join(MODES))
+    if delimiter == 'tab':
+        delimiter = '\t'
+    data_file = get_data_file(filename, delimiter)
+    if not len(data_file):
+        raise ValueError("No rows in %s" % filename)
+    # Current row and columns read from it, indexed by filename
+    try:
+        rows = user.data_rows
+    except AttributeError:
+        rows = user.data_rows = {}
+    current = rows.get(filename)
+    if current is None or column in current[1]:
+        if mode == 'sequential':
+            index = data_file.next_index()
+        elif mode == 'random':
+            index = random.randrange(len(data_file))
+        else:
+            index = _next_unique(user, data_file)
+        current = rows[filename] = (data_file.row(index), {})
+    row, read = current
+    read[column] = True
+    index = data_file.column(column)
+    if index >= len(row):
+        return ''
+    return row[index]
+
+
+def _next_unique(user, data_file):
+    """Return the index of the next row in ``user``'s own range.
+    """
+    # (next, end) of each user's range, indexed by DataFile
+    try:
+        ranges = user.data_ranges
+    except AttributeError:
+        ranges = user.data_ranges = {}
+    if data_file not in ranges:
+        worker, workers = user.worker()
+        ranges[data_file] = partition(len(data_file), worker, workers)
+    index, end = ranges[data_file]
+    if index >= end:
+        raise DataExhausted("Worker %d of %d has used all of its rows in %s" %
+                            (user.worker() + (data_file.filename,)))
+    ranges[data_file] = (index + 1, end)
+    return index
@@ -0,0 +1,200 @@
+# dump.py
+
+"""This module provides a `FailureDumper`, which saves the response bodies of
+failed captures to separate files instead of writing them to the main log.
+
+When a capture expression is not matched, `~webtest.runner.WebtestRunner`
+normally writes the entire response body to the log. During an outage, when
+every thread is getting the same error page on every iteration, this can fill
+the log with identical copies of it. To avoid this, pass a `FailureDumper` to
+`~webtest.runner.get_test_runner`::
+
+    from webtest.dump import FailureDumper
+    dumper = FailureDumper('failures', rate=1.0, burst=10)
+    TestRunner = get_test_runner(my_tests, failure_dumper=dumper)
+
+Each response body is then saved in the ``failures`` directory, in a file named
+after the MD5 hash of the body, and the log gets a single line referring to
+that file. Bodies are deduplicated by their hash, so an error page that is
+received a thousand times is only saved once.
+
+To limit disk I/O further, new files are written at a rate of at most ``rate``
+per second, with bursts of up to ``burst`` files (a token bucket), and no more
+than ``max_bytes`` are written in total. Bodies that are not saved for either
+reason, or because writing the file failed, are only mentioned in the log.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import os
+import random
+import threading
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+# Maximum number of saved filenames to remember. When this is reached, they
+# are all forgotten; bodies saved earlier are then found on disk instead.
+_MAX_SAVED = 10000
+
+
+class FailureDumper:
+    """Saves response bodies to content-hashed files, with deduplication,
+    rate limiting and a total size cap.
+
+    Optional keyword arguments:
+
+        ``directory``
+            Directory where response bodies are saved. It is created if it
+            does not exist.
+        ``rate``
+            Maximum average number of files written per second.
+        ``burst``
+            Maximum number of files that may be written at once, after a
+            period with no failures.
+        ``max_bytes``
+            Maximum number of bytes to write, in total.
+        ``sample``
+            Fraction of failures to consider saving, between 0.0 and 1.0.
+
+    """
+    def __init__(self, directory='failures', rate=1.0, burst=10,
+                 max_bytes=100 * 1024 * 1024, sample=1.0):
+        """Create a FailureDumper.
+        """
+        self.directory = directory
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_bytes = max_bytes
+        self.sample = sample
+        # Number of bytes written so far
+        self.bytes_written = 0
+        # Number of failures not saved, due to sampling, limits or errors
+        self.suppressed = 0
+        # Filenames of saved (or reserved) bodies, indexed by hash
+        self._saved = {}
+        # Token bucket
+        self._tokens = self.burst
+        self._last_refill = time.time()
+        self._lock = threading.Lock()
+
+
+    def dump(self, body, description=''):
+        """Save the given response body, if it has not been saved already and
+        no limits have been reached. Return a one-line message, suitable for
+        logging, that says where the body was saved, or why it wasn't.
+
+        ``description`` is written to the file before the body, to explain
+        where it came from.
+        """
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        digest = md5(body).hexdigest()
+        filename = os.path.join(self.directory, digest + '.txt')
+
+        self._lock.acquire()
+        try:
+            saved = self._saved.get(digest)
+        finally:
+            self._lock.release()
+        if saved:
+            return "Response body same as %s" % saved
+        # Saved by another process, or an earlier run
+        if os.path.exists(filename):
+            self._lock.acquire()
+            try:
+                self._remember(digest, filename)
+            finally:
+                self._lock.release()
+            return "Response body same as %s" % filename
+
+        # Reserve the filename and the space needed, so the file can be
+        # written without holding the lock
+        content = description + '\n\n' + body
+        self._lock.acquire()
+        try:
+            # Reserved by another thread in the meantime
+            if digest in self._saved:
+                return "Response body same as %s" % self._saved[digest]
+            if self.sample < 1.0 and random.random() >= self.sample:
+                self.suppressed += 1
+                return "Response body not saved (not sampled)"
+            if not self._take_token():
+                self.suppressed += 1
+                return "Response body not saved (rate limit reached)"
+            if self.bytes_written + len(content) > self.max_bytes:
+                self.suppressed += 1
+                return "Response body not saved (size limit reached)"
+            self._remember(digest, filename)
+            self.bytes_written += len(content)
+        finally:
+            self._lock.release()
+
+        try:
+            self._write(filename, content)
+        except (IOError, OSError), e:
+            # Give back the reservation, so a later failure can try again
+            self._lock.acquire()
+            try:
+                if self._saved.get(digest) == filename:
+                    del self._saved[digest]
+                self.bytes_written -= len(content)
+                self.suppressed += 1
+            finally:
+                self._lock.release()
+            return "Response body not saved (%s)" % e
+        return "Response body saved to %s" % filename
+
+
+    def _remember(self, digest, filename):
+        """Record that the body with the given digest is saved in
+        ``filename``. Must be called with the lock held.
+        """
+        if len(self._saved) >= _MAX_SAVED:
+            self._saved.clear()
+        self._saved[digest] = filename
+
+
+    def _take_token(self):
+        """Refill the token bucket according to the time elapsed, then take
+        a token from it. Return False if there are none left.
+        """
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+
+    def _write(self, filename, content):
+        """Write ``content`` to the given file, creating the directory if
+        necessary. The file is written under a temporary name first, so
+        other processes never see a partial file.
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Created by another thread or process in the meantime
+                pass
+        # Unique among threads, and among processes sharing the directory
+        pid = 0
+        if hasattr(os, 'getpid'):
+            pid = os.getpid()
+        temp_filename = '%s.%d.%d.tmp' % (filename, pid, id(content))
+        outfile = open(temp_filename, 'wb')
+        outfile.write(content)
+        outfile.close()
+        try:
+            os.rename(temp_filename, filename)
+        except OSError:
+            # Another process saved the same body first (on Windows,
+            # rename does not replace an existing file)
+            os.remove(temp_filename)
+
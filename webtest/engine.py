@@ -0,0 +1,1475 @@
+# engine.py
+
+"""This module provides an `Engine`, which runs webtests without Grinder or
+Jython, from a single CPython process.
+
+Under Grinder, each virtual user is a worker thread, blocked in the JVM while
+it waits for a response or sleeps between requests. The `Engine` instead runs
+each virtual user as a coroutine, and all of them share one operating system
+thread and one event loop. A single process can then simulate thousands of
+users, for far less memory and CPU time. To use more than one core, split the
+users between several processes with `run_processes`.
+
+The engine takes the same ``TestRunner`` class that
+`~webtest.runner.get_test_runner` returns, so the same
+`~webtest.runner.TestSet`\s, variables, macros, captures, think times,
+transactions and sequencing apply::
+
+    from webtest.runner import TestSet, get_test_runner
+    from webtest.engine import Engine
+
+    TestRunner = get_test_runner([TestSet('my_test.webtest')],
+                                 think_time=500, variables={'SERVER': 'test'})
+    engine = Engine(TestRunner, users=500, duration=600, ramp_up=60)
+    engine.run()
+    print(engine.summary())
+
+Or, from the command line, with a script that defines ``TestRunner`` in the
+same way as a Grinder script does::
+
+    $ python -m webtest.engine --users 500 --duration 600 grinder_webtest.py
+
+To use every core of the machine, `run_processes` forks one worker process per
+CPU (or ``processes`` of them), each with its own `Engine` running its share of
+the users, and returns an `Engine` holding all their statistics, merged::
+
+    engine = run_processes(TestRunner, users=2000, duration=600)
+    print(engine.summary())
+
+or, from the command line, ``--processes 0`` (for one per CPU) or
+``--processes N``. Users are numbered across all the processes, so ``'thread'``
+sequencing gives each user the same test set it would in a single process, and
+``unique`` data sources (see `webtest.data`) split their rows between all the
+users. Other sequences make their random choices independently in each
+process.
+The merged statistics are kept in the engine that `run_processes` returns.
+Histograms are sent back from each process and merged, and written to a single
+histogram file. Recorder and trace files are written separately by each
+process, with the process number added to their names (``responses-0.rec``,
+``responses-1.rec`` and so on).
+
+Each user runs the ``before_set`` once, then iterations of the test sets until
+it has run ``iterations`` of them, or ``duration`` seconds have passed since
+the engine started, then the ``after_set``. Users are started evenly over the
+first ``ramp_up`` seconds. An iteration stops at the first failed capture or
+connection error, and the user goes on to the next one. With a
+``session_pool`` (see `webtest.session`), the ``before_set`` and ``after_set``
+are instead run when sessions are created and refreshed, and a user waiting for
+a session sleeps without blocking the others; the pool is shared by the users
+in each process.
+
+Each user has its own variables, cookies and keep-alive connections, one per
+host. Requests are sent with HTTP/1.1, with the same default headers as under
+Grinder; redirects are not followed. HTTPS needs the ``ssl`` module, and
+server certificates are not checked. With ``discard_bodies=True`` given to
+`~webtest.runner.get_test_runner`, the bodies of responses to requests with no
+``Capture`` of the body are counted as they arrive, but not kept.
+
+The response times, error counts and number of requests of each test are kept
+in `stats`, and `summary` formats them as a table. Response times are also
+passed to any recorder, histograms, pacing, exporter or tracer given to
+`~webtest.runner.get_test_runner`, and sleeps to any saturation monitor, as
+they would be under Grinder. The profiler and phase timer are not used, since
+they measure time spent in a single thread.
+
+Host names are resolved once for each host, when it is first used; this is
+the only call that blocks the event loop.
+"""
+
+# This module needs CPython 2.6 or later; it is not used under Grinder.
+
+from __future__ import generators
+
+import errno
+import heapq
+import os
+import random
+import select
+import socket
+import sys
+import time
+import traceback
+import urllib
+import urlparse
+from email.utils import parsedate_tz, mktime_tz
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+import clock
+import data
+import histogram
+import scope
+
+# Number of bytes to read from a socket at once
+RECV_SIZE = 65536
+
+# Time in seconds between checks that worker processes are still alive
+_POLL_INTERVAL = 1.0
+
+# Socket errors meaning "try again later" on a non-blocking socket
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS,
+                errno.EALREADY, errno.EINTR)
+
+
+class HTTPError (Exception):
+    """Raised when a server sends a response that can't be parsed.
+    """
+    pass
+
+
+class ConnectionClosed (socket.error):
+    """Raised when a server closes the connection before sending a complete
+    response.
+    """
+    pass
+
+
+# Operations yielded by coroutines to the event loop
+# ----------------------------------------------
+
+class Sleep:
+    """Resume the coroutine after ``seconds``.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class WaitRead:
+    """Resume the coroutine when ``sock`` is readable, or throw a
+    ``socket.timeout`` into it after ``timeout`` seconds.
+    """
+    def __init__(self, sock, timeout):
+        self.sock = sock
+        self.timeout = timeout
+
+
+class WaitWrite (WaitRead):
+    """Resume the coroutine when ``sock`` is writable, or throw a
+    ``socket.timeout`` into it after ``timeout`` seconds.
+    """
+    pass
+
+
+class Return:
+    """Finish the coroutine, and send ``value`` to the coroutine that called it.
+    """
+    def __init__(self, value=None):
+        self.value = value
+
+
+class Task:
+    """A stack of generators, run by the event loop as one coroutine. Yielding
+    a generator calls it; yielding a `Return` or finishing returns to the
+    caller.
+    """
+    def __init__(self, generator, name):
+        self.stack = [generator]
+        self.name = name
+        # The operation this task is waiting for, if any
+        self.waiting = None
+
+
+def _wait_for(error, default):
+    """Return `WaitRead` or `WaitWrite`, if the given socket error means the
+    operation should be retried when the socket is ready, or ``None``.
+    ``default`` is returned for plain "would block" errors.
+    """
+    if ssl and isinstance(error, ssl.SSLError):
+        if error.args[0] == ssl.SSL_ERROR_WANT_READ:
+            return WaitRead
+        if error.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+            return WaitWrite
+        return None
+    if error.args and error.args[0] in _WOULD_BLOCK:
+        return default
+    return None
+
+
+# HTTP client
+# ----------------------------------------------
+
+class Response:
+    """An HTTP response, with the same methods as Grinder's ``HTTPResponse``
+    that the runner uses.
+    """
+    def __init__(self, version, status, reason, headers, body):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        # List of (name, value), in the order received
+        self.headers = headers
+        # Body, or None if it was discarded
+        self.body = body
+        # Length of the body, in bytes, even if it was discarded
+        self.length = len(body or '')
+        self.keep_alive = True
+
+
+    def getStatusCode(self):
+        return self.status
+
+
+    def getText(self):
+        return self.body or ''
+
+
+    def getData(self):
+        return self.body
+
+
+    def listHeaders(self):
+        return [name for name, value in self.headers]
+
+
+    def getHeader(self, name):
+        """Return the value of the first header with the given name, ignoring
+        case, or ``None``.
+        """
+        name = name.lower()
+        for header, value in self.headers:
+            if header.lower() == name:
+                return value
+        return None
+
+
+    def getHeaders(self, name):
+        """Return a list of the values of all headers with the given name.
+        """
+        name = name.lower()
+        return [value for header, value in self.headers
+                if header.lower() == name]
+
+
+class CookieJar:
+    """Cookies set by responses to a single virtual user.
+    """
+    def __init__(self):
+        # (value, host_only), indexed by (domain, path, name)
+        self.cookies = {}
+
+
+    def update(self, host, path, response):
+        """Store or delete the cookies in any ``Set-Cookie`` headers of a
+        response to a request for ``path`` on ``host``.
+        """
+        for header in response.getHeaders('Set-Cookie'):
+            parts = header.split(';')
+            if '=' not in parts[0]:
+                continue
+            name, value = parts[0].split('=', 1)
+            name = name.strip()
+            domain = host
+            host_only = True
+            cookie_path = path.split('?', 1)[0]
+            cookie_path = cookie_path[:cookie_path.rfind('/') + 1] or '/'
+            expired = False
+            for part in parts[1:]:
+                if '=' in part:
+                    attribute, attribute_value = part.split('=', 1)
+                else:
+                    attribute, attribute_value = part, ''
+                attribute = attribute.strip().lower()
+                attribute_value = attribute_value.strip()
+                if attribute == 'domain' and attribute_value:
+                    domain = attribute_value.lstrip('.').lower()
+                    host_only = False
+                elif attribute == 'path' and attribute_value.startswith('/'):
+                    cookie_path = attribute_value
+                elif attribute == 'max-age':
+                    try:
+                        expired = int(attribute_value) <= 0
+                    except ValueError:
+                        pass
+                elif attribute == 'expires':
+                    date = parsedate_tz(attribute_value)
+                    if date:
+                        expired = mktime_tz(date) <= time.time()
+            key = (domain, cookie_path, name)
+            if expired:
+                if key in self.cookies:
+                    del self.cookies[key]
+            else:
+                self.cookies[key] = (value.strip(), host_only)
+
+
+    def header(self, host, path):
+        """Return the ``Cookie`` header to send with a request for ``path``
+        on ``host``, or ``None`` if there are no matching cookies.
+        """
+        path = path.split('?', 1)[0]
+        pairs = []
+        for (domain, cookie_path, name), (value, host_only) in \
+                self.cookies.items():
+            if host != domain and \
+               (host_only or not host.endswith('.' + domain)):
+                continue
+            if path != cookie_path and not (path.startswith(cookie_path) and
+                    (cookie_path.endswith('/') or path[len(cookie_path)] == '/')):
+                continue
+            # Longer paths first
+            pairs.append((-len(cookie_path), name, value))
+        if not pairs:
+            return None
+        pairs.sort()
+        return '; '.join(['%s=%s' % (name, value)
+                          for length, name, value in pairs])
+
+
+class Connection:
+    """A keep-alive connection to a single host, used by a single virtual user.
+    All the methods here that do I/O are coroutines.
+    """
+    def __init__(self, engine, scheme, host, port):
+        self.engine = engine
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = engine.timeout
+        self.sock = None
+        self.buffer = ''
+        # Whether any part of the current response has been received
+        self.received = False
+
+
+    def open(self):
+        """Connect to the host, and do the SSL handshake for ``https``.
+        """
+        family, address = self.engine.resolve(self.host, self.port)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        error = sock.connect_ex(address)
+        if error in _WOULD_BLOCK:
+            try:
+                yield WaitWrite(sock, self.timeout)
+            except:
+                sock.close()
+                raise
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error and error != errno.EISCONN:
+            sock.close()
+            raise socket.error(error, os.strerror(error))
+        if self.scheme == 'https':
+            if ssl is None:
+                sock.close()
+                raise HTTPError("HTTPS requests need the ssl module")
+            if hasattr(ssl, 'SSLContext'):
+                context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+                sock = context.wrap_socket(sock, server_hostname=self.host,
+                                           do_handshake_on_connect=False)
+            else:
+                sock = ssl.wrap_socket(sock, do_handshake_on_connect=False)
+            while True:
+                try:
+                    sock.do_handshake()
+                    break
+                except socket.error, error:
+                    wait = _wait_for(error, WaitRead)
+                    if wait is None:
+                        sock.close()
+                        raise
+                    yield wait(sock, self.timeout)
+        self.sock = sock
+        self.buffer = ''
+
+
+    def close(self):
+        """Close the connection, if it's open.
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.buffer = ''
+
+
+    def send_all(self, data):
+        """Send all of ``data``.
+        """
+        while data:
+            try:
+                sent = self.sock.send(data)
+            except socket.error, error:
+                wait = _wait_for(error, WaitWrite)
+                if wait is None:
+                    raise
+                yield wait(self.sock, self.timeout)
+                continue
+            data = data[sent:]
+
+
+    def recv(self):
+        """Return the next data received, or ``''`` if the connection was
+        closed.
+        """
+        while True:
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except socket.error, error:
+                wait = _wait_for(error, WaitRead)
+                if wait is None:
+                    raise
+                yield wait(self.sock, self.timeout)
+                continue
+            if data:
+                self.received = True
+            yield Return(data)
+
+
+    def read_line(self):
+        """Return the next line received, without its line ending.
+        """
+        while True:
+            end = self.buffer.find('\n')
+            if end >= 0:
+                break
+            data = yield self.recv()
+            if not data:
+                raise ConnectionClosed("Connection closed by %s" % self.host)
+            self.buffer += data
+        line = self.buffer[:end]
+        self.buffer = self.buffer[end + 1:]
+        if line.endswith('\r'):
+            line = line[:-1]
+        yield Return(line)
+
+
+    def read_exact(self, length, discard=False):
+        """Return the next ``length`` bytes received; or if ``discard`` is
+        True, receive them without keeping them, and return ``None``.
+        """
+        chunks = [self.buffer[:length]]
+        received = len(chunks[0])
+        self.buffer = self.buffer[length:]
+        while received < length:
+            data = yield self.recv()
+            if not data:
+                raise ConnectionClosed("Connection closed by %s" % self.host)
+            received += len(data)
+            if received > length:
+                self.buffer = data[length - received:]
+                data = data[:length - received]
+            if not discard:
+                chunks.append(data)
+        if discard:
+            yield Return(None)
+        yield Return(''.join(chunks))
+
+
+    def read_to_close(self, discard=False):
+        """Return ``(data, length)``, for all the data received until the
+        connection is closed. If ``discard`` is True, the data is not kept,
+        and ``None`` is returned in its place.
+        """
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        self.buffer = ''
+        while True:
+            data = yield self.recv()
+            if not data:
+                break
+            length += len(data)
+            if not discard:
+                chunks.append(data)
+        if discard:
+            yield Return((None, length))
+        yield Return((''.join(chunks), length))
+
+
+    def read_response(self, method, discard=False):
+        """Read a response to a request sent with the given method, and return
+        it as a `Response`. If ``discard`` is True, the body is counted, but
+        not kept.
+        """
+        self.received = bool(self.buffer)
+        while True:
+            line = yield self.read_line()
+            parts = line.split(None, 2)
+            if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+                raise HTTPError("Bad status line from %s: %r" %
+                                (self.host, line))
+            try:
+                status = int(parts[1])
+            except ValueError:
+                raise HTTPError("Bad status line from %s: %r" %
+                                (self.host, line))
+            headers = []
+            while True:
+                line = yield self.read_line()
+                if not line:
+                    break
+                if line[0] in ' \t' and headers:
+                    name, value = headers[-1]
+                    headers[-1] = (name, value + ' ' + line.strip())
+                elif ':' in line:
+                    name, value = line.split(':', 1)
+                    headers.append((name.strip(), value.strip()))
+            # Skip any interim responses, such as 100 Continue
+            if not (100 <= status < 200):
+                break
+        if len(parts) > 2:
+            reason = parts[2]
+        else:
+            reason = ''
+        response = Response(parts[0], status, reason, headers, '')
+
+        connection = (response.getHeader('Connection') or '').lower()
+        if response.version == 'HTTP/1.0':
+            response.keep_alive = 'keep-alive' in connection
+        else:
+            response.keep_alive = 'close' not in connection
+
+        length = response.getHeader('Content-Length')
+        encoding = (response.getHeader('Transfer-Encoding') or '').lower()
+        if method == 'HEAD' or status in (204, 304):
+            pass
+        elif 'chunked' in encoding:
+            chunks = []
+            response.length = 0
+            while True:
+                line = yield self.read_line()
+                try:
+                    size = int(line.split(';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise HTTPError("Bad chunk size from %s: %r" %
+                                    (self.host, line))
+                if size == 0:
+                    break
+                chunk = yield self.read_exact(size, discard)
+                if not discard:
+                    chunks.append(chunk)
+                response.length += size
+                yield self.read_line()
+            # Skip any trailers
+            while True:
+                line = yield self.read_line()
+                if not line:
+                    break
+            if discard:
+                response.body = None
+            else:
+                response.body = ''.join(chunks)
+        elif length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                raise HTTPError("Bad Content-Length from %s: %r" %
+                                (self.host, length))
+            response.body = yield self.read_exact(length, discard)
+            response.length = length
+        else:
+            response.body, response.length = \
+                yield self.read_to_close(discard)
+            response.keep_alive = False
+        yield Return(response)
+
+
+def format_request(method, path, headers, body):
+    """Return the text of an HTTP/1.1 request.
+    """
+    lines = ['%s %s HTTP/1.1' % (method, path)]
+    for name, value in headers:
+        lines.append('%s: %s' % (name, value))
+    lines.append('')
+    lines.append('')
+    text = '\r\n'.join(lines)
+    if body:
+        text += body
+    return text
+
+
+# Virtual users and the engine
+# ----------------------------------------------
+
+def _user_class(test_runner, total_users):
+    """Return a class of virtual users for the given ``TestRunner`` class,
+    in a test with ``total_users`` users. Virtual users are created without
+    running the ``before_set``; the engine runs it instead.
+    """
+    class VirtualUser (test_runner):
+        def __init__(self, number):
+            self.number = number
+            self.variables = scope.Scope(
+                getattr(test_runner, 'default_variables', {}))
+            self.recording = False
+            self.next_start = None
+            # All users share the engine's thread, so each is traced as a
+            # separate track
+            self.trace_track = number
+            self.cookies = CookieJar()
+            # Connections, indexed by (scheme, host, port)
+            self.connections = {}
+
+        def __del__(self):
+            pass
+
+        def thread_number(self):
+            return self.number
+
+        def _get_cookies(self):
+            return dict(self.cookies.cookies)
+
+        def _set_cookies(self, cookies):
+            self.cookies.cookies = dict(cookies)
+
+        def worker(self):
+            return self.number, total_users
+
+        def close_connections(self):
+            for connection in self.connections.values():
+                connection.close()
+            self.connections = {}
+
+    return VirtualUser
+
+
+class TestStatistics:
+    """Statistics for a single test number.
+    """
+    def __init__(self, description, transaction=False, significant_digits=2):
+        self.description = description
+        # Whether the test is a transaction, rather than a single request
+        self.transaction = transaction
+        self.count = 0
+        self.errors = 0
+        # Total length of response bodies, in bytes
+        self.bytes = 0
+        # Response times, in microseconds
+        self.times = histogram.Histogram(significant_digits)
+
+
+class Engine:
+    """Runs webtests with many virtual users, as coroutines in a single event
+    loop.
+
+    Arguments:
+
+        ``test_runner``
+            A ``TestRunner`` class returned by `~webtest.runner.get_test_runner`.
+
+    Optional keyword arguments:
+
+        ``users``
+            Number of virtual users.
+        ``iterations``
+            Number of iterations each user runs, or ``None`` to keep running
+            until ``duration`` has passed.
+        ``duration``
+            Time in seconds after which users stop starting new iterations,
+            or ``None`` for no limit.
+        ``ramp_up``
+            Time in seconds over which the users are started.
+        ``sleep_variation``
+            Fraction by which think times are randomly varied, like Grinder's
+            ``grinder.sleepTimeVariation`` property.
+        ``timeout``
+            Time in seconds to wait for a connection, or for data from a
+            server, before the request fails.
+        ``first_user``, ``total_users``
+            When the users are split between processes, the number of this
+            engine's first user, and the number of users in all processes.
+            Users are numbered, and started during the ramp-up, as if all
+            of them were in one engine.
+
+    """
+    def __init__(self, test_runner, users=1, iterations=1, duration=None,
+                 ramp_up=0, sleep_variation=0.2, timeout=60, first_user=0,
+                 total_users=None):
+        """Create an Engine.
+        """
+        if users < 1:
+            raise ValueError("users must be at least 1.")
+        if total_users is None:
+            total_users = first_user + users
+        if not iterations and not duration:
+            raise ValueError("iterations or duration must be given.")
+        self.test_runner = test_runner
+        # The runner module that test_runner came from
+        self.runner = sys.modules[test_runner.__module__]
+        self.user_class = _user_class(test_runner, total_users)
+        self.users = users
+        self.first_user = first_user
+        self.total_users = total_users
+        self.iterations = iterations
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.sleep_variation = sleep_variation
+        self.timeout = timeout
+        # TestStatistics, indexed by test number
+        self.stats = {}
+        # Number of iterations finished, and stopped by errors
+        self.finished = 0
+        self.aborted = 0
+        # Time taken by run(), in seconds
+        self.elapsed = 0.0
+        # Errors that stop an iteration
+        self.abort_errors = (self.runner.CaptureFailed,
+                             self.runner.BadRequestMethod,
+                             socket.error, HTTPError)
+        # (family, address), indexed by (host, port)
+        self._addresses = {}
+        # Heap of (time, sequence, task, operation)
+        self._timers = []
+        self._sequence = 0
+        # (task, operation), indexed by file descriptor
+        self._waiting = {}
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+        else:
+            self._poll = None
+        self._deadline = None
+        # Number of tasks that have not yet finished
+        self._tasks = 0
+
+
+    def log(self, message, *args):
+        """Write a message to the runner's log.
+        """
+        self.runner._log(message, *args)
+
+
+    def log_error(self, message, *args):
+        """Write an error message to the runner's log, so that it is never
+        dropped by a `~webtest.logsink.LogSink`.
+        """
+        self.runner._log_error(message, *args)
+
+
+    def resolve(self, host, port):
+        """Return ``(family, address)`` to connect to ``port`` on ``host``.
+        """
+        key = (host, port)
+        if key not in self._addresses:
+            info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            self._addresses[key] = (info[0][0], info[0][4])
+        return self._addresses[key]
+
+
+    # Event loop
+    # ------------------------------------------
+
+    def run(self):
+        """Run all the virtual users until they have finished.
+        """
+        start = clock.nanotime()
+        if self.duration:
+            self._deadline = start + long(self.duration * 1000000000)
+        users = []
+        for number in range(self.first_user, self.first_user + self.users):
+            user = self.user_class(number)
+            users.append(user)
+            delay = long(self.ramp_up * 1000000000) * number // self.total_users
+            task = Task(self.run_user(user), 'User %d' % number)
+            self._tasks += 1
+            self._call_at(start + delay, task, None)
+        while self._tasks:
+            self._run_once()
+        self.elapsed = (clock.nanotime() - start) / 1e9
+        # All users ran in this thread, so they finish as one
+        users[0]._finish()
+
+
+    def _call_at(self, when, task, operation):
+        """Resume ``task`` at the given time, in nanoseconds, if it is still
+        waiting for ``operation``.
+        """
+        task.waiting = operation
+        self._sequence += 1
+        heapq.heappush(self._timers, (when, self._sequence, task, operation))
+
+
+    def _run_once(self):
+        """Wait for the next timer or socket event, and resume the tasks that
+        are ready.
+        """
+        timeout = None
+        if self._timers:
+            timeout = max(0, self._timers[0][0] - clock.nanotime()) / 1e9
+        for fd in self._ready(timeout):
+            task, operation = self._waiting.pop(fd)
+            if self._poll:
+                self._poll.unregister(fd)
+            self._step(task)
+        now = clock.nanotime()
+        while self._timers and self._timers[0][0] <= now:
+            when, sequence, task, operation = heapq.heappop(self._timers)
+            # Skip timeouts of operations that are already done
+            if task.waiting is not operation:
+                continue
+            if isinstance(operation, Sleep) or operation is None:
+                self._step(task)
+            else:
+                fd = operation.sock.fileno()
+                del self._waiting[fd]
+                if self._poll:
+                    self._poll.unregister(fd)
+                self._step(task, None, (socket.timeout,
+                    socket.timeout("timed out after %s seconds" %
+                                   operation.timeout), None))
+
+
+    def _ready(self, timeout):
+        """Wait up to ``timeout`` seconds for any of the sockets being waited
+        for to be ready, and return a list of their file descriptors.
+        """
+        if self._poll:
+            if timeout is not None:
+                timeout = int(timeout * 1000 + 1)
+            while True:
+                try:
+                    return [fd for fd, event in self._poll.poll(timeout)]
+                except select.error, error:
+                    if error.args[0] != errno.EINTR:
+                        raise
+        readers = []
+        writers = []
+        for fd, (task, operation) in self._waiting.items():
+            if isinstance(operation, WaitWrite):
+                writers.append(fd)
+            else:
+                readers.append(fd)
+        if not readers and not writers:
+            time.sleep(timeout)
+            return []
+        readable, writable, errors = select.select(readers, writers, readers +
+                                                   writers, timeout)
+        return dict.fromkeys(readable + writable + errors).keys()
+
+
+    def _step(self, task, value=None, error=None):
+        """Run ``task`` until it yields an operation to wait for, or finishes.
+        """
+        task.waiting = None
+        while True:
+            generator = task.stack[-1]
+            try:
+                if error:
+                    operation = generator.throw(*error)
+                else:
+                    operation = generator.send(value)
+            except StopIteration:
+                task.stack.pop()
+                value, error = None, None
+            except:
+                task.stack.pop()
+                value, error = None, sys.exc_info()
+            else:
+                value, error = None, None
+                if isinstance(operation, Return):
+                    task.stack.pop().close()
+                    value = operation.value
+                elif hasattr(operation, 'send'):
+                    task.stack.append(operation)
+                    continue
+                elif isinstance(operation, Sleep):
+                    self._call_at(clock.nanotime() +
+                                  long(operation.seconds * 1000000000),
+                                  task, operation)
+                    return
+                elif isinstance(operation, WaitRead):
+                    fd = operation.sock.fileno()
+                    self._waiting[fd] = (task, operation)
+                    if self._poll:
+                        if isinstance(operation, WaitWrite):
+                            self._poll.register(fd, select.POLLOUT)
+                        else:
+                            self._poll.register(fd, select.POLLIN)
+                    self._call_at(clock.nanotime() +
+                                  long(operation.timeout * 1000000000),
+                                  task, operation)
+                    return
+                else:
+                    error = (TypeError, TypeError(
+                        "Can't yield %r in a coroutine" % (operation,)), None)
+            if not task.stack:
+                self._tasks -= 1
+                if error:
+                    self.log_error("!!!!!! %s failed:\n%s", task.name,
+                                   ''.join(traceback.format_exception(*error)))
+                return
+
+
+    # Virtual user coroutines
+    # ------------------------------------------
+
+    def _stopping(self, iteration):
+        """Return True if a user that has run ``iteration`` iterations should
+        stop.
+        """
+        if self.iterations and iteration >= self.iterations:
+            return True
+        return self._deadline is not None and clock.nanotime() >= self._deadline
+
+
+    def run_user(self, user):
+        """Run the ``before_set``, the test set iterations, and the
+        ``after_set`` for a single virtual user.
+        """
+        WebtestRunner = self.runner.WebtestRunner
+        pool = WebtestRunner.session_pool
+        try:
+            if WebtestRunner.before_set and not pool:
+                yield self.run_test_set(user, WebtestRunner.before_set)
+            iteration = 0
+            while not self._stopping(iteration):
+                if WebtestRunner.recorder:
+                    user.recording = WebtestRunner.recorder.sampled()
+                try:
+                    if pool:
+                        yield self.run_pooled(user, pool)
+                    else:
+                        yield self.run_iteration(user)
+                except self.abort_errors, error:
+                    self.aborted += 1
+                    self.log_error("!!!!!! User %d stopped iteration %d: %s",
+                                   user.number, iteration, error)
+                except data.DataExhausted, error:
+                    self.aborted += 1
+                    self.log_error("!!!!!! User %d stopped: %s",
+                                   user.number, error)
+                    break
+                iteration += 1
+                self.finished += 1
+            if WebtestRunner.after_set and not pool:
+                yield self.run_test_set(user, WebtestRunner.after_set)
+        finally:
+            user.close_connections()
+
+
+    def run_pooled(self, user, pool):
+        """Run a single iteration of the test sets for a virtual user, with a
+        session checked out of the given `~webtest.session.SessionPool`.
+        """
+        WebtestRunner = self.runner.WebtestRunner
+        # Never block the event loop waiting for a session
+        pooled = pool.acquire(False)
+        while pooled is None:
+            yield Sleep(0.01)
+            pooled = pool.acquire(False)
+        valid = False
+        try:
+            if pool.needs_login(pooled):
+                # Log out of an expired session first
+                if pooled.logged_in() and WebtestRunner.after_set:
+                    user._restore_session(pooled)
+                    yield self.run_test_set(user, WebtestRunner.after_set)
+                user._reset_session()
+                yield self.run_test_set(user, WebtestRunner.before_set)
+                user._save_session(pooled)
+                pool.logged_in(pooled)
+            else:
+                user._restore_session(pooled)
+            yield self.run_iteration(user)
+            user._save_session(pooled)
+            valid = True
+        finally:
+            pool.release(pooled, valid)
+
+
+    def run_iteration(self, user):
+        """Run the test sets chosen for a single iteration of a virtual user,
+        in the ``variable_scope`` given to `~webtest.runner.get_test_runner`.
+        """
+        user._push_scope('iteration')
+        try:
+            for test_set in user.choose_test_sets(user.number):
+                user._push_scope('test_set')
+                try:
+                    yield self.run_test_set(user, test_set)
+                finally:
+                    user._pop_scope('test_set')
+        finally:
+            user._pop_scope('iteration')
+
+
+    def run_test_set(self, user, test_set):
+        """Run all ``.webtest`` files in the given `TestSet`, then sleep
+        between scenarios.
+        """
+        WebtestRunner = self.runner.WebtestRunner
+        for filename in test_set.filenames:
+            if WebtestRunner.log_tests:
+                self.log(WebtestRunner.file_headings[filename])
+            for step in WebtestRunner.webtest_steps[filename]:
+                if isinstance(step, self.runner.Transaction):
+                    yield self.run_transaction(user, step)
+                else:
+                    yield self.run_request(user, step)
+                # Sleep between requests
+                yield self.think(user, user._think_time(step))
+        # Sleep between scenarios
+        yield self.think(user, user._scenario_think_time())
+
+
+    def vary(self, milliseconds):
+        """Return a randomly varied sleep time around ``milliseconds``.
+        """
+        if milliseconds <= 0 or self.sleep_variation <= 0:
+            return milliseconds
+        # The variation covers three standard deviations
+        varied = random.gauss(milliseconds,
+                              milliseconds * self.sleep_variation / 3.0)
+        return max(0, long(varied))
+
+
+    def _traced(self, user):
+        """Return True if the given user's requests and sleeps are traced.
+        """
+        return self.runner.WebtestRunner.tracer.sampled(
+            user.trace_track, 'User %d' % user.number)
+
+
+    def think(self, user, think_time):
+        """Sleep for ``think_time``, a ``(milliseconds, exact)`` pair.
+        """
+        milliseconds, exact = think_time
+        if not exact:
+            milliseconds = self.vary(milliseconds)
+        if milliseconds <= 0:
+            return
+        WebtestRunner = self.runner.WebtestRunner
+        start = clock.nanotime()
+        yield Sleep(milliseconds / 1000.0)
+        end = clock.nanotime()
+        if WebtestRunner.saturation_monitor:
+            WebtestRunner.saturation_monitor.record_sleep(milliseconds,
+                                                          end - start)
+        if WebtestRunner.tracer and self._traced(user):
+            WebtestRunner.tracer.span('sleep', 'sleep', start, end,
+                                      track=user.trace_track)
+
+
+    def record(self, test, elapsed, success, transaction=False, length=0):
+        """Count a request or transaction for ``test`` that took ``elapsed``
+        nanoseconds, or ``None`` if it failed before there was a response,
+        and got a response body of ``length`` bytes.
+        """
+        if isinstance(test, self.runner.UnrecordedTest):
+            return
+        number = test.getNumber()
+        try:
+            stats = self.stats[number]
+        except KeyError:
+            stats = self.stats[number] = TestStatistics(test.getDescription(),
+                                                        transaction)
+        stats.count += 1
+        stats.bytes += length
+        if not success:
+            stats.errors += 1
+        if elapsed is not None:
+            stats.times.record(elapsed // 1000)
+
+
+    def run_transaction(self, user, transaction):
+        """Run all requests in the given `~webtest.runner.Transaction`, timed
+        as a single test, with no think time between them.
+        """
+        WebtestRunner = self.runner.WebtestRunner
+        if WebtestRunner.log_tests:
+            self.log(WebtestRunner.test_headings[transaction.test.getNumber()])
+        start = clock.nanotime()
+        success = True
+        try:
+            for step in transaction.requests:
+                if not (yield self.run_request(user, step)):
+                    success = False
+        except self.abort_errors:
+            self.record(transaction.test, clock.nanotime() - start, False, True)
+            raise
+        elapsed = clock.nanotime() - start
+        self.record(transaction.test, elapsed, success, True)
+        if WebtestRunner.histograms:
+            WebtestRunner.histograms.record(transaction.test.getNumber(),
+                                            elapsed // 1000)
+
+
+    def run_request(self, user, step):
+        """Send a single ``(test, wrapper, request)`` step, and return True if
+        the response status was less than 400. Errors are counted against the
+        test, and raised.
+        """
+        test, wrapper, request = step
+        try:
+            response = yield self.execute(user, test, request)
+        except self.abort_errors, error:
+            # Failed captures were counted with the response
+            if not isinstance(error, self.runner.CaptureFailed):
+                self.record(test, None, False)
+            raise
+        yield Return(response.getStatusCode() < 400)
+
+
+    def prepare(self, user, request):
+        """Evaluate the URL, parameters, headers and body of a request, and
+        return ``(method, scheme, host, port, path, headers, body)`` to send.
+        """
+        url = user.eval_expressions(request.url)
+        parameters = user.evaluated_pairs(request.parameters)
+        headers = user.evaluated_pairs(request.headers)
+        body = None
+        if request.method == 'POST':
+            if request.body:
+                body = user.eval_expressions(request.body)
+            else:
+                body = urllib.urlencode(parameters)
+                headers.append(('Content-Type',
+                                'application/x-www-form-urlencoded'))
+        elif request.method == 'GET':
+            if parameters:
+                if '?' in url:
+                    url += '&' + urllib.urlencode(parameters)
+                else:
+                    url += '?' + urllib.urlencode(parameters)
+        else:
+            message = "Unknown HTTP method: '%s'" % request.method
+            message += " in request defined on line %d" % request.line_number
+            raise self.runner.BadRequestMethod(message)
+
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower() or 'http'
+        host = (parts.hostname or '').lower()
+        if not host:
+            raise HTTPError("No host in URL '%s'" % url)
+        port = parts.port
+        if port is None:
+            if scheme == 'https':
+                port = 443
+            else:
+                port = 80
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        # Request headers override the defaults. A request may repeat a
+        # header name, and every value is sent.
+        all_headers = [('Host', parts.netloc.split('@')[-1])]
+        names = {}
+        for name, value in headers:
+            if name.lower() != 'host':
+                names[name.lower()] = True
+                all_headers.append((name, value))
+        for name, value in self.runner.DEFAULT_HEADERS:
+            if name.lower() not in names:
+                all_headers.append((name, value))
+        cookie = user.cookies.header(host, path)
+        if cookie:
+            all_headers.append(('Cookie', cookie))
+        if body is not None:
+            all_headers.append(('Content-Length', str(len(body))))
+        return request.method, scheme, host, port, path, all_headers, body
+
+
+    def fetch(self, user, method, scheme, host, port, path, headers, body,
+              discard=False):
+        """Send a request on the user's connection to the host, and return
+        the `Response`, with its body discarded if ``discard`` is True. If a
+        kept-alive connection was closed by the server before it responded,
+        the request is sent once more on a new one. On any other error, the
+        connection is closed.
+        """
+        key = (scheme, host, port)
+        connection = user.connections.get(key)
+        if connection is None:
+            connection = user.connections[key] = \
+                Connection(self, scheme, host, port)
+        data = format_request(method, path, headers, body)
+        for attempt in (1, 2):
+            reused = connection.sock is not None
+            if not reused:
+                yield connection.open()
+            try:
+                yield connection.send_all(data)
+                response = yield connection.read_response(method, discard)
+                break
+            except socket.error, error:
+                connection.close()
+                if not reused or connection.received or \
+                   isinstance(error, socket.timeout):
+                    raise
+            except:
+                # Don't leave a half-read response on a kept-alive connection
+                connection.close()
+                raise
+        if not response.keep_alive:
+            connection.close()
+        user.cookies.update(host, path, response)
+        yield Return(response)
+
+
+    def execute(self, user, test, request):
+        """Send a `~webtest.parser.Request` for ``test``, and return the
+        `Response`, as `~webtest.runner.WebtestRunner.execute` does under
+        Grinder.
+        """
+        WebtestRunner = self.runner.WebtestRunner
+        tracing = WebtestRunner.tracer and self._traced(user)
+        if tracing:
+            traced = clock.nanotime()
+        if WebtestRunner.log_tests:
+            self.log(WebtestRunner.test_headings[test.getNumber()])
+
+        method, scheme, host, port, path, headers, body = \
+            self.prepare(user, request)
+        discard = WebtestRunner.discard_bodies and \
+                  not self.runner._captures_body(request)
+        start = clock.nanotime()
+        response = yield self.fetch(user, method, scheme, host, port, path,
+                                    headers, body, discard)
+        end = clock.nanotime()
+        user._record_timing(test, response, start, end, tracing)
+
+        if WebtestRunner.log_debug:
+            self.log("------ Response from %s: ------", test.getDescription())
+            user.log_response(response)
+        if request.capture:
+            try:
+                user.eval_capture(request, response)
+            except self.runner.CaptureFailed:
+                self.record(test, end - start, False, length=response.length)
+                raise
+        self.record(test, end - start, response.getStatusCode() < 400,
+                    length=response.length)
+        if tracing:
+            WebtestRunner.tracer.span(test.getDescription(), 'request', traced,
+                clock.nanotime(), {'test': test.getNumber()}, user.trace_track)
+        yield Return(response)
+
+
+    # Results
+    # ------------------------------------------
+
+    def results(self):
+        """Return the statistics of a finished run, to be passed to `merge`.
+        """
+        return {
+            'stats': self.stats,
+            'finished': self.finished,
+            'aborted': self.aborted,
+            'elapsed': self.elapsed,
+        }
+
+
+    def merge(self, results):
+        """Add the statistics of another engine's run, returned by its
+        `results`, to this engine's.
+        """
+        for number, other in results['stats'].items():
+            if number in self.stats:
+                stats = self.stats[number]
+                stats.count += other.count
+                stats.errors += other.errors
+                stats.bytes += other.bytes
+                stats.times.merge(other.times)
+            else:
+                self.stats[number] = other
+        self.finished += results['finished']
+        self.aborted += results['aborted']
+        self.elapsed = max(self.elapsed, results['elapsed'])
+
+
+    def summary(self):
+        """Return a summary of the run: the number of requests, errors, bytes
+        received and iterations, then a table of response time percentiles
+        per test.
+        """
+        count = 0
+        errors = 0
+        length = 0
+        histograms = {}
+        for number, stats in self.stats.items():
+            if not stats.transaction:
+                count += stats.count
+                errors += stats.errors
+                length += stats.bytes
+            histograms[(number, 'response')] = stats.times
+        if self.elapsed:
+            rate = count / self.elapsed
+        else:
+            rate = 0.0
+        lines = ["%d requests, %d errors, %d bytes received, in %.1f s "
+                 "(%.1f requests/s)" % (count, errors, length, self.elapsed,
+                                        rate),
+                 "%d iterations by %d users, %d stopped by errors" %
+                 (self.finished, self.users, self.aborted),
+                 histogram.format_table(histograms)]
+        numbers = self.stats.keys()
+        numbers.sort()
+        for number in numbers:
+            stats = self.stats[number]
+            if stats.errors:
+                lines.append("Test %d: %d errors in %d: %s" % (number,
+                             stats.errors, stats.count, stats.description))
+        return '\n'.join(lines)
+
+
+def _process_filename(filename, index):
+    """Return ``filename`` with the worker process ``index`` added before its
+    extension, such as ``responses-1.rec`` for ``responses.rec``.
+    """
+    root, extension = os.path.splitext(filename)
+    return '%s-%d%s' % (root, index, extension)
+
+
+def _run_process(queue, index, test_runner, options):
+    """Run an engine with the given options, in worker process ``index``
+    started by `run_processes`, and put ``(index, results)`` in ``queue``.
+    Histograms are sent back with the results, instead of being written.
+    """
+    # Don't make the same random choices as every other process
+    random.seed()
+    try:
+        engine = Engine(test_runner, **options)
+        WebtestRunner = engine.runner.WebtestRunner
+        # Don't write over other processes' files
+        histograms = WebtestRunner.histograms
+        if histograms:
+            histograms.filename = None
+        recorder = WebtestRunner.recorder
+        if recorder:
+            recorder.filename = _process_filename(recorder.filename, index)
+            recorder.index_filename = recorder.filename + '.idx'
+        tracer = WebtestRunner.tracer
+        if tracer:
+            tracer.filename = _process_filename(tracer.filename, index)
+        engine.run()
+        results = engine.results()
+        if histograms:
+            results['histograms'] = histograms.merged()
+        queue.put((index, results))
+    except:
+        queue.put((index,
+                   ''.join(traceback.format_exception(*sys.exc_info()))))
+
+
+def run_processes(test_runner, processes=None, users=1, **options):
+    """Run ``users`` virtual users, split as evenly as possible between
+    ``processes`` worker processes, each with its own `Engine`, and return an
+    `Engine` holding their merged statistics. If ``processes`` is ``None``,
+    one is started for each CPU. Any other keyword arguments are passed to
+    each `Engine`.
+
+    The worker processes are forked, so this only works where ``os.fork``
+    does. Users are numbered from 0 across all processes, so ``'thread'``
+    sequencing assigns test sets as it would in a single engine. If any
+    worker fails, or dies without reporting its results, `RuntimeError` is
+    raised once the others have finished.
+
+    Each worker's histograms are merged into the ``TestRunner``'s
+    `~webtest.histogram.HistogramRecorder`, which writes them once all the
+    workers have reported. Recorder and trace files are written separately by
+    each worker, named as by `_process_filename`.
+    """
+    import multiprocessing
+    import Queue
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, users))
+    # Check the options before starting any processes
+    merged = Engine(test_runner, users=users, **options)
+    queue = multiprocessing.Queue()
+    histograms = merged.runner.WebtestRunner.histograms
+    workers = []
+    first_user = 0
+    for index in range(processes):
+        count = users // processes
+        if index < users % processes:
+            count += 1
+        process_options = dict(options)
+        process_options.update(users=count, first_user=first_user,
+                               total_users=users)
+        worker = multiprocessing.Process(target=_run_process,
+            args=(queue, index, test_runner, process_options))
+        worker.start()
+        workers.append(worker)
+        first_user += count
+    # Collect the results before joining, so no worker blocks on a full queue.
+    # Workers that exit without reporting are noted as failed, once they have
+    # been seen dead for a whole polling interval, in case their results were
+    # still on the way.
+    errors = []
+    reported = {}
+    dead = {}
+    while len(reported) < processes:
+        try:
+            index, results = queue.get(True, _POLL_INTERVAL)
+        except Queue.Empty:
+            for index in range(processes):
+                if index in reported or workers[index].is_alive():
+                    continue
+                if index in dead:
+                    reported[index] = True
+                    errors.append("Worker process %d exited with code %s "
+                                  "without reporting its results" %
+                                  (index, workers[index].exitcode))
+                else:
+                    dead[index] = True
+            continue
+        reported[index] = True
+        if isinstance(results, str):
+            errors.append(results)
+        else:
+            merged.merge(results)
+            if 'histograms' in results:
+                histograms.add(results['histograms'])
+    for worker in workers:
+        worker.join()
+    if histograms:
+        histograms.write()
+    if errors:
+        raise RuntimeError("%d of %d worker processes failed:\n%s" %
+                           (len(errors), processes, '\n'.join(errors)))
+    return merged
+
+
+def main(args):
+    """Run the ``TestRunner`` defined by a script with the engine, and print
+    the summary.
+    """
+    from optparse import OptionParser
+    usage = "python -m webtest.engine [options] SCRIPT"
+    option_parser = OptionParser(usage=usage)
+    option_parser.add_option('-u', '--users', dest='users', type='int',
+                             default=1, help="Number of virtual users")
+    option_parser.add_option('-i', '--iterations', dest='iterations',
+                             type='int', default=None,
+                             help="Iterations per user")
+    option_parser.add_option('-d', '--duration', dest='duration',
+                             type='float', default=None,
+                             help="Seconds to run for")
+    option_parser.add_option('-r', '--ramp-up', dest='ramp_up', type='float',
+                             default=0, help="Seconds over which to start users")
+    option_parser.add_option('-t', '--timeout', dest='timeout', type='float',
+                             default=60, help="Seconds to wait for a server")
+    option_parser.add_option('-p', '--processes', dest='processes', type='int',
+                             default=1,
+                             help="Worker processes to split users between; "
+                                  "0 for one per CPU")
+    options, filenames = option_parser.parse_args(args)
+    if len(filenames) != 1:
+        option_parser.error("A single script must be given")
+    if options.iterations is None and options.duration is None:
+        options.iterations = 1
+    script = {'__name__': '__webtest__', '__file__': filenames[0]}
+    execfile(filenames[0], script)
+    if 'TestRunner' not in script:
+        option_parser.error("%s does not define TestRunner" % filenames[0])
+    engine_options = {
+        'users': options.users,
+        'iterations': options.iterations,
+        'duration': options.duration,
+        'ramp_up': options.ramp_up,
+        'timeout': options.timeout,
+    }
+    if options.processes == 1:
+        engine = Engine(script['TestRunner'], **engine_options)
+        engine.run()
+    else:
+        engine = run_processes(script['TestRunner'],
+                               options.processes or None, **engine_options)
+    print(engine.summary())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,318 @@
+# export.py
+
+"""This module provides a `MetricsExporter`, which sends live per-test metrics
+to a statsd or InfluxDB server over UDP, for watching long test runs on a
+dashboard.
+
+To export metrics, pass a `MetricsExporter` to
+`~webtest.runner.get_test_runner`::
+
+    from webtest.export import MetricsExporter
+    exporter = MetricsExporter('127.0.0.1', 8125, protocol='statsd')
+    TestRunner = get_test_runner(my_tests, exporter=exporter)
+
+Each worker thread counts the requests, errors (responses with a status of 400
+or more) and response bytes for each test number, and records response times
+in a `~webtest.histogram.Histogram`. Every ``interval`` seconds, a background
+thread takes the counts from all threads, merges them, and sends them in as
+few UDP datagrams as possible, each no larger than ``max_datagram`` bytes.
+Sending never blocks the worker threads; if a datagram cannot be sent, it is
+counted in ``send_errors`` and dropped.
+
+With ``protocol='statsd'``, each test number's metrics are sent as::
+
+    webtest.1001.count:120|c
+    webtest.1001.errors:2|c
+    webtest.1001.bytes:604800|c
+    webtest.1001.mean:48.210|g
+    webtest.1001.p50:45.100|g
+    ...
+
+With ``protocol='influx'``, they are sent as InfluxDB line protocol::
+
+    webtest,test=1001 count=120i,errors=2i,bytes=604800i,mean=48.210,p50=45.100,... 1286236800000000000
+
+Times are in milliseconds. The percentiles sent are those in
+`~webtest.histogram.PERCENTILES`, with ``.`` replaced by ``_`` in their names
+(so p99.9 is sent as ``p99_9``), followed by ``max``.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import atexit
+import socket
+import thread
+import threading
+import time
+
+import histogram
+
+# Largest UDP payload that avoids IP fragmentation on a typical network
+DEFAULT_MAX_DATAGRAM = 1432
+
+
+def _response_length(response):
+    """Return the length of the given response's body, in bytes. If the body
+    was discarded, its length is taken from the ``Content-Length`` header.
+    """
+    try:
+        data = response.getData()
+    except AttributeError:
+        return len(response.getText())
+    if data is not None:
+        return len(data)
+    # The standalone engine counts discarded bodies itself
+    length = getattr(response, 'length', None)
+    if length is not None:
+        return length
+    try:
+        return int(response.getHeader('Content-Length'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _percentile_name(percent):
+    """Return the metric name for a percentile, such as ``p99_9``.
+    """
+    return 'p' + ('%g' % percent).replace('.', '_')
+
+
+class TestMetrics:
+    """Metrics for a single test number, accumulated over one interval.
+    """
+    def __init__(self, significant_digits=2):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        # Response times, in microseconds
+        self.times = histogram.Histogram(significant_digits)
+
+
+    def merge(self, other):
+        """Add the metrics from another `TestMetrics` to this one.
+        """
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.times.merge(other.times)
+
+
+    def fields(self):
+        """Return a list of ``(name, value)`` for the timing metrics, in
+        milliseconds.
+        """
+        fields = [('mean', self.times.mean() / 1000.0)]
+        for percent in histogram.PERCENTILES:
+            fields.append((_percentile_name(percent),
+                           self.times.percentile(percent) / 1000.0))
+        fields.append(('max', self.times.max / 1000.0))
+        return fields
+
+
+class MetricsExporter:
+    """Aggregates per-test metrics on each worker thread, and sends them in
+    batched UDP datagrams from a background thread.
+
+    Optional keyword arguments:
+
+        ``host``, ``port``
+            Address of the statsd or InfluxDB UDP listener.
+        ``protocol``
+            ``'statsd'`` or ``'influx'``.
+        ``prefix``
+            Prefix of statsd metric names, or InfluxDB measurement name.
+        ``interval``
+            Time in seconds between sends.
+        ``max_datagram``
+            Maximum size of each datagram, in bytes.
+        ``significant_digits``
+            Precision of the response time histograms.
+
+    """
+    def __init__(self, host='127.0.0.1', port=8125, protocol='statsd',
+                 prefix='webtest', interval=10, max_datagram=DEFAULT_MAX_DATAGRAM,
+                 significant_digits=2):
+        """Create a MetricsExporter. The sending thread is started when the
+        first request is recorded.
+        """
+        if protocol not in ('statsd', 'influx'):
+            raise ValueError("protocol must be 'statsd' or 'influx'.")
+        self.address = (host, port)
+        self.protocol = protocol
+        self.prefix = prefix
+        self.interval = interval
+        self.max_datagram = max_datagram
+        self.significant_digits = significant_digits
+        # Number of datagrams sent, and not sent due to errors
+        self.sent = 0
+        self.send_errors = 0
+        # Per-thread metrics: (lock, dict of TestMetrics indexed by test
+        # number), indexed by thread identifier
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._socket = None
+
+
+    def record(self, test_number, microseconds, response):
+        """Record a request for the given test number that took the given
+        number of ``microseconds``, and got ``response``.
+        """
+        try:
+            lock, tests = self._threads[thread.get_ident()]
+        except KeyError:
+            lock, tests = self._add_thread()
+        length = _response_length(response)
+        lock.acquire()
+        try:
+            try:
+                metrics = tests[test_number]
+            except KeyError:
+                metrics = tests[test_number] = TestMetrics(self.significant_digits)
+            metrics.count += 1
+            if response.getStatusCode() >= 400:
+                metrics.errors += 1
+            metrics.bytes += length
+            metrics.times.record(microseconds)
+        finally:
+            lock.release()
+
+
+    def _add_thread(self):
+        """Create and return the lock and metrics for the current thread,
+        starting the sending thread if needed.
+        """
+        self._lock.acquire()
+        try:
+            entry = (threading.Lock(), {})
+            self._threads[thread.get_ident()] = entry
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+                atexit.register(self.close)
+        finally:
+            self._lock.release()
+        return entry
+
+
+    def take(self):
+        """Remove and return the metrics recorded since the last call, as a
+        dict of `TestMetrics` indexed by test number, merged from all threads.
+        """
+        self._lock.acquire()
+        threads = self._threads.values()
+        self._lock.release()
+        merged = {}
+        for lock, tests in threads:
+            lock.acquire()
+            try:
+                items = tests.items()
+                tests.clear()
+            finally:
+                lock.release()
+            for test_number, metrics in items:
+                if test_number in merged:
+                    merged[test_number].merge(metrics)
+                else:
+                    merged[test_number] = metrics
+        return merged
+
+
+    def format_lines(self, metrics, timestamp=None):
+        """Return a list of lines in the configured protocol, for the given
+        dict of `TestMetrics` indexed by test number.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        test_numbers = metrics.keys()
+        test_numbers.sort()
+        lines = []
+        for test_number in test_numbers:
+            test = metrics[test_number]
+            if self.protocol == 'statsd':
+                name = '%s.%d.' % (self.prefix, test_number)
+                lines.append('%scount:%d|c' % (name, test.count))
+                lines.append('%serrors:%d|c' % (name, test.errors))
+                lines.append('%sbytes:%d|c' % (name, test.bytes))
+                for field, value in test.fields():
+                    lines.append('%s%s:%.3f|g' % (name, field, value))
+            else:
+                fields = ['count=%di' % test.count, 'errors=%di' % test.errors,
+                          'bytes=%di' % test.bytes]
+                for field, value in test.fields():
+                    fields.append('%s=%.3f' % (field, value))
+                lines.append('%s,test=%d %s %d' % (self.prefix, test_number,
+                             ','.join(fields), long(timestamp * 1000000000)))
+        return lines
+
+
+    def batch(self, lines):
+        """Return a list of datagrams containing the given lines, separated by
+        newlines, each no longer than ``max_datagram`` (unless a single line is
+        longer).
+        """
+        datagrams = []
+        current = []
+        size = 0
+        for line in lines:
+            if current and size + 1 + len(line) > self.max_datagram:
+                datagrams.append('\n'.join(current))
+                current = []
+                size = 0
+            if current:
+                size += 1
+            current.append(line)
+            size += len(line)
+        if current:
+            datagrams.append('\n'.join(current))
+        return datagrams
+
+
+    def flush(self):
+        """Send the metrics recorded since the last flush now.
+        """
+        self._flush_lock.acquire()
+        try:
+            metrics = self.take()
+            if not metrics:
+                return
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for datagram in self.batch(self.format_lines(metrics)):
+                try:
+                    self._socket.sendto(datagram, self.address)
+                    self.sent += 1
+                except socket.error:
+                    self.send_errors += 1
+        finally:
+            self._flush_lock.release()
+
+
+    def close(self):
+        """Stop the sending thread, and send any remaining metrics.
+        Does nothing if already closed.
+        """
+        if self._stopped.isSet():
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+    def _run(self):
+        """Send metrics every ``interval`` seconds until closed. Executed by
+        the sending thread.
+        """
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            if not self._stopped.isSet():
+                self.flush()
+
@@ -0,0 +1,369 @@
+# extract.py
+
+"""This module provides streaming extractors for single values in JSON and XML
+documents. They are used by the ``json:`` and ``xpath:`` capture expressions
+(see `~webtest.runner.WebtestRunner.eval_capture`)::
+
+    <Capture>
+        <![CDATA[
+            {ORDER_ID = json:$.orders[0].id}
+            {TOTAL = xpath://Invoice/Total}
+            {NEXT_PAGE = xpath:/feed/link[2]/@href}
+        ]]>
+    </Capture>
+
+Both extractors read the document in a single pass, without building a tree,
+and stop as soon as the target is found, so the memory they use does not grow
+with the size of the document; only the captured value is kept.
+
+`json_path` accepts a small subset of JSONPath: an optional ``$``, followed by
+any number of ``.name``, ``["name"]`` or ``[index]`` steps, with indexes
+counted from 0::
+
+    >>> json_path('{"orders": [{"id": 17}, {"id": 42}]}', '$.orders[1].id')
+    '42'
+
+Strings are returned without their quotes, and with escapes decoded; numbers
+and the literals ``true``, ``false`` and ``null`` are returned as they appear;
+objects and arrays are returned as compact JSON text. The document is split
+into tokens by `~webtest.pretty.iter_json_tokens`.
+
+`xpath` accepts a small subset of XPath: element names (or ``*``) separated by
+``/`` for children or ``//`` for descendants, each optionally followed by a
+position ``[n]`` among its siblings of that name, counted from 1. The last step
+may be ``@name`` to get an attribute, or ``text()``; otherwise, the text
+content of the first matching element is returned::
+
+    >>> xpath('<a><b>1</b><b>2<c>3</c></b></a>', '/a/b[2]')
+    '23'
+
+Element and attribute names are matched exactly as they appear, including any
+namespace prefix. The document is parsed with the ``xml.sax`` parser.
+
+Both functions return ``None`` if the target is not in the document, and raise
+a ``ValueError`` if the path is invalid or the document is malformed.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import re
+from xml import sax
+
+import pretty
+
+# Compiled paths, indexed by path
+_json_paths = {}
+_xpaths = {}
+# Maximum number of compiled paths of each kind to keep
+_MAX_CACHED = 256
+
+
+# A single JSON path step: .name, ["name"] or [index]
+_json_step = re.compile(r'\.([^.\[\]]+)|\[(\d+)\]|\[(["\'])(.*?)\3\]')
+# A JSON string escape
+_json_escape = re.compile(r'\\(u[0-9a-fA-F]{4}|.)')
+_json_escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+def compile_json_path(path):
+    """Return a list of ``(is_index, key)`` steps for the given JSON path,
+    where ``key`` is a member name, or an array index if ``is_index`` is True.
+    Raise a ``ValueError`` if the path is invalid.
+    """
+    if path in _json_paths:
+        return _json_paths[path]
+    rest = path.strip()
+    if rest.startswith('$'):
+        rest = rest[1:]
+    # Allow the first name to be given without a dot
+    if rest and rest[0] not in '.[':
+        rest = '.' + rest
+    steps = []
+    start = 0
+    while start < len(rest):
+        match = _json_step.match(rest, start)
+        if not match:
+            raise ValueError("Invalid JSON path '%s' at offset %d" %
+                             (path, start))
+        name, index, quote, quoted = match.groups()
+        if index is not None:
+            steps.append((True, int(index)))
+        elif name is not None:
+            steps.append((False, name))
+        else:
+            steps.append((False, quoted))
+        start = match.end()
+    if len(_json_paths) >= _MAX_CACHED:
+        _json_paths.clear()
+    _json_paths[path] = steps
+    return steps
+
+
+def _unescape(match):
+    """Return the character for a JSON string escape match.
+    """
+    escape = match.group(1)
+    if escape[0] == 'u' and len(escape) == 5:
+        char = unichr(int(escape[1:], 16))
+        if isinstance(match.string, unicode):
+            return char
+        return char.encode('utf-8')
+    return _json_escapes.get(escape, escape)
+
+
+def json_string(token):
+    """Return the value of a JSON string token, without its quotes, and with
+    any escapes decoded.
+    """
+    value = token[1:-1]
+    if '\\' not in value:
+        return value
+    return _json_escape.sub(_unescape, value)
+
+
+def _skip_value(tokens, kind):
+    """Skip the rest of the JSON value starting with a token of the given
+    ``kind``.
+    """
+    if kind not in ('{', '['):
+        return
+    depth = 1
+    while depth:
+        kind = tokens.next()[0]
+        if kind in ('{', '['):
+            depth += 1
+        elif kind in ('}', ']'):
+            depth -= 1
+
+
+def _collect_value(tokens, kind, token):
+    """Return the JSON value starting with the given token, as text.
+    """
+    if kind == '"':
+        return json_string(token)
+    if kind == 0:
+        return token
+    if kind not in ('{', '['):
+        raise pretty.MalformedJSON("Unexpected '%s'" % token)
+    parts = [token]
+    depth = 1
+    while depth:
+        kind, token = tokens.next()
+        if kind in ('{', '['):
+            depth += 1
+        elif kind in ('}', ']'):
+            depth -= 1
+        parts.append(token)
+    return ''.join(parts)
+
+
+def _find_json(tokens, steps):
+    """Follow the given steps through the JSON tokens, and return the value at
+    the end, or ``None`` if it is not found.
+    """
+    kind, token = tokens.next()
+    for is_index, key in steps:
+        if is_index:
+            if kind != '[':
+                return None
+            kind, token = tokens.next()
+            index = 0
+            while index < key:
+                if kind == ']':
+                    return None
+                _skip_value(tokens, kind)
+                kind, token = tokens.next()
+                if kind == ',':
+                    kind, token = tokens.next()
+                index += 1
+            if kind == ']':
+                return None
+        else:
+            if kind != '{':
+                return None
+            kind, token = tokens.next()
+            while True:
+                if kind == '}':
+                    return None
+                if kind != '"' or tokens.next()[0] != ':':
+                    raise pretty.MalformedJSON("Expected a member name")
+                name = json_string(token)
+                kind, token = tokens.next()
+                if name == key:
+                    break
+                _skip_value(tokens, kind)
+                kind, token = tokens.next()
+                if kind == ',':
+                    kind, token = tokens.next()
+    return _collect_value(tokens, kind, token)
+
+
+def json_path(text, path):
+    """Return the value at the given JSON ``path`` in the JSON ``text``, or
+    ``None`` if there is no such value.
+    """
+    steps = compile_json_path(path)
+    try:
+        return _find_json(pretty.iter_json_tokens(text), steps)
+    except pretty.MalformedJSON, e:
+        raise ValueError("Malformed JSON: %s" % e)
+    except StopIteration:
+        raise ValueError("Malformed JSON: unexpected end of document")
+
+
+# A single XPath step: / or //, a name or *, and an optional [position]
+_xpath_step = re.compile(r'(//?)\s*([^/\[\]\s]+)\s*(?:\[\s*(\d+)\s*\])?')
+
+def compile_xpath(path):
+    """Return ``(steps, attribute)`` for the given XPath, where ``steps`` is a
+    list of ``(descendant, name, position)`` for each element step, and
+    ``attribute`` is the name of the attribute to get, or ``None`` to get the
+    text content. Raise a ``ValueError`` if the path is invalid.
+    """
+    if path in _xpaths:
+        return _xpaths[path]
+    rest = path.strip()
+    if not rest.startswith('/'):
+        rest = '/' + rest
+    steps = []
+    attribute = None
+    start = 0
+    while start < len(rest):
+        match = _xpath_step.match(rest, start)
+        if not match or attribute is not None:
+            raise ValueError("Invalid XPath '%s' at offset %d" % (path, start))
+        separator, name, position = match.groups()
+        start = match.end()
+        if name.startswith('@') and separator == '/' and position is None:
+            attribute = name[1:]
+        elif name == 'text()' and separator == '/' and start == len(rest):
+            pass
+        elif name.startswith('@') or name.endswith(')'):
+            raise ValueError("Invalid XPath '%s' at offset %d" %
+                             (path, match.start()))
+        else:
+            if position is not None:
+                position = int(position)
+            steps.append((separator == '//', name, position))
+    if not steps:
+        raise ValueError("Invalid XPath '%s': no elements" % path)
+    if len(_xpaths) >= _MAX_CACHED:
+        _xpaths.clear()
+    _xpaths[path] = (steps, attribute)
+    return steps, attribute
+
+
+def _step_matches(step, element):
+    """Return True if the given ``(name, position, index)`` element matches
+    the given XPath step.
+    """
+    descendant, name, position = step
+    if name == '*':
+        return position is None or position == element[2]
+    return name == element[0] and (position is None or position == element[1])
+
+
+def _path_matches(steps, stack, step=0, level=0):
+    """Return True if the open elements in ``stack``, from ``level`` on,
+    match the XPath ``steps`` from ``step`` on.
+    """
+    if step == len(steps):
+        return level == len(stack)
+    if steps[step][0]:
+        levels = range(level, len(stack))
+    elif level < len(stack):
+        levels = [level]
+    else:
+        levels = []
+    for level in levels:
+        if _step_matches(steps[step], stack[level]) and \
+           _path_matches(steps, stack, step + 1, level + 1):
+            return True
+    return False
+
+
+class _Found (Exception):
+    """Raised by `_XPathHandler` to stop parsing when the target is found."""
+    def __init__(self, value):
+        Exception.__init__(self)
+        self.value = value
+
+
+class _XPathHandler (sax.handler.ContentHandler):
+    """Content handler that raises `_Found` with the value of the first
+    element or attribute matching an XPath.
+    """
+    def __init__(self, steps, attribute):
+        sax.handler.ContentHandler.__init__(self)
+        self.steps = steps
+        self.attribute = attribute
+        # (name, position among siblings of that name, position among all
+        # siblings) of each open element, outermost first
+        self.stack = []
+        # Number of children of each open element (and the document) seen so
+        # far, indexed by name, with the total indexed by None
+        self.counts = [{}]
+        # Text of the matching element, once it is found
+        self.text = None
+        # Number of elements open inside the matching element
+        self.depth = 0
+
+
+    def startElement(self, name, attrs):
+        if self.text is not None:
+            self.depth += 1
+            return
+        counts = self.counts[-1]
+        counts[name] = counts.get(name, 0) + 1
+        counts[None] = counts.get(None, 0) + 1
+        self.stack.append((name, counts[name], counts[None]))
+        self.counts.append({})
+        # Check the last step first, since it usually fails
+        if not _step_matches(self.steps[-1], self.stack[-1]) or \
+           not _path_matches(self.steps, self.stack):
+            return
+        if self.attribute is None:
+            self.text = []
+        elif self.attribute in attrs.getNames():
+            raise _Found(attrs.getValue(self.attribute))
+
+
+    def endElement(self, name):
+        if self.text is not None:
+            if self.depth == 0:
+                raise _Found(''.join(self.text))
+            self.depth -= 1
+            return
+        self.stack.pop()
+        self.counts.pop()
+
+
+    def characters(self, content):
+        if self.text is not None:
+            self.text.append(content)
+
+
+def xpath(text, path):
+    """Return the text or attribute value at the given ``path`` in the XML
+    ``text``, or ``None`` if there is no such element or attribute.
+    """
+    steps, attribute = compile_xpath(path)
+    saxparser = sax.make_parser()
+    saxparser.setContentHandler(_XPathHandler(steps, attribute))
+    # Don't fetch external entities referenced by the response
+    try:
+        saxparser.setFeature(sax.handler.feature_external_ges, False)
+    except (sax.SAXNotRecognizedException, sax.SAXNotSupportedException):
+        pass
+    try:
+        for chunk in pretty._encoded_chunks(text):
+            saxparser.feed(chunk)
+        saxparser.close()
+    except _Found, found:
+        value = found.value
+        # Return the same kind of string as was given
+        if isinstance(value, unicode) and not isinstance(text, unicode):
+            value = value.encode('utf-8')
+        return value
+    except sax.SAXException, e:
+        raise ValueError("Malformed XML: %s" % e)
+    return None
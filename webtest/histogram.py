@@ -0,0 +1,561 @@
+# histogram.py
+
+"""This module provides latency histograms in the style of HdrHistogram_,
+for reporting accurate percentiles (such as p99 or p99.9) of request times.
+
+.. _HdrHistogram: http://hdrhistogram.org/
+
+To record the latency of every request, pass a `HistogramRecorder` to
+`~webtest.runner.get_test_runner`::
+
+    from net.grinder.script.Grinder import grinder
+    from webtest.histogram import HistogramRecorder
+
+    histograms = HistogramRecorder('latency-%s.hist' % grinder.processName)
+    TestRunner = get_test_runner(my_tests, histograms=histograms)
+
+The time taken by each request (its service time) is recorded under the
+metric name ``service``. If the runner is given a ``pacing`` interval, the
+time from when each request was scheduled to start is also recorded, under the
+metric name ``response``; see `~webtest.runner.get_test_runner`.
+
+Each worker thread records into its own set of histograms, one per test
+number and metric, so no locking is needed when recording. The histograms from all
+threads are merged and written to the given file when the last
+`~webtest.runner.WebtestRunner` is destroyed, at process exit, and (if an
+``interval`` is given) periodically while the test runs.
+
+Histogram files are compact and mergeable. To get percentiles across all
+agents and processes, collect the files and run this module as a script::
+
+    $ python -m webtest.histogram latency-*.hist
+    Test    Metric         Count   Min(ms)   p50(ms)   p90(ms)   p99(ms) p99.9(ms)   Max(ms)  Mean(ms)
+    1001    service         5000      12.0      48.3      95.2     210.9     812.0     901.1      55.2
+    ...
+
+Use ``-o merged.hist`` to also write the merged histograms to a new file.
+
+Values are recorded in microseconds. With the default two significant
+digits, each recorded value is accurate to within 1%.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import math
+import os
+import struct
+import sys
+import thread
+import threading
+import atexit
+import zlib
+
+# Number of temporary files written by this process, for unique names
+_temp_files = 0
+_temp_lock = threading.Lock()
+
+# Written at the start of every histogram file
+MAGIC = 'WTHIST1\n'
+
+# Histogram header: sub-bucket bits, total count, min, max, sum,
+# number of non-empty buckets
+_HEADER = '>BQqqdI'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+# Entry key: test number, length of metric name
+_KEY = '>iB'
+_KEY_SIZE = struct.calcsize(_KEY)
+
+
+class BadHistogramFile (Exception):
+    """Raised when a histogram file cannot be read."""
+    pass
+
+
+def _bit_length(value):
+    """Return the number of bits needed to represent a positive integer.
+    """
+    return math.frexp(value)[1]
+
+
+def _encode_varint(value, parts):
+    """Append the base-128 encoding of a non-negative integer to ``parts``.
+    """
+    while value >= 0x80:
+        parts.append(chr((value & 0x7f) | 0x80))
+        value = value >> 7
+    parts.append(chr(value))
+
+
+def _decode_varint(data, offset):
+    """Return ``(value, offset)`` for the base-128 integer at ``offset``.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        value = value | ((byte & 0x7f) << shift)
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class Histogram:
+    """A histogram of non-negative integer values, with log-linear buckets.
+
+    Values smaller than the number of sub-buckets are counted exactly; larger
+    values are counted in buckets whose width is a fixed fraction of their
+    value, determined by ``significant_digits``.
+    """
+    def __init__(self, significant_digits=2):
+        """Create an empty Histogram with the given precision.
+        """
+        self.sub_bits = _bit_length(2 * 10 ** significant_digits)
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0.0
+        # Counts, indexed by bucket index
+        self.counts = {}
+        self._sub_count = 1 << self.sub_bits
+        self._half_count = self._sub_count >> 1
+
+
+    def _index(self, value):
+        """Return the bucket index for the given value.
+        """
+        if value < self._sub_count:
+            return value
+        shift = _bit_length(value) - self.sub_bits
+        return self._sub_count + (shift - 1) * self._half_count \
+               + (value >> shift) - self._half_count
+
+
+    def _highest_value(self, index):
+        """Return the highest value counted in the given bucket index.
+        """
+        if index < self._sub_count:
+            return index
+        shift, sub = divmod(index - self._sub_count, self._half_count)
+        shift += 1
+        return ((sub + self._half_count + 1) << shift) - 1
+
+
+    def record(self, value, count=1):
+        """Record the given value, ``count`` times.
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+
+    def record_corrected(self, value, expected_interval):
+        """Record the given value, correcting for coordinated omission. If
+        ``value`` is longer than ``expected_interval`` (the time expected
+        between the start of successive requests), requests that would have
+        been sent while waiting were held back; for each of them, a value is
+        back-filled, starting at ``value - expected_interval`` and decreasing
+        by ``expected_interval`` each time.
+        """
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+
+    def merge(self, other):
+        """Add all values counted in another Histogram to this one. Both
+        histograms must have the same precision.
+        """
+        if other.sub_bits != self.sub_bits:
+            raise ValueError("Cannot merge histograms of different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+
+
+    def copy(self):
+        """Return a copy of this Histogram.
+        """
+        result = Histogram()
+        result.sub_bits = self.sub_bits
+        result._sub_count = self._sub_count
+        result._half_count = self._half_count
+        result.merge(self)
+        return result
+
+
+    def percentile(self, percent):
+        """Return the value below which the given percentage of recorded
+        values fall; for example, ``percentile(99.9)``. Return 0 if the
+        histogram is empty.
+        """
+        if not self.total:
+            return 0
+        wanted = self.total * percent / 100.0
+        indexes = self.counts.keys()
+        indexes.sort()
+        seen = 0
+        for index in indexes:
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+
+    def mean(self):
+        """Return the mean of all recorded values, or 0.0 if the histogram
+        is empty.
+        """
+        if not self.total:
+            return 0.0
+        return self.sum / self.total
+
+
+    def encode(self):
+        """Return the histogram as a packed string.
+        """
+        minimum = self.min
+        if minimum is None:
+            minimum = -1
+        parts = [struct.pack(_HEADER, self.sub_bits, self.total, minimum,
+                             self.max, self.sum, len(self.counts))]
+        indexes = self.counts.keys()
+        indexes.sort()
+        previous = 0
+        for index in indexes:
+            _encode_varint(index - previous, parts)
+            _encode_varint(self.counts[index], parts)
+            previous = index
+        return ''.join(parts)
+
+
+    def decode(cls, data, offset=0):
+        """Return ``(histogram, offset)``, where ``histogram`` is unpacked
+        from a string returned by `encode`, beginning at ``offset``, and
+        ``offset`` is where it ended.
+        """
+        sub_bits, total, minimum, maximum, total_sum, buckets = \
+            struct.unpack(_HEADER, data[offset:offset + _HEADER_SIZE])
+        offset += _HEADER_SIZE
+        histogram = cls()
+        histogram.sub_bits = sub_bits
+        histogram._sub_count = 1 << sub_bits
+        histogram._half_count = histogram._sub_count >> 1
+        histogram.total = total
+        if minimum >= 0:
+            histogram.min = minimum
+        histogram.max = maximum
+        histogram.sum = total_sum
+        index = 0
+        for bucket in range(buckets):
+            delta, offset = _decode_varint(data, offset)
+            count, offset = _decode_varint(data, offset)
+            index += delta
+            histogram.counts[index] = count
+        return histogram, offset
+
+    # Make this a class method
+    decode = classmethod(decode)
+
+
+def write_file(filename, histograms):
+    """Write a histogram file. ``histograms`` is a dict of `Histogram`\s,
+    indexed by ``(test_number, metric)``. The file is written under a
+    temporary name of its own and then renamed, so readers never see a
+    partial file.
+    """
+    keys = histograms.keys()
+    keys.sort()
+    parts = []
+    for test_number, metric in keys:
+        parts.append(struct.pack(_KEY, test_number, len(metric)) + metric)
+        parts.append(histograms[(test_number, metric)].encode())
+    global _temp_files
+    _temp_lock.acquire()
+    _temp_files += 1
+    temp_number = _temp_files
+    _temp_lock.release()
+    pid = 0
+    if hasattr(os, 'getpid'):
+        pid = os.getpid()
+    temp_filename = '%s.%d.%d.tmp' % (filename, pid, temp_number)
+    outfile = open(temp_filename, 'wb')
+    try:
+        outfile.write(MAGIC + zlib.compress(''.join(parts)))
+    finally:
+        outfile.close()
+    try:
+        # Replaces the file atomically, except on Windows
+        os.rename(temp_filename, filename)
+    except OSError:
+        if not os.path.exists(filename):
+            raise
+        os.remove(filename)
+        os.rename(temp_filename, filename)
+
+
+def read_file(filename):
+    """Read a histogram file, and return a dict of `Histogram`\s indexed by
+    ``(test_number, metric)``.
+    """
+    infile = open(filename, 'rb')
+    data = infile.read()
+    infile.close()
+    if not data.startswith(MAGIC):
+        raise BadHistogramFile("%s is not a histogram file" % filename)
+    try:
+        data = zlib.decompress(data[len(MAGIC):])
+    except zlib.error, e:
+        raise BadHistogramFile("%s: %s" % (filename, e))
+    histograms = {}
+    offset = 0
+    while offset < len(data):
+        test_number, length = \
+            struct.unpack(_KEY, data[offset:offset + _KEY_SIZE])
+        offset += _KEY_SIZE
+        metric = data[offset:offset + length]
+        offset += length
+        histograms[(test_number, metric)], offset = \
+            Histogram.decode(data, offset)
+    return histograms
+
+
+def merge_files(filenames):
+    """Read and merge the given histogram files, and return a dict of
+    `Histogram`\s indexed by ``(test_number, metric)``.
+    """
+    merged = {}
+    for filename in filenames:
+        for key, histogram in read_file(filename).items():
+            if key in merged:
+                merged[key].merge(histogram)
+            else:
+                merged[key] = histogram
+    return merged
+
+
+# Percentiles shown by format_table
+PERCENTILES = (50, 90, 99, 99.9)
+
+def format_table(histograms, scale=1000.0):
+    """Return a table of counts and percentiles for the given dict of
+    `Histogram`\s, indexed by ``(test_number, metric)``. Values are divided
+    by ``scale``; the default converts microseconds to milliseconds.
+    """
+    columns = ['Count', 'Min(ms)'] + \
+              ['p%s(ms)' % percent for percent in PERCENTILES] + \
+              ['Max(ms)', 'Mean(ms)']
+    lines = ['%-6s  %-10s' % ('Test', 'Metric') +
+             ''.join(['%10s' % column for column in columns])]
+    keys = histograms.keys()
+    keys.sort()
+    for key in keys:
+        histogram = histograms[key]
+        values = [histogram.min or 0] + \
+                 [histogram.percentile(percent) for percent in PERCENTILES] + \
+                 [histogram.max, histogram.mean()]
+        lines.append('%-6d  %-10s%10d' % (key[0], key[1], histogram.total) +
+                     ''.join(['%10.1f' % (value / scale) for value in values]))
+    return '\n'.join(lines)
+
+
+class HistogramRecorder:
+    """Records values into per-thread histograms, and writes them, merged,
+    to a histogram file.
+
+    Optional keyword arguments:
+
+        ``filename``
+            Name of the histogram file to write. If ``None``, nothing is
+            written, but `merged` can still be used.
+        ``interval``
+            If given, the merged histograms are also written every
+            ``interval`` seconds by a background thread.
+        ``significant_digits``
+            Precision of the histograms.
+
+    """
+    def __init__(self, filename=None, interval=None, significant_digits=2):
+        """Create a HistogramRecorder.
+        """
+        self.filename = filename
+        self.interval = interval
+        self.significant_digits = significant_digits
+        # Dicts of Histograms indexed by (test_number, metric),
+        # indexed by thread identifier (or None, for those passed to add)
+        self._threads = {}
+        # Number of threads that have not yet called thread_finished
+        self._running = 0
+        self._lock = threading.Lock()
+        # Serializes writes to the file
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+
+    def record(self, test_number, value, metric='service',
+               expected_interval=None):
+        """Record a value for the given test number in the current thread's
+        histograms. If ``expected_interval`` is given, values are back-filled
+        as described in `Histogram.record_corrected`.
+        """
+        try:
+            histograms = self._threads[thread.get_ident()]
+        except KeyError:
+            histograms = self._add_thread()
+        key = (test_number, metric)
+        try:
+            histogram = histograms[key]
+        except KeyError:
+            histogram = histograms[key] = Histogram(self.significant_digits)
+        if expected_interval:
+            histogram.record_corrected(value, expected_interval)
+        else:
+            histogram.record(value)
+
+
+    def _add_thread(self):
+        """Create and return the dict of histograms for the current thread,
+        starting the periodic writer if needed.
+        """
+        self._lock.acquire()
+        try:
+            histograms = {}
+            self._threads[thread.get_ident()] = histograms
+            self._running += 1
+            if len(self._threads) == 1 and self.filename:
+                atexit.register(self.close)
+                if self.interval:
+                    self._thread = threading.Thread(target=self._run)
+                    self._thread.setDaemon(True)
+                    self._thread.start()
+        finally:
+            self._lock.release()
+        return histograms
+
+
+    def merged(self):
+        """Return a dict of `Histogram`\s indexed by ``(test_number, metric)``,
+        merged from all threads. Values being recorded while this runs may or
+        may not be included.
+        """
+        self._lock.acquire()
+        thread_histograms = self._threads.values()
+        self._lock.release()
+        merged = {}
+        for histograms in thread_histograms:
+            for key, histogram in histograms.items():
+                if key in merged:
+                    merged[key].merge(histogram)
+                else:
+                    merged[key] = histogram.copy()
+        return merged
+
+
+    def add(self, histograms):
+        """Add a dict of `Histogram`\s indexed by ``(test_number, metric)``,
+        such as one returned by `merged` in another process, to the
+        histograms that are merged and written.
+        """
+        self._lock.acquire()
+        try:
+            # Histograms from elsewhere are kept apart from any thread's
+            added = self._threads.setdefault(None, {})
+            for key, histogram in histograms.items():
+                if key in added:
+                    added[key].merge(histogram)
+                else:
+                    added[key] = histogram.copy()
+        finally:
+            self._lock.release()
+
+
+    def thread_finished(self):
+        """Note that the current thread has finished recording. When all
+        threads have finished, the merged histograms are written.
+        """
+        self._lock.acquire()
+        try:
+            if thread.get_ident() not in self._threads:
+                return
+            self._running -= 1
+            finished = self._running <= 0
+        finally:
+            self._lock.release()
+        if finished:
+            self.write()
+
+
+    def write(self):
+        """Write the merged histograms to ``filename``.
+        """
+        if not self.filename:
+            return
+        self._write_lock.acquire()
+        try:
+            write_file(self.filename, self.merged())
+        finally:
+            self._write_lock.release()
+
+
+    def close(self):
+        """Stop the periodic writer, if any, and write the histograms.
+        Does nothing if already closed.
+        """
+        if self._stopped.isSet():
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+
+    def _run(self):
+        """Write the histograms every ``interval`` seconds until closed.
+        Executed by the periodic writer thread.
+        """
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            if not self._stopped.isSet():
+                self.write()
+
+
+def main(args):
+    """Merge the histogram files given on the command line, and print their
+    percentiles.
+    """
+    from optparse import OptionParser
+    usage = "python -m webtest.histogram [-o OUTPUT] FILE [FILE ...]"
+    option_parser = OptionParser(usage=usage)
+    option_parser.add_option('-o', '--output', dest='output',
+                             help="Write the merged histograms to OUTPUT")
+    options, filenames = option_parser.parse_args(args)
+    if not filenames:
+        option_parser.error("No histogram files given")
+    merged = merge_files(filenames)
+    if options.output:
+        write_file(options.output, merged)
+    print(format_table(merged))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
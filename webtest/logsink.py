@@ -0,0 +1,243 @@
+# logsink.py
+
+"""This module provides a `LogSink`, which takes log output off the worker
+threads and writes it in batches from a single background thread.
+
+Normally, every line logged by a `~webtest.runner.WebtestRunner` is written
+synchronously to the Grinder log by the worker thread that produced it. At
+``info`` or ``debug`` verbosity, this can slow down the worker threads enough
+to affect throughput. To avoid this, pass a `LogSink` to
+`~webtest.runner.get_test_runner`::
+
+    from webtest.logsink import LogSink
+    TestRunner = get_test_runner(my_tests, verbosity='info',
+                                 log_sink=LogSink(buffer_size=4096))
+
+Each worker thread then appends its log messages, unformatted, to its own ring
+buffer. A background thread wakes up every ``interval`` seconds, formats the
+messages from all buffers, and writes them to the log in batches. If a thread
+logs more than ``buffer_size`` messages between flushes, its oldest messages
+are overwritten; the number lost is kept in the ``dropped`` attribute, and is
+reported in the log.
+
+Error messages (such as the ``!!!!!!`` lines logged when a capture fails) are
+never dropped. They are written immediately by the worker thread, after any
+messages it has already buffered, so they appear in order with the messages
+leading up to them.
+
+Buffers are flushed when each `~webtest.runner.WebtestRunner` is destroyed,
+and when the process exits.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import atexit
+import thread
+import threading
+
+
+class RingBuffer:
+    """A fixed-size buffer of log messages, written by a single worker
+    thread and emptied by the flushing thread. When the buffer is full, each
+    new message overwrites the oldest one.
+    """
+    def __init__(self, size):
+        """Create a RingBuffer that holds up to ``size`` messages.
+        """
+        self.size = size
+        self.items = [None] * size
+        # Index of the oldest message, and number of messages held
+        self.head = 0
+        self.count = 0
+        # Number of messages overwritten since the last take_all
+        self.dropped = 0
+        # Only contended by the flushing thread, once per flush
+        self.lock = threading.Lock()
+
+
+    def put(self, item):
+        """Add an item to the buffer. Return False if the buffer was full,
+        and the oldest item was overwritten.
+        """
+        self.lock.acquire()
+        try:
+            self.items[(self.head + self.count) % self.size] = item
+            if self.count == self.size:
+                self.head = (self.head + 1) % self.size
+                self.dropped += 1
+                return False
+            self.count += 1
+            return True
+        finally:
+            self.lock.release()
+
+
+    def take_all(self):
+        """Remove and return ``(items, dropped)``, where ``items`` is a list
+        of all buffered items in the order they were added, and ``dropped`` is
+        the number of items overwritten since the last call.
+        """
+        self.lock.acquire()
+        try:
+            end = self.head + self.count
+            if end <= self.size:
+                items = self.items[self.head:end]
+            else:
+                items = self.items[self.head:] + self.items[:end - self.size]
+            dropped = self.dropped
+            self.items = [None] * self.size
+            self.head = 0
+            self.count = 0
+            self.dropped = 0
+        finally:
+            self.lock.release()
+        return items, dropped
+
+
+class LogSink:
+    """Collects log messages in per-thread ring buffers, and writes them in
+    batches from a background thread.
+
+    Optional keyword arguments:
+
+        ``output``
+            Function called with each batch of log lines, joined by newlines.
+            If ``None``, the runner's log function (normally
+            ``grinder.logger.output``) is used.
+        ``buffer_size``
+            Maximum number of messages each thread may buffer between flushes.
+            Older messages are overwritten by newer ones.
+        ``interval``
+            Time in seconds between flushes.
+        ``batch_size``
+            Maximum number of lines written in a single call to ``output``.
+
+    """
+    def __init__(self, output=None, buffer_size=1024, interval=0.5,
+                 batch_size=256):
+        """Create a LogSink. The flushing thread is started when the first
+        message is written.
+        """
+        self.output = output
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.batch_size = batch_size
+        # Total number of messages overwritten in full buffers
+        self.dropped = 0
+        # RingBuffers, indexed by thread identifier
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+
+    def write(self, message, args=(), error=False):
+        """Buffer a log message for the current thread. If ``args`` are
+        given, they will be formatted into ``message`` using ``%`` when the
+        message is flushed.
+
+        If ``error`` is True, the message is written immediately instead,
+        after any messages already buffered by the current thread, so it can
+        never be dropped.
+        """
+        try:
+            buffer = self._buffers[thread.get_ident()]
+        except KeyError:
+            buffer = self._add_buffer()
+        if error:
+            self._write_through(buffer, message, args)
+        else:
+            buffer.put((message, args))
+
+
+    def _write_through(self, buffer, message, args):
+        """Write the messages in ``buffer``, followed by ``message``, now.
+        """
+        self._flush_lock.acquire()
+        try:
+            lines = self._format(buffer)
+            if args:
+                message = message % args
+            lines.append(message)
+            self._output(lines)
+        finally:
+            self._flush_lock.release()
+
+
+    def _add_buffer(self):
+        """Create and return a RingBuffer for the current thread, starting
+        the flushing thread if needed.
+        """
+        self._lock.acquire()
+        try:
+            buffer = RingBuffer(self.buffer_size)
+            self._buffers[thread.get_ident()] = buffer
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+                atexit.register(self.close)
+        finally:
+            self._lock.release()
+        return buffer
+
+
+    def flush(self):
+        """Write all buffered messages now.
+        """
+        self._flush_lock.acquire()
+        try:
+            self._lock.acquire()
+            buffers = self._buffers.values()
+            self._lock.release()
+
+            lines = []
+            for buffer in buffers:
+                lines.extend(self._format(buffer))
+            self._output(lines)
+        finally:
+            self._flush_lock.release()
+
+
+    def _format(self, buffer):
+        """Empty ``buffer``, and return a list of its formatted messages.
+        Must be called with the flush lock held.
+        """
+        lines = []
+        items, dropped = buffer.take_all()
+        if dropped:
+            self.dropped += dropped
+            lines.append("LogSink: %d messages dropped" % dropped)
+        for message, args in items:
+            if args:
+                message = message % args
+            lines.append(message)
+        return lines
+
+
+    def _output(self, lines):
+        """Write ``lines`` in batches of up to ``batch_size``.
+        """
+        for start in range(0, len(lines), self.batch_size):
+            self.output('\n'.join(lines[start:start + self.batch_size]))
+
+
+    def close(self):
+        """Stop the flushing thread, and write any remaining messages.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+    def _run(self):
+        """Flush every ``interval`` seconds until closed. Executed by the
+        flushing thread.
+        """
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            self.flush()
+
@@ -61,6 +61,8 @@ import random
 import datetime
 import time
 
+import data
+
 def _sample(choices, how_many):
     """Return `how_many` randomly-chosen items from `choices`.
     """
@@ -69,6 +71,9 @@ def _sample(choices, how_many):
 class Macro:
     """Functions that can be invoked from a webtest.
     """
+    # The WebtestRunner instance evaluating the expression, if any
+    runner = None
+
     def __init__(self):
         pass
 
@@ -134,4 +139,14 @@ class Macro:
         """
         return str(int(time.time()))
 
+    def data(self, filename, column, mode='sequential', delimiter=','):
+        """Return the value in the given column of the current row of a CSV
+        file, taking rows in ``sequential``, ``random`` or ``unique`` mode.
+        For example, ``data(users.csv, username)`` might return ``phil``. See
+        the `webtest.data` module for details.
+        """
+        if self.runner is None:
+            raise ValueError("The data macro needs a WebtestRunner")
+        return data.value(self.runner, filename, column, mode, delimiter)
+
 
@@ -65,6 +65,42 @@ Two additional elements are understood by this parser:
         A block of expressions that may be used to capture or verify
         content in the body of the response for this request
 
+Requests may be grouped into named transactions, such as all the requests
+needed to load a page, by enclosing them in a ``TransactionTimer`` element, as
+Visual Studio does::
+
+    <TransactionTimer Name="Home page">
+      <Items>
+        <Request Method="GET" Url="http://www.example.com/" />
+        <Request Method="GET" Url="http://www.example.com/logo.png" />
+      </Items>
+    </TransactionTimer>
+
+Each `Request` inside a ``TransactionTimer`` has its ``transaction`` attribute
+set to the timer's name (the innermost one, if they are nested).
+
+The time the user paused after a request, in seconds, may be given in a
+``ThinkTime`` attribute, as Visual Studio does::
+
+    <Request Method="GET" Url="http://www.example.com/" ThinkTime="2.5" />
+
+Or, for recordings that only have the time each request was made, in a
+timing file next to the ``.webtest`` file, with the same name but a
+``.timing`` extension (``my_test.timing`` for ``my_test.webtest``). Each line
+of the timing file gives the time in seconds when a request started, and
+optionally when its response finished, separated by whitespace, for each
+request in the order they appear in the ``.webtest`` file::
+
+    # Started        Finished
+    1286236800.120   1286236800.350
+    1286236801.900   1286236802.015
+
+Blank lines and lines starting with ``#`` are ignored. The pause after each
+request is taken from when it finished (or started) until the next one
+started. A timing file overrides any ``ThinkTime`` attributes. Either way,
+each `Request` has its ``think_time`` attribute set to the pause in
+milliseconds, or ``None`` if it is not known.
+
 This module is designed to be used with the `webtest.runner` module, which is
 specifically designed to work with the Grinder load test framework, but the
 parser defined here is not Grinder-specific, and can be used for more
@@ -73,6 +109,7 @@ general-purpose parsing of ``.webtest`` files.
 
 # Everything in this script should be compatible with Jython 2.2.1.
 
+import os
 from xml import sax
 from urlparse import urlparse
 
@@ -108,6 +145,20 @@ class Request:
         self.description = ''
         # Line number where this request was defined
         self.line_number = line_number
+        # Name of the transaction this request is part of, if any
+        self.transaction = None
+        # Parsed capture expressions, cached by the runner
+        self.capture_specs = None
+        # Finds the literal prefixes of body captures, set by the runner
+        self.capture_scanner = None
+        # Recorded pause after this request in milliseconds, if known
+        self.think_time = None
+        if attrs.get('ThinkTime'):
+            try:
+                self.think_time = float(attrs['ThinkTime']) * 1000
+            except ValueError:
+                raise MalformedXML("Invalid ThinkTime '%s' on line %d" %
+                                   (attrs['ThinkTime'], line_number))
 
 
     def _add_attrs(self, attrs, to_list):
@@ -203,6 +254,8 @@ class WebtestHandler (sax.handler.ContentHandler):
         self.in_element = ''
         # Locator used to track line numbers
         self.locator = None
+        # Names of the TransactionTimer elements we're inside, outermost first
+        self.transactions = []
 
 
     def setDocumentLocator(self, locator):
@@ -226,6 +279,16 @@ class WebtestHandler (sax.handler.ContentHandler):
         # Request element? Create a new Request object
         if name == 'Request':
             self.request = Request(attrs, self.locator.getLineNumber())
+            if self.transactions:
+                self.request.transaction = self.transactions[-1]
+
+        # TransactionTimer element? Requests inside it are part of a transaction
+        elif name == 'TransactionTimer':
+            if self.request:
+                raise MalformedXML("%s inside Request" % name)
+            if not attrs.get('Name'):
+                raise MalformedXML("%s without a Name" % name)
+            self.transactions.append(attrs['Name'])
 
         # Header element? Add the header to the current request
         elif name == 'Header':
@@ -282,6 +345,10 @@ class WebtestHandler (sax.handler.ContentHandler):
             self.requests.append(self.request)
             self.request = None
 
+        # End of a transaction
+        elif name == 'TransactionTimer':
+            self.transactions.pop()
+
         # For elements with character content, reset in_element
         elif name in ('StringHttpBody', 'Capture', 'Description'):
             self.in_element = ''
@@ -325,6 +392,43 @@ class Webtest:
         infile.close()
         # Store a reference to the list of requests
         self.requests = self._handler.requests
+        # Load the timing file, if there is one
+        timing_filename = os.path.splitext(filename)[0] + '.timing'
+        if os.path.isfile(timing_filename):
+            self.load_timing(timing_filename)
+
+
+    def load_timing(self, filename):
+        """Set the ``think_time`` of each request from the given timing file.
+        Raise a ``ValueError`` if the file is invalid, or does not have one
+        line for each request.
+        """
+        times = []
+        infile = open(filename, 'r')
+        try:
+            line_number = 0
+            for line in infile.readlines():
+                line_number += 1
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                try:
+                    times.append([float(field) for field in fields[:2]])
+                except ValueError:
+                    raise ValueError("Invalid time on line %d of %s" %
+                                     (line_number, filename))
+        finally:
+            infile.close()
+        if len(times) != len(self.requests):
+            raise ValueError("%s has %d times for %d requests" %
+                             (filename, len(times), len(self.requests)))
+        for index in range(len(times)):
+            request = self.requests[index]
+            if index + 1 < len(times):
+                gap = times[index + 1][0] - times[index][-1]
+                request.think_time = max(gap, 0) * 1000
+            else:
+                request.think_time = None
 
     # For backwards compatibility
     parse = load
@@ -0,0 +1,236 @@
+# phases.py
+
+"""This module provides a `PhaseTimer`, for finding out where a worker
+thread's time goes while executing requests.
+
+Each request executed by `~webtest.runner.WebtestRunner.execute` goes through
+several phases:
+
+    ``logging``
+        Logging the test heading, and the response in ``debug`` mode
+    ``expressions``
+        Evaluating expressions in the request URL and body
+    ``nvpairs``
+        Evaluating expressions in parameters and headers
+    ``http``
+        Sending the request and receiving the response
+    ``bookkeeping``
+        Recording histograms, responses, pacing information and metrics
+    ``capture``
+        Evaluating capture expressions against the response
+
+Everything except ``http`` is load-generator overhead. To measure it, pass a
+`PhaseTimer` to `~webtest.runner.get_test_runner`::
+
+    from webtest.phases import PhaseTimer
+    TestRunner = get_test_runner(my_tests, phase_timer=PhaseTimer())
+
+Time spent in each phase is accumulated in nanosecond counters, per thread and
+test number. When all the threads that used the timer have finished (or at
+process exit), a table like this is written to the log, with totals for each
+test number and for each worker thread::
+
+    Test           Count      logging  expressions      nvpairs         http  bookkeeping      capture  overhead
+    1001             500         12.1         30.5          8.2       4801.3          0.9         41.9      1.9%
+    1002             500          4.0          2.2          3.1        950.1          0.3          0.0      1.0%
+    Total           1000         16.1         32.7         11.3       5751.4          1.2         41.9      1.8%
+
+    Thread         Count      logging  expressions      nvpairs         http  bookkeeping      capture  overhead
+    TestRunner      1000         16.1         32.7         11.3       5751.4          1.2         41.9      1.8%
+
+Times are in milliseconds, and ``overhead`` is the percentage of the total time
+spent outside the ``http`` phase. When no `PhaseTimer` is given, the runner
+only pays for a few ``if`` checks per request.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import atexit
+import thread
+import threading
+
+import clock
+
+# Names of the phases, in the order their counters are kept
+PHASES = ('logging', 'expressions', 'nvpairs', 'http', 'bookkeeping', 'capture')
+
+# Indexes of each phase's counter
+LOGGING, EXPRESSIONS, NVPAIRS, HTTP, BOOKKEEPING, CAPTURE = range(len(PHASES))
+# Index of the request count, after the phase counters
+COUNT = len(PHASES)
+
+
+def lap(counters, phase, mark):
+    """Add the time since ``mark`` (in nanoseconds) to the given phase's
+    counter, and return the current time.
+    """
+    now = clock.nanotime()
+    counters[phase] += now - mark
+    return now
+
+
+def _sum_counters(counter_lists):
+    """Return a counter list with the given counter lists added together.
+    """
+    result = [0] * (len(PHASES) + 1)
+    for counters in counter_lists:
+        for index in range(len(counters)):
+            result[index] += counters[index]
+    return result
+
+
+class PhaseTimer:
+    """Accumulates the time spent in each phase of executing requests, per
+    thread and test number.
+
+    Optional keyword arguments:
+
+        ``output``
+            Function called with the report table. If ``None``, the runner's
+            log function (normally ``grinder.logger.output``) is used; if the
+            timer is not used by a runner, no report is written.
+
+    """
+    def __init__(self, output=None):
+        """Create a PhaseTimer.
+        """
+        self.output = output
+        # Dicts of counter lists indexed by test number,
+        # indexed by thread identifier
+        self._threads = {}
+        # Thread names, indexed by thread identifier
+        self._names = {}
+        # Number of threads that have not yet called thread_finished
+        self._running = 0
+        self._reported = False
+        self._lock = threading.Lock()
+
+
+    def counters(self, test_number):
+        """Return the list of counters for the given test number in the
+        current thread. It holds the nanoseconds spent in each phase (indexed
+        by `LOGGING`, `EXPRESSIONS` etc.), followed by the number of
+        requests (indexed by `COUNT`).
+        """
+        try:
+            tests = self._threads[thread.get_ident()]
+        except KeyError:
+            tests = self._add_thread()
+        try:
+            return tests[test_number]
+        except KeyError:
+            counters = tests[test_number] = [0] * (len(PHASES) + 1)
+            return counters
+
+
+    def _add_thread(self):
+        """Create and return the dict of counters for the current thread.
+        """
+        self._lock.acquire()
+        try:
+            tests = {}
+            self._threads[thread.get_ident()] = tests
+            self._names[thread.get_ident()] = threading.currentThread().getName()
+            self._running += 1
+            if len(self._threads) == 1:
+                atexit.register(self.report)
+        finally:
+            self._lock.release()
+        return tests
+
+
+    def thread_finished(self):
+        """Note that the current thread has finished using the timer. When all
+        threads have finished, the report is written.
+        """
+        self._lock.acquire()
+        try:
+            if thread.get_ident() not in self._threads:
+                return
+            self._running -= 1
+            finished = self._running <= 0
+        finally:
+            self._lock.release()
+        if finished:
+            self.report()
+
+
+    def totals(self):
+        """Return ``(by_test, by_thread)``, where ``by_test`` is a dict of
+        counter lists indexed by test number, with the counters from all
+        threads added together, and ``by_thread`` is a dict of counter lists
+        indexed by thread name, with the counters from all tests (and all
+        threads with that name) added together.
+        """
+        self._lock.acquire()
+        thread_tests = self._threads.items()
+        self._lock.release()
+        by_test = {}
+        by_thread = {}
+        for ident, tests in thread_tests:
+            # Threads with the same name share a row
+            thread_total = by_thread.setdefault(self._names[ident],
+                                                [0] * (len(PHASES) + 1))
+            for test_number, counters in tests.items():
+                if test_number not in by_test:
+                    by_test[test_number] = [0] * (len(PHASES) + 1)
+                test_total = by_test[test_number]
+                for index in range(len(counters)):
+                    test_total[index] += counters[index]
+                    thread_total[index] += counters[index]
+        return by_test, by_thread
+
+
+    def format_table(self):
+        """Return a table of the time spent in each phase, in milliseconds,
+        for each test number, then for each thread.
+        """
+        by_test, by_thread = self.totals()
+        lines = [self._format_header('Test')]
+        test_numbers = by_test.keys()
+        test_numbers.sort()
+        for test_number in test_numbers:
+            lines.append(self._format_row(str(test_number), by_test[test_number]))
+        lines.append(self._format_row('Total', _sum_counters(by_test.values())))
+        lines.append('')
+        lines.append(self._format_header('Thread'))
+        names = by_thread.keys()
+        names.sort()
+        for name in names:
+            lines.append(self._format_row(name, by_thread[name]))
+        return '\n'.join(lines)
+
+
+    def _format_header(self, label):
+        """Return the header row of the table.
+        """
+        return '%-12s%8s' % (label, 'Count') + \
+               ''.join(['%13s' % phase for phase in PHASES]) + '%10s' % 'overhead'
+
+
+    def _format_row(self, label, counters):
+        """Return one row of the table.
+        """
+        total = sum(counters[:COUNT])
+        if total:
+            overhead = 100.0 * (total - counters[HTTP]) / total
+        else:
+            overhead = 0.0
+        return '%-12s%8d' % (label, counters[COUNT]) + \
+               ''.join(['%13.1f' % (ns / 1000000.0) for ns in counters[:COUNT]]) + \
+               '%9.1f%%' % overhead
+
+
+    def report(self):
+        """Write the table to ``output``, unless it has been written already.
+        """
+        self._lock.acquire()
+        try:
+            if self._reported or not self._threads or self.output is None:
+                return
+            self._reported = True
+        finally:
+            self._lock.release()
+        self.output("Time spent in each phase of execute() (ms):\n" +
+                    self.format_table())
+
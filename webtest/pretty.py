@@ -0,0 +1,291 @@
+# pretty.py
+
+"""Provides functions for pretty-printing XML and JSON response bodies, for
+use in debug logging.
+
+Both pretty-printers work in a single streaming pass over the text, without
+building a document tree, and stop as soon as their output reaches a given
+size limit. This keeps debug logging usable when responses are large::
+
+    >>> print(pretty_json('{"id": 42, "tags": ["a", "b"]}'))
+    {
+      "id": 42,
+      "tags": [
+        "a",
+        "b"
+      ]
+    }
+
+If the output is cut short, it ends with a truncation marker::
+
+    >>> print(pretty_xml('<a><b>text</b><c/></a>', limit=13))
+    <a>
+      <b>text
+    ... [truncated, 22 characters total]
+
+XML is parsed with the ``xml.sax`` parser, and JSON is split into tokens by
+`iter_json_tokens`, which may also be used on its own.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+from __future__ import generators
+
+import re
+from xml import sax
+from xml.sax.saxutils import escape, quoteattr
+
+# Default maximum number of characters to output
+DEFAULT_LIMIT = 65536
+
+# Number of characters fed to the XML parser at a time
+_CHUNK_SIZE = 16384
+
+# Indentation for each nesting level
+_INDENT = '  '
+
+
+class _LimitReached (Exception):
+    """Raised internally when the output limit is reached."""
+    pass
+
+
+class _BoundedWriter:
+    """Collects output, up to a maximum number of characters.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+
+
+    def write(self, text):
+        """Append ``text`` to the output. If this reaches the limit, append
+        as much as will fit, and raise `_LimitReached`.
+        """
+        if self.limit is not None and self.size + len(text) > self.limit:
+            self.parts.append(text[:self.limit - self.size])
+            self.size = self.limit
+            raise _LimitReached()
+        self.parts.append(text)
+        self.size += len(text)
+
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+def _truncated(output, text):
+    """Return ``output`` with a truncation marker added, noting the length
+    of the original ``text``.
+    """
+    return output + '\n... [truncated, %d characters total]' % len(text)
+
+
+def _encoded_chunks(text):
+    """Iterate over ``text`` in chunks of about ``_CHUNK_SIZE`` characters,
+    encoding each chunk as UTF-8 if ``text`` is unicode. Encoding one chunk at
+    a time means the parser can stop early without encoding the whole text.
+    """
+    start = 0
+    while start < len(text):
+        end = start + _CHUNK_SIZE
+        chunk = text[start:end]
+        if isinstance(chunk, unicode):
+            # Don't split a surrogate pair between chunks
+            if u'\ud800' <= chunk[-1:] <= u'\udbff':
+                end += 1
+                chunk = text[start:end]
+            chunk = chunk.encode('utf-8')
+        yield chunk
+        start = end
+
+
+def truncate(text, limit=DEFAULT_LIMIT):
+    """Return ``text`` unchanged, or cut down to ``limit`` characters with a
+    truncation marker added.
+    """
+    if limit is None or len(text) <= limit:
+        return text
+    return _truncated(text[:limit], text)
+
+
+class PrettyXMLHandler (sax.handler.ContentHandler):
+    """Content handler for xml.sax parser, which writes each element on its
+    own line, indented according to its depth.
+    """
+    def __init__(self, writer):
+        """Create a handler that writes to the given `_BoundedWriter`.
+        """
+        sax.handler.ContentHandler.__init__(self)
+        self.writer = writer
+        self.depth = 0
+        # Opening tag that has not been written yet, since we don't know
+        # whether the element is empty, or contains only text
+        self.pending = None
+        self.text = []
+
+
+    def _flush_pending(self):
+        """Write the pending opening tag, and any text that followed it.
+        """
+        text = ''.join(self.text).strip()
+        self.text = []
+        if self.pending is not None:
+            self.writer.write(self.pending + '>')
+            self.pending = None
+            if text:
+                self.writer.write(escape(text))
+        elif text:
+            self.writer.write('\n' + _INDENT * self.depth + escape(text))
+
+
+    def startElement(self, name, attrs):
+        self._flush_pending()
+        tag = '<' + name
+        for attr_name in attrs.getNames():
+            tag += ' %s=%s' % (attr_name, quoteattr(attrs.getValue(attr_name)))
+        if self.depth or self.writer.size:
+            tag = '\n' + _INDENT * self.depth + tag
+        self.pending = tag
+        self.depth += 1
+
+
+    def characters(self, data):
+        self.text.append(data)
+
+
+    def endElement(self, name):
+        self.depth -= 1
+        # Element with no children: write it on a single line
+        if self.pending is not None:
+            text = ''.join(self.text).strip()
+            self.writer.write(self.pending)
+            self.pending = None
+            self.text = []
+            if text:
+                self.writer.write('>%s</%s>' % (escape(text), name))
+            else:
+                self.writer.write('/>')
+        else:
+            self._flush_pending()
+            self.writer.write('\n' + _INDENT * self.depth + '</%s>' % name)
+
+
+    def ignorableWhitespace(self, whitespace):
+        pass
+
+
+def pretty_xml(text, limit=DEFAULT_LIMIT):
+    """Return the given XML text pretty-printed, with one element per line.
+    At most ``limit`` characters are output (or all of them, if ``limit`` is
+    ``None``). If the text is not well-formed XML, it is returned unchanged
+    (but truncated to ``limit``).
+    """
+    writer = _BoundedWriter(limit)
+    handler = PrettyXMLHandler(writer)
+    saxparser = sax.make_parser()
+    saxparser.setContentHandler(handler)
+    # Don't fetch external entities referenced by the response
+    try:
+        saxparser.setFeature(sax.handler.feature_external_ges, False)
+    except (sax.SAXNotRecognizedException, sax.SAXNotSupportedException):
+        pass
+    try:
+        for chunk in _encoded_chunks(text):
+            saxparser.feed(chunk)
+        saxparser.close()
+    except _LimitReached:
+        return _truncated(writer.getvalue(), text)
+    except sax.SAXException:
+        return truncate(text, limit)
+    return writer.getvalue()
+
+
+# A single JSON token: punctuation, a string, or a number or literal
+_json_token = re.compile(r'\s*(?:([{}\[\]:,])|("(?:[^"\\]|\\.)*")|([^\s{}\[\]:,"]+))')
+_json_space = re.compile(r'\s*')
+
+class MalformedJSON (Exception):
+    """Raised when text cannot be split into JSON tokens."""
+    pass
+
+
+def iter_json_tokens(text, start=0):
+    """Iterate over the tokens in a JSON document, starting at the given
+    offset. Each token is yielded as ``(kind, token)``, where ``kind`` is one
+    of ``{ } [ ] : ,`` for punctuation, ``"`` for strings, or ``0`` for
+    numbers and the literals ``true``, ``false`` and ``null``; ``token`` is the
+    text of the token exactly as it appears, including quotes for strings.
+
+    The document is not validated, only tokenized. `MalformedJSON` is raised
+    if something that is not a token is encountered.
+    """
+    end = _json_space.match(text, start).end()
+    length = len(text)
+    while end < length:
+        match = _json_token.match(text, end)
+        if not match:
+            raise MalformedJSON("Unexpected character at offset %d" % end)
+        punctuation, string, other = match.groups()
+        if punctuation:
+            yield punctuation, punctuation
+        elif string:
+            yield '"', string
+        else:
+            yield 0, other
+        end = _json_space.match(text, match.end()).end()
+
+
+def pretty_json(text, limit=DEFAULT_LIMIT):
+    """Return the given JSON text pretty-printed, with each value on its own
+    line. At most ``limit`` characters are output (or all of them, if
+    ``limit`` is ``None``). If the text cannot be tokenized, it is returned
+    unchanged (but truncated to ``limit``).
+    """
+    writer = _BoundedWriter(limit)
+    depth = 0
+    # Whether the previous token opened an object or array
+    after_open = False
+    try:
+        for kind, token in iter_json_tokens(text):
+            if kind in ('}', ']'):
+                depth -= 1
+                if not after_open:
+                    writer.write('\n' + _INDENT * depth)
+                writer.write(token)
+                after_open = False
+                continue
+            if after_open:
+                writer.write('\n' + _INDENT * depth)
+                after_open = False
+            if kind in ('{', '['):
+                writer.write(token)
+                depth += 1
+                after_open = True
+            elif kind == ',':
+                writer.write(',\n' + _INDENT * depth)
+            elif kind == ':':
+                writer.write(': ')
+            else:
+                writer.write(token)
+    except _LimitReached:
+        return _truncated(writer.getvalue(), text)
+    except MalformedJSON:
+        return truncate(text, limit)
+    return writer.getvalue()
+
+
+def prettify(text, content_type='', limit=DEFAULT_LIMIT):
+    """Return the given response body pretty-printed according to its
+    ``content_type``, or its content if the type is not given. XML and JSON
+    are pretty-printed; anything else is just truncated to ``limit``.
+    """
+    content_type = (content_type or '').lower()
+    stripped = text[:64].lstrip()
+    if 'xml' in content_type or stripped.startswith('<?xml'):
+        return pretty_xml(text, limit)
+    elif 'json' in content_type or stripped[:1] in ('{', '['):
+        return pretty_json(text, limit)
+    return truncate(text, limit)
+
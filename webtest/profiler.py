@@ -0,0 +1,222 @@
+# profiler.py
+
+"""This module provides a `Profiler`, for finding out which Python code is
+using the worker threads' time, such as custom `~webtest.macro.Macro`
+subclasses or slow capture expressions.
+
+Pass a `Profiler` to `~webtest.runner.get_test_runner` using the ``profile``
+keyword::
+
+    from webtest.profiler import Profiler
+    TestRunner = get_test_runner(my_tests, profile=Profiler(sample=0.01))
+
+A sample of iterations (here, 1% of them) are then run under a deterministic
+profiler, installed with ``sys.setprofile`` in the worker thread running the
+iteration; other iterations run at full speed. The time spent in each distinct
+call stack is accumulated across all threads, and written in "collapsed stack"
+format, one stack per line, with frames separated by semicolons and followed by
+the number of microseconds spent in that stack::
+
+    WebtestRunner.__call__;_run_iteration (runner.py:1294);run_test_set (runner.py:1265);_run_webtest_file (runner.py:1242);execute (runner.py:1089) 1830
+    WebtestRunner.__call__;_run_iteration (runner.py:1294);run_test_set (runner.py:1265);_run_webtest_file (runner.py:1242);execute (runner.py:1089);eval_expressions (runner.py:849) 412
+
+This can be turned into a flame graph with Brendan Gregg's ``flamegraph.pl``,
+or loaded into tools such as speedscope. Each worker process writes its own
+file, named after the Grinder process (``profile-<process>.folded``) unless a
+``filename`` is given. The file is written when the last
+`~webtest.runner.WebtestRunner` that profiled an iteration is destroyed, and
+rewritten at process exit if more iterations have been profiled since.
+
+Profiling adds a lot of overhead to the profiled iterations, so the times of
+requests sent during them should not be trusted; keep ``sample`` small.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import atexit
+import os
+import random
+import sys
+import thread
+import threading
+
+import clock
+
+# Label of the root frame of every stack
+ROOT = 'WebtestRunner.__call__'
+
+
+def _process_name():
+    """Return a name for the current process, for use in filenames.
+    """
+    try:
+        from net.grinder.script.Grinder import grinder
+        return grinder.getProcessName()
+    except ImportError:
+        if hasattr(os, 'getpid'):
+            return str(os.getpid())
+        return 'process'
+
+
+def _frame_label(frame):
+    """Return the label for a Python function's frame.
+    """
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class _StackProfile:
+    """Accumulates the time spent in each call stack while profiling a single
+    call, in a single thread.
+    """
+    def __init__(self):
+        # Labels of the current stack, joined by semicolons, one per frame;
+        # the last one is the stack that time is currently spent in
+        self.keys = [ROOT]
+        # Nanoseconds spent in each stack, indexed by key
+        self.times = {}
+        self.mark = clock.nanotime()
+
+
+    def event(self, frame, event, arg):
+        """Profile function, called by the interpreter on each function call
+        and return.
+        """
+        now = clock.nanotime()
+        key = self.keys[-1]
+        self.times[key] = self.times.get(key, 0) + now - self.mark
+        if event == 'call':
+            self.keys.append(key + ';' + _frame_label(frame))
+        elif event == 'c_call':
+            if arg is not sys.setprofile:
+                self.keys.append(key + ';' + getattr(arg, '__name__', '?'))
+        elif len(self.keys) > 1:
+            # 'return', 'c_return' or 'c_exception'
+            self.keys.pop()
+        # Don't count the time spent in this function
+        self.mark = clock.nanotime()
+
+
+class Profiler:
+    """Profiles a sample of `~webtest.runner.WebtestRunner` iterations, and
+    writes the time spent in each call stack to a collapsed stack file.
+
+    Optional keyword arguments:
+
+        ``filename``
+            File to write the collapsed stacks to. If ``None``, the file is
+            named ``profile-<process>.folded``, after the Grinder process.
+        ``sample``
+            Fraction of iterations to profile, between 0.0 and 1.0.
+
+    """
+    def __init__(self, filename=None, sample=0.01):
+        """Create a Profiler.
+        """
+        if filename is None:
+            filename = 'profile-%s.folded' % _process_name()
+        self.filename = filename
+        self.sample = sample
+        # Number of iterations profiled so far
+        self.profiled = 0
+        # Microseconds spent in each stack, indexed by stack
+        self.stacks = {}
+        # Number of iterations profiled when the file was last written
+        self._written = 0
+        # Identifiers of threads that have profiled an iteration, and not yet
+        # called thread_finished
+        self._threads = {}
+        self._lock = threading.Lock()
+        # Serializes writes to the file
+        self._write_lock = threading.Lock()
+        self._registered = False
+
+
+    def sampled(self):
+        """Return True if the next iteration should be profiled.
+        """
+        return self.sample >= 1.0 or random.random() < self.sample
+
+
+    def run(self, function, *args):
+        """Call ``function`` with the given arguments under the profiler, and
+        return its result. The time spent in each call stack is added to
+        ``stacks``.
+        """
+        profile = _StackProfile()
+        sys.setprofile(profile.event)
+        try:
+            result = function(*args)
+        finally:
+            sys.setprofile(None)
+            self._merge(profile.times)
+        return result
+
+
+    def _merge(self, times):
+        """Add the nanosecond times of a single profiled call to ``stacks``.
+        """
+        self._lock.acquire()
+        try:
+            for key, nanoseconds in times.items():
+                self.stacks[key] = self.stacks.get(key, 0) + nanoseconds // 1000
+            self.profiled += 1
+            self._threads[thread.get_ident()] = True
+            if not self._registered:
+                atexit.register(self.write)
+                self._registered = True
+        finally:
+            self._lock.release()
+
+
+    def format_stacks(self):
+        """Return the collapsed stacks, one per line, sorted by stack.
+        """
+        self._lock.acquire()
+        try:
+            items = self.stacks.items()
+        finally:
+            self._lock.release()
+        items.sort()
+        lines = []
+        for key, microseconds in items:
+            if microseconds:
+                lines.append('%s %d\n' % (key, microseconds))
+        return ''.join(lines)
+
+
+    def thread_finished(self):
+        """Note that the current thread has finished. When all threads that
+        have profiled an iteration have finished, the file is written.
+        """
+        self._lock.acquire()
+        try:
+            if thread.get_ident() not in self._threads:
+                return
+            del self._threads[thread.get_ident()]
+            finished = not self._threads
+        finally:
+            self._lock.release()
+        if finished:
+            self.write()
+
+
+    def write(self):
+        """Write the collapsed stacks to ``filename``, if any iterations have
+        been profiled since it was last written.
+        """
+        self._write_lock.acquire()
+        try:
+            profiled = self.profiled
+            if profiled == self._written:
+                return
+            self._written = profiled
+            outfile = open(self.filename, 'w')
+            try:
+                outfile.write(self.format_stacks())
+            finally:
+                outfile.close()
+        finally:
+            self._write_lock.release()
+
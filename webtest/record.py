@@ -0,0 +1,475 @@
+# record.py
+
+"""This module provides a way to record HTTP responses received during a test
+run into a compact, indexed, append-only archive, and to read them back later.
+
+To record responses, create a `Recorder` and pass it to
+`~webtest.runner.get_test_runner`::
+
+    from webtest.record import Recorder
+
+    recorder = Recorder('responses.rec', sample=0.01, compress=True)
+    TestRunner = get_test_runner(my_tests, recorder=recorder)
+
+Each time a `~webtest.runner.WebtestRunner` begins an iteration (a single
+``__call__``), it asks the `Recorder` whether that iteration should be
+recorded; with ``sample=0.01``, roughly 1% of iterations are recorded. Every
+response in a recorded iteration is stored with its status code, headers,
+timing and body.
+
+Records are handed to a background writer thread through a bounded queue, so
+worker threads never block on disk I/O. If the queue is full, the record is
+dropped, and the ``dropped`` counter of the `Recorder` is incremented.
+
+The archive consists of two files: the archive itself (``responses.rec`` in
+the example above), and an index (``responses.rec.idx``) with one fixed-size
+entry per record. Use `RecordReader` to read them::
+
+    >>> from webtest.record import RecordReader
+    >>> reader = RecordReader('responses.rec')
+    >>> len(reader)
+    42
+    >>> for record in reader.select(test_number=1002):
+    ...     print(record)
+
+If the index is missing (for example, if the writing process was killed), it
+is rebuilt by scanning the archive.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+from __future__ import generators
+
+import atexit
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+import Queue
+
+# Written at the start of every archive
+MAGIC = 'WTREC1\n'
+
+# Flag bits for each record
+FLAG_COMPRESSED = 1
+
+# Record prefix: payload length, flags
+_PREFIX = '>IB'
+_PREFIX_SIZE = struct.calcsize(_PREFIX)
+# Payload header: test number, thread number, start time, elapsed seconds,
+# status code, header block length, body length
+_PAYLOAD = '>iiddHII'
+_PAYLOAD_SIZE = struct.calcsize(_PAYLOAD)
+# Index entry: archive offset, test number, start time, status code
+_INDEX = '>QidH'
+_INDEX_SIZE = struct.calcsize(_INDEX)
+
+
+class BadArchive (Exception):
+    """Raised when a record archive cannot be read."""
+    pass
+
+
+class Record:
+    """A single recorded HTTP response, including:
+
+        test_number
+            Number of the Grinder `Test` that sent the request
+        thread_number
+            Grinder worker thread that sent the request
+        start
+            Time when the request was sent, in seconds since the epoch
+        elapsed
+            Time taken to receive the response, in seconds
+        status
+            HTTP status code of the response
+        headers
+            A list of ``(Name, Value)`` for the response headers
+        body
+            The response body, as a UTF-8 encoded string
+
+    """
+    def __init__(self, test_number, thread_number, start, elapsed,
+                 status, headers, body):
+        """Create a Record with the given attributes.
+        """
+        self.test_number = test_number
+        self.thread_number = thread_number
+        self.start = start
+        self.elapsed = elapsed
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+    def encode(self):
+        """Return the record payload as a packed string.
+        """
+        header_block = ''.join(
+            ['%s: %s\r\n' % (name, value) for name, value in self.headers])
+        return struct.pack(_PAYLOAD, self.test_number, self.thread_number,
+                           self.start, self.elapsed, self.status,
+                           len(header_block), len(self.body)) \
+               + header_block + self.body
+
+
+    def decode(cls, payload):
+        """Return a `Record` unpacked from a string returned by `encode`.
+        """
+        test_number, thread_number, start, elapsed, status, \
+            header_length, body_length = \
+            struct.unpack(_PAYLOAD, payload[:_PAYLOAD_SIZE])
+        offset = _PAYLOAD_SIZE
+        header_block = payload[offset:offset + header_length]
+        offset += header_length
+        body = payload[offset:offset + body_length]
+        headers = []
+        for line in header_block.split('\r\n'):
+            if line:
+                name, value = line.split(': ', 1)
+                headers.append((name, value))
+        return cls(test_number, thread_number, start, elapsed,
+                   status, headers, body)
+
+    # Make this a class method
+    decode = classmethod(decode)
+
+
+    def __str__(self):
+        """Return a one-line string summarizing the record.
+        """
+        return 'Test %d (thread %d): %d, %d bytes in %.1f ms' % \
+            (self.test_number, self.thread_number, self.status,
+             len(self.body), self.elapsed * 1000)
+
+
+def _encode_text(text):
+    """Return ``text`` as a UTF-8 encoded string.
+    """
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return str(text)
+
+
+class _FlushRequest:
+    """Queued by `Recorder.flush` to wait for the writer thread.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class Recorder:
+    """Records HTTP responses to an append-only archive, using a background
+    writer thread.
+
+        ``filename``
+            Name of the archive file to append to. The index is written
+            alongside it, with an ``.idx`` extension added.
+
+    Optional keyword arguments:
+
+        ``sample``
+            Fraction of iterations to record, between 0.0 and 1.0.
+        ``compress``
+            If true, compress each record with zlib.
+        ``queue_size``
+            Maximum number of records waiting to be written; records
+            received while the queue is full are dropped.
+        ``timeout``
+            Maximum time in seconds that `flush` and `close` wait for the
+            writer thread.
+
+    If writing fails (for instance, when the disk is full), the error is kept
+    in ``error``, and any later records are dropped.
+
+    """
+    def __init__(self, filename, sample=1.0, compress=False, queue_size=1000,
+                 timeout=30):
+        """Create a Recorder. No files are opened until the first record
+        is received.
+        """
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.sample = sample
+        self.compress = compress
+        self.timeout = timeout
+        # Number of records written, and dropped due to a full queue or an
+        # error
+        self.written = 0
+        self.dropped = 0
+        # Error that stopped the writer thread, if any
+        self.error = None
+        self._queue = Queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+    def sampled(self):
+        """Return True if the next iteration should be recorded.
+        """
+        return self.sample >= 1.0 or random.random() < self.sample
+
+
+    def record(self, test_number, thread_number, start, elapsed, response):
+        """Queue the given response for writing, without blocking. Return
+        True if the response was queued, or False if it was dropped.
+        """
+        headers = []
+        for name in response.listHeaders():
+            headers.append((name, _encode_text(response.getHeader(name))))
+        record = Record(test_number, thread_number, start, elapsed,
+                        response.getStatusCode(), headers,
+                        _encode_text(response.getText()))
+        self._start()
+        if self.error is None:
+            try:
+                self._queue.put_nowait(record)
+                return True
+            except Queue.Full:
+                pass
+        self._lock.acquire()
+        self.dropped += 1
+        self._lock.release()
+        return False
+
+
+    def _put(self, item, thread):
+        """Queue the given item for the writer ``thread``, waiting up to
+        ``timeout`` seconds for room. Return True if it was queued, or False
+        if there was no room in time, or the thread has stopped.
+        """
+        deadline = time.time() + self.timeout
+        while thread.isAlive():
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except Queue.Full:
+                if time.time() >= deadline:
+                    return False
+                time.sleep(0.01)
+        return False
+
+
+    def flush(self):
+        """Wait until all queued records have been written to disk, for up to
+        ``timeout`` seconds. Return True if they were, or False if writing
+        failed, or did not finish in time.
+        """
+        thread = self._thread
+        if thread is None:
+            return True
+        request = _FlushRequest()
+        if not self._put(request, thread):
+            return False
+        request.done.wait(self.timeout)
+        return request.done.isSet() and self.error is None
+
+
+    def close(self):
+        """Write all queued records, and stop the writer thread, waiting up
+        to ``timeout`` seconds for it.
+        """
+        self._lock.acquire()
+        thread, self._thread = self._thread, None
+        self._lock.release()
+        if thread is not None and self._put(None, thread):
+            thread.join(self.timeout)
+
+
+    def _start(self):
+        """Start the writer thread, if it isn't already running.
+        """
+        if self._thread is not None:
+            return
+        self._lock.acquire()
+        try:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_records)
+                self._thread.setDaemon(True)
+                self._thread.start()
+                # Make sure queued records are written before exiting
+                atexit.register(self.close)
+        finally:
+            self._lock.release()
+
+
+    def _write_records(self):
+        """Write records from the queue until a ``None`` is received.
+        Executed by the writer thread. If writing fails, the error is kept,
+        and the rest of the queue is discarded, so nothing waits on it.
+        """
+        archive = index = None
+        try:
+            try:
+                archive = open(self.filename, 'ab')
+                index = open(self.index_filename, 'ab')
+                archive.seek(0, 2)
+                if archive.tell() == 0:
+                    archive.write(MAGIC)
+                while True:
+                    item = self._queue.get()
+                    if item is None:
+                        return
+                    # Flush request; write everything out and wake up the caller
+                    if isinstance(item, _FlushRequest):
+                        archive.flush()
+                        index.flush()
+                        item.done.set()
+                        continue
+                    self._write_record(archive, index, item)
+                    # Flush whenever the queue runs dry
+                    if self._queue.empty():
+                        archive.flush()
+                        index.flush()
+            except Exception, e:
+                self.error = e
+                self._discard_queue()
+        finally:
+            for outfile in (archive, index):
+                if outfile is not None:
+                    try:
+                        outfile.close()
+                    except (IOError, OSError):
+                        pass
+
+
+    def _discard_queue(self):
+        """Drop queued records, and wake up any callers of `flush`, until a
+        ``None`` is received. Executed by the writer thread after an error.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+            else:
+                self._lock.acquire()
+                self.dropped += 1
+                self._lock.release()
+
+
+    def _write_record(self, archive, index, record):
+        """Append the given `Record` to the archive and index files.
+        """
+        payload = record.encode()
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload)
+            flags |= FLAG_COMPRESSED
+        offset = archive.tell()
+        archive.write(struct.pack(_PREFIX, len(payload), flags) + payload)
+        index.write(struct.pack(_INDEX, offset, record.test_number,
+                                record.start, record.status))
+        self.written += 1
+
+
+class RecordReader:
+    """Reads `Record`\s from an archive written by a `Recorder`.
+
+        ``filename``
+            Name of the archive file to read
+
+    """
+    def __init__(self, filename):
+        """Open the given archive, and load its index.
+        """
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self._archive = open(filename, 'rb')
+        if self._archive.read(len(MAGIC)) != MAGIC:
+            self._archive.close()
+            raise BadArchive("%s is not a record archive" % filename)
+        # List of (offset, test_number, start, status)
+        if os.path.exists(self.index_filename):
+            self.index = self._read_index()
+        else:
+            self.index = self._scan()
+
+
+    def _read_index(self):
+        """Read and return the list of index entries.
+        """
+        infile = open(self.index_filename, 'rb')
+        data = infile.read()
+        infile.close()
+        entries = []
+        # Ignore a partial entry at the end, if the writer was interrupted
+        for offset in range(0, len(data) - _INDEX_SIZE + 1, _INDEX_SIZE):
+            entries.append(
+                struct.unpack(_INDEX, data[offset:offset + _INDEX_SIZE]))
+        return entries
+
+
+    def _scan(self):
+        """Rebuild the list of index entries by reading the whole archive.
+        """
+        entries = []
+        offset = len(MAGIC)
+        while True:
+            try:
+                record = self._read_at(offset)
+            except BadArchive:
+                break
+            entries.append(
+                (offset, record.test_number, record.start, record.status))
+            offset = self._archive.tell()
+        return entries
+
+
+    def _read_at(self, offset):
+        """Read and return the `Record` starting at the given offset.
+        """
+        self._archive.seek(offset)
+        prefix = self._archive.read(_PREFIX_SIZE)
+        if len(prefix) < _PREFIX_SIZE:
+            raise BadArchive("Truncated record at offset %d" % offset)
+        length, flags = struct.unpack(_PREFIX, prefix)
+        payload = self._archive.read(length)
+        if len(payload) < length:
+            raise BadArchive("Truncated record at offset %d" % offset)
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        return Record.decode(payload)
+
+
+    def __len__(self):
+        """Return the number of records in the archive.
+        """
+        return len(self.index)
+
+
+    def __getitem__(self, number):
+        """Return the `Record` with the given index number.
+        """
+        return self._read_at(self.index[number][0])
+
+
+    def __iter__(self):
+        """Iterate over all records in the archive, in the order they
+        were written.
+        """
+        for entry in self.index:
+            yield self._read_at(entry[0])
+
+
+    def select(self, test_number=None, status=None):
+        """Iterate over records matching the given test number and/or status
+        code. Only the index is consulted to find matches, so non-matching
+        records are never read.
+        """
+        for offset, entry_test, start, entry_status in self.index:
+            if test_number is not None and entry_test != test_number:
+                continue
+            if status is not None and entry_status != status:
+                continue
+            yield self._read_at(offset)
+
+
+    def close(self):
+        """Close the archive file.
+        """
+        self._archive.close()
+
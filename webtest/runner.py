@@ -106,6 +106,17 @@ Here, ``INVOICE_ID`` is set to the value ``12345``; any later reference to
 that come later in the same `TestSet`) will evaluate to ``12345``. See the
 `WebtestRunner.eval_expressions` method below for details.
 
+Variables set or captured by a `TestRunner` normally last for the life of the
+thread, so that later iterations can use them. If they are only needed within
+an iteration, or a single `TestSet`, pass ``variable_scope='iteration'`` or
+``variable_scope='test_set'``::
+
+    TestRunner = get_test_runner(my_tests, variable_scope='iteration')
+
+Variables set in each iteration (or `TestSet`) are then discarded when it
+finishes, while those set by the ``before_set`` are kept. See the
+`webtest.scope` module for details.
+
 Variables can also be set to the result of a "macro"; this is useful if you
 need to refer to the current date (when the script runs), or for generating
 random alphanumeric values::
@@ -114,7 +125,12 @@ random alphanumeric values::
     <FormPostParameter Name="INVOICE_ID" Value="{INVOICE_ID = random_digits(10)}"/>
 
 See the `webtest.macro` module for details on using macros and defining custom
-macros.
+macros. To take values from a CSV file, such as a different username for each
+thread, use the built-in ``data`` macro::
+
+    <FormPostParameter Name="UID" Value="{USERNAME = data(users.csv, username)}"/>
+
+See the `webtest.data` module for details.
 
 Finally, and perhaps most importantly, if you need to set a variable's value
 from one of the HTTP responses in your ``.webtest``, you can use a capture
@@ -230,6 +246,30 @@ weight. This allows you to more closely mimic a real-world distribution of
 activity among your various test scenarios.
 
 
+Transactions
+------------
+
+Each request in a ``.webtest`` file gets its own Grinder test number, so a page
+that takes 40 requests to load gives you 40 separate timings. To time the page
+as a whole, enclose its requests in a ``TransactionTimer`` element::
+
+    <TransactionTimer Name="Home page">
+      <Items>
+        <Request Method="GET" Url="http://{SERVER}/" />
+        <Request Method="GET" Url="http://{SERVER}/style.css" />
+        ...
+      </Items>
+    </TransactionTimer>
+
+Consecutive requests in the same transaction are then also wrapped in a test
+of their own, numbered after the requests in the file, which times them as a
+unit. No think time is taken between the requests in a transaction, only after
+the last one. If you only want the transaction timings, pass
+``request_stats=False`` to `get_test_runner`; the requests inside transactions
+are then sent without being recorded as Grinder tests, which also reduces the
+number of rows in the Grinder console.
+
+
 Before and After
 ----------------
 
@@ -247,15 +287,204 @@ The ``before_set`` will be run when a `WebtestRunner` instance is created
 be run when the instance is destroyed (the thread finishes execution, or is
 interrupted).
 
+If logging in is expensive, and you want many distinct users cycling through
+the scenarios, pass a `~webtest.session.SessionPool` using the
+``session_pool`` keyword::
+
+    from webtest.session import SessionPool
+    TestRunner = get_test_runner(my_tests, before_set=login, after_set=logout,
+                                 session_pool=SessionPool(size=50, max_age=900))
+
+Each iteration then checks out a session (the variables and cookies captured
+by the ``before_set``) from the pool, and returns it afterwards. The
+``before_set`` is only run to create a session, or to refresh one that has
+expired, and the ``after_set`` just before a session is refreshed. See the
+`webtest.session` module for details.
+
+
+Recording Responses
+-------------------
+
+To keep a copy of the responses received during a test run, pass a
+`~webtest.record.Recorder` using the ``recorder`` keyword::
+
+    from webtest.record import Recorder
+    recorder = Recorder('responses.rec', sample=0.01, compress=True)
+    TestRunner = get_test_runner(my_tests, recorder=recorder)
+
+The status, headers, timing and body of every response in a sampled iteration
+(here, 1% of them) are written to an append-only archive by a background
+thread. See the `webtest.record` module for how to read them back.
+
+Conversely, for scenarios that download large images, PDFs or reports, pass
+``discard_bodies=True``. The bodies of responses to requests that have no
+``Capture`` looking at the body are then read and thrown away as they arrive,
+instead of being kept in memory and decoded to text; captures from headers or
+the status code (see `WebtestRunner.eval_capture`) still work. Bodies are
+still kept at ``debug`` verbosity, or when there is a ``recorder``.
+
+
+Latency Histograms
+------------------
+
+Grinder reports the mean and standard deviation of each test's response time.
+For percentiles, pass a `~webtest.histogram.HistogramRecorder` using the
+``histograms`` keyword::
+
+    from webtest.histogram import HistogramRecorder
+    histograms = HistogramRecorder('latency-%s.hist' % grinder.processName)
+    TestRunner = get_test_runner(my_tests, histograms=histograms)
+
+The time taken by every request is recorded in a histogram for its test
+number. Histogram files from several processes or agents can be merged to
+report accurate percentiles; see the `webtest.histogram` module.
+
+Each `WebtestRunner` waits for one response before sending the next request,
+so when the server slows down, fewer requests are sent, and the slow period is
+under-represented in the results (this is called "coordinated omission"). To
+avoid this, give a ``pacing`` interval, in milliseconds, instead of a
+``think_time``::
+
+    TestRunner = get_test_runner(my_tests, pacing=2000, histograms=histograms)
+
+Each thread then aims to start a request every 2000 milliseconds (so 10
+threads give an arrival rate of 5 requests per second). Along with the
+``service`` time of each request, the histograms get a ``response`` time,
+measured from when the request was scheduled to start. If a response takes
+longer than the pacing interval, the requests that should have been sent in
+the meantime are back-filled into the ``response`` histogram, and the schedule
+skips ahead rather than sending the missed requests all at once.
+
+To replay recorded traffic with the pauses the user actually made, rather
+than a flat ``think_time``, give a ``replay_speed``::
+
+    TestRunner = get_test_runner(my_tests, replay_speed=10)
+
+After each request (or transaction) with a recorded pause, taken from its
+``ThinkTime`` attribute or from a timing file (see `webtest.parser`), the
+thread then sleeps for that pause divided by ``replay_speed``, so 1 replays
+the original timing, and 10 replays it ten times faster. The ``think_time`` is
+still used after requests without a recorded pause. With many threads, this
+replays the shape of real traffic at a higher intensity.
+
+
+Logging
+-------
+
+By default, log output is written by each worker thread as it goes. To move
+log I/O off the worker threads, pass a `~webtest.logsink.LogSink` using the
+``log_sink`` keyword::
+
+    from webtest.logsink import LogSink
+    TestRunner = get_test_runner(my_tests, verbosity='info',
+                                 log_sink=LogSink())
+
+Log messages are then buffered per thread, and written in batches by a single
+background thread. See the `webtest.logsink` module for details.
+
+When a capture expression is not matched, the whole response body is written
+to the log. To save it to a separate file instead, with duplicate bodies saved
+only once, pass a `~webtest.dump.FailureDumper` using the ``failure_dumper``
+keyword::
+
+    from webtest.dump import FailureDumper
+    TestRunner = get_test_runner(my_tests,
+                                 failure_dumper=FailureDumper('failures'))
+
+
+Profiling
+---------
+
+To find out where the worker threads spend their time (in your own macros, for
+example), pass a `~webtest.profiler.Profiler` using the ``profile`` keyword::
+
+    from webtest.profiler import Profiler
+    TestRunner = get_test_runner(my_tests, profile=Profiler(sample=0.01))
+
+A sample of iterations is then run under a profiler, and the time spent in
+each call stack is written to a file that can be turned into a flame graph.
+For a cheaper summary of where the time goes within each request, pass a
+`~webtest.phases.PhaseTimer` using the ``phase_timer`` keyword.
+
+If the load generator itself runs short of CPU, response times are inflated
+and fewer requests are sent than intended. To detect this, pass a
+`~webtest.saturation.SaturationMonitor` using the ``saturation_monitor``
+keyword; it measures how late the worker threads wake up from their sleeps,
+and says at the end of the run whether the results can be trusted.
+
+
+Live Metrics
+------------
+
+To watch a long test run on a dashboard, pass a
+`~webtest.export.MetricsExporter` using the ``exporter`` keyword::
+
+    from webtest.export import MetricsExporter
+    TestRunner = get_test_runner(my_tests,
+                                 exporter=MetricsExporter('127.0.0.1', 8125))
+
+Request counts, errors, bytes and response time percentiles for each test are
+then sent to a statsd (or InfluxDB) server every few seconds, over UDP. See the
+`webtest.export` module for details.
+
+To see how each thread's time is split between waiting for the server, client
+overhead and think time, pass a `~webtest.timeline.TraceWriter` using the
+``tracer`` keyword. The requests and sleeps of a sample of threads are written
+to a file that can be viewed as a timeline in Chrome's ``chrome://tracing``.
+
+
+Running Without Grinder
+-----------------------
+
+The ``TestRunner`` class can also be run by a `~webtest.engine.Engine`, under
+plain CPython, with each virtual user as a coroutine instead of a thread::
+
+    from webtest.engine import Engine
+    engine = Engine(TestRunner, users=500, duration=600)
+    engine.run()
+
+See the `webtest.engine` module for details.
+
 """
 
 # Everything in this script should be compatible with Jython 2.2.1.
 
 import random
+import time
 
 # Import the webtest parser
 import parser
 import macro
+import record
+import logsink
+import pretty
+import dump
+import histogram
+import clock
+import phases
+import profiler
+import saturation
+import export
+import timeline
+import extract
+import scope
+import session
+
+# Headers sent with every request
+DEFAULT_HEADERS = [
+    ('Accept-Language', 'en-us'),
+    ('User-Agent',
+     'Mozilla/4.0 (compatible; '
+     'MSIE 7.0; '
+     'Windows NT 5.1; '
+     '.NET CLR 1.1.4322; '
+     '.NET CLR 2.0.50727; '
+     '.NET CLR 3.0.4506.2152; '
+     '.NET CLR 3.5.30729)'),
+    ('Accept', '*/*'),
+]
+# Connection timeout, in milliseconds
+CONNECTION_TIMEOUT = 60000
 
 # Import the necessary Grinder stuff
 # This is wrapped with exception handling, to allow Sphinx to import this
@@ -264,31 +493,53 @@ try:
     from net.grinder.script import Test
     from net.grinder.script.Grinder import grinder
     from net.grinder.plugin.http import HTTPPluginControl, HTTPRequest
-    from HTTPClient import NVPair
+    from HTTPClient import NVPair, CookieModule
 except ImportError:
     print("Grinder module import failed.")
     print("You may need to add grinder.jar to your classpath.")
     print("Continuing blissfully onward...")
-    from stub import Test, NVPair, HTTPRequest, grinder, log
+    from stub import Test, NVPair, HTTPRequest, HTTPPluginControl, \
+                     CookieModule, grinder, log
 else:
     # Convenient access to logger
     log = grinder.logger.output
 
     # Set default headers for all connections
     connectionDefaults = HTTPPluginControl.getConnectionDefaults()
-    connectionDefaults.setTimeout(60000)
+    connectionDefaults.setTimeout(CONNECTION_TIMEOUT)
     connectionDefaults.defaultHeaders = [
-        NVPair('Accept-Language', 'en-us'),
-        NVPair('User-Agent',
-               'Mozilla/4.0 (compatible; '
-               'MSIE 7.0; '
-               'Windows NT 5.1; '
-               '.NET CLR 1.1.4322; '
-               '.NET CLR 2.0.50727; '
-               '.NET CLR 3.0.4506.2152; '
-               '.NET CLR 3.5.30729)'),
-        NVPair('Accept', '*/*'),
-    ]
+        NVPair(name, value) for name, value in DEFAULT_HEADERS]
+
+
+def _log(message, *args):
+    """Write ``message`` to the log. If any ``args`` are given, they are
+    formatted into ``message`` using ``%``; this is only done here, so callers
+    can pass format arguments instead of building the string themselves.
+
+    If a `~webtest.logsink.LogSink` is in use, the message is handed to it
+    unformatted, and is written later by its background thread.
+    """
+    sink = WebtestRunner.log_sink
+    if sink:
+        sink.write(message, args)
+    else:
+        if args:
+            message = message % args
+        log(message)
+
+
+def _log_error(message, *args):
+    """Write an error ``message`` to the log, as `_log` does. If a
+    `~webtest.logsink.LogSink` is in use, the message is written immediately,
+    with any messages already buffered by this thread, so it is never dropped.
+    """
+    sink = WebtestRunner.log_sink
+    if sink:
+        sink.write(message, args, error=True)
+    else:
+        if args:
+            message = message % args
+        log(message)
 
 
 class CaptureFailed (RuntimeError):
@@ -322,6 +573,262 @@ class TestSet:
         self.weight = kwargs.get('weight', 1.0)
 
 
+class UnrecordedTest:
+    """Stands in for a Grinder `Test`, for requests inside a transaction whose
+    own statistics are not recorded (see ``request_stats`` in
+    `get_test_runner`).
+    """
+    def __init__(self, number, description):
+        self.number = number
+        self.description = description
+
+    def getNumber(self):
+        return self.number
+
+    def getDescription(self):
+        return self.description
+
+
+def _run_transaction_requests(runner, transaction):
+    """Execute the requests in a `Transaction`. This function is wrapped by
+    the transaction's Grinder `Test`, so its execution is timed.
+    """
+    for step in transaction.requests:
+        runner._run_request(step, transaction)
+
+
+class Transaction:
+    """A named group of consecutive requests, defined by a ``TransactionTimer``
+    in a ``.webtest`` file, and timed as a single Grinder `Test`.
+    """
+    def __init__(self, name, test, requests):
+        """Create a Transaction with the given name and `Test`, containing the
+        given list of ``(test, wrapper, request)``.
+        """
+        self.name = name
+        self.test = test
+        self.requests = requests
+        # Calling this executes the requests, as the transaction's test
+        self.wrapper = test.wrap(_run_transaction_requests)
+
+
+def _recorded_think_time(step):
+    """Return the recorded pause in milliseconds after the given
+    ``(test, wrapper, request)`` or `Transaction`, or ``None`` if it is not
+    known. For a transaction, this is the pause after its last request.
+    """
+    if isinstance(step, Transaction):
+        step = step.requests[-1]
+    return step[2].think_time
+
+
+# Compiled capture regexps, as (pattern, prefix), indexed by regexp
+_capture_patterns = {}
+# Maximum number of compiled capture regexps to keep
+_MAX_CAPTURE_PATTERNS = 1000
+
+def _literal_prefix(regexp):
+    """Return the literal text that every match of ``regexp`` starts with, or
+    an empty string if it is not known.
+    """
+    # Alternations might have other prefixes, and inline flags such as (?i)
+    # apply to the whole regexp
+    if '|' in regexp or '(?' in regexp:
+        return ''
+    prefix = []
+    index = 0
+    while index < len(regexp):
+        char = regexp[index]
+        width = 1
+        if char == '\\':
+            # Escaped punctuation is literal; classes like \d are not
+            char = regexp[index + 1:index + 2]
+            if not char or char.isalnum():
+                break
+            width = 2
+        elif char in '.^$*+?{}[]()':
+            break
+        # A character followed by a quantifier might not be matched
+        following = regexp[index + width:index + width + 1]
+        if following and following in '*+?{':
+            break
+        prefix.append(char)
+        index += width
+    prefix = ''.join(prefix)
+    # Searching a byte string for a unicode prefix would decode all of it
+    try:
+        return str(prefix)
+    except UnicodeError:
+        return ''
+
+
+def _capture_pattern(regexp):
+    """Return ``(pattern, prefix)`` for the given capture regexp, where
+    ``pattern`` is the compiled regexp, and ``prefix`` is the literal text
+    that every match starts with (see `_literal_prefix`).
+    """
+    try:
+        return _capture_patterns[regexp]
+    except KeyError:
+        pass
+    # Import re here to avoid threading problems
+    # See: http://osdir.com/ml/java.grinder.user/2003-07/msg00030.html
+    import re
+    compiled = (re.compile(regexp), _literal_prefix(regexp))
+    if len(_capture_patterns) >= _MAX_CAPTURE_PATTERNS:
+        _capture_patterns.clear()
+    _capture_patterns[regexp] = compiled
+    return compiled
+
+
+class _PrefixScanner:
+    """Finds the first offset of each of several literal prefixes in a text,
+    in a single pass.
+    """
+    def __init__(self, prefixes):
+        """Create a scanner for the given list of prefixes.
+        """
+        # Import re here to avoid threading problems
+        # See: http://osdir.com/ml/java.grinder.user/2003-07/msg00030.html
+        import re
+        self.prefixes = []
+        for prefix in prefixes:
+            if prefix not in self.prefixes:
+                self.prefixes.append(prefix)
+        alternatives = []
+        for prefix in self.prefixes:
+            alternatives.append(re.escape(prefix))
+        self.pattern = re.compile('|'.join(alternatives))
+
+
+    def scan(self, text):
+        """Return a dict of the first offset of each prefix in ``text``, or
+        -1 if it is not found, indexed by prefix.
+        """
+        offsets = {}
+        remaining = len(self.prefixes)
+        start = 0
+        while remaining:
+            match = self.pattern.search(text, start)
+            if match is None:
+                break
+            first, start = match.span()
+            # The search resumes after this match, so check for any prefixes
+            # starting inside it (including the one matched)
+            for prefix in self.prefixes:
+                if prefix not in offsets:
+                    offset = text.find(prefix, first, start + len(prefix) - 1)
+                    if offset >= 0:
+                        offsets[prefix] = offset
+                        remaining -= 1
+        for prefix in self.prefixes:
+            if prefix not in offsets:
+                offsets[prefix] = -1
+        return offsets
+
+
+def _search(regexp, text, offsets=None):
+    """Return the first match of ``regexp`` in ``text``, or ``None``. If every
+    match must start with some literal text, the regexp is only tried from
+    its first occurrence, taken from the ``offsets`` found by a
+    `_PrefixScanner`, or else found with ``str.find``.
+    """
+    pattern, prefix = _capture_pattern(regexp)
+    start = 0
+    if prefix:
+        if offsets is not None and prefix in offsets:
+            start = offsets[prefix]
+        else:
+            start = text.find(prefix)
+        if start < 0:
+            return None
+    return pattern.search(text, start)
+
+
+def _capture_where(source, header):
+    """Return where a capture from the given ``source`` (and ``header``)
+    looks, for log messages. Only called when there is something to log, so
+    no strings are built for captures at ``quiet`` verbosity.
+    """
+    if source == 'header':
+        return "%s header" % header
+    if source == 'status':
+        return "status"
+    return "response"
+
+
+def _capture_specs(request):
+    """Return a list of ``(name, source, header, regexp)`` for the capture
+    expressions in the given `~webtest.parser.Request`, where ``source`` is
+    ``'body'``, ``'header'``, ``'status'``, ``'json'`` or ``'xpath'``, and
+    ``header`` is the name of the header to search (or ``None``). For
+    ``'json'`` and ``'xpath'``, ``regexp`` is the path expression. The list is
+    cached on the request. Raise a ``SyntaxError`` if any expression is
+    malformed.
+    """
+    if request.capture_specs is not None:
+        return request.capture_specs
+    # Import re here to avoid threading problems
+    # See: http://osdir.com/ml/java.grinder.user/2003-07/msg00030.html
+    import re
+    # Match a {VAR_NAME = <regular expression>}
+    re_capture = re.compile('^{([_A-Z0-9]+) ?= ?(.+)}$')
+    # Match a header:Header-Name <regular expression>
+    re_header = re.compile(r'^header:([^\s:]+)\s*(.*)$', re.DOTALL)
+    # Match a status: <regular expression>
+    re_status = re.compile(r'^status:\s*(.*)$', re.DOTALL)
+    # Match a json: or xpath: <path expression>
+    re_path = re.compile(r'^(json|xpath):\s*(.*)$', re.DOTALL)
+    specs = []
+    # Literal prefixes of body captures without {...} expressions
+    prefixes = []
+    for expression in request.captures():
+        # Error if this expression doesn't look like a capture
+        match = re_capture.search(expression)
+        if not match:
+            message = "Syntax error in capture expression '%s'" % expression
+            message += " in request defined on line %d" % request.line_number
+            raise SyntaxError(message)
+        # Get the two parts of the capture expression
+        name, value = match.groups()
+        header = None
+        if re_header.match(value):
+            header, value = re_header.match(value).groups()
+            source = 'header'
+        elif re_status.match(value):
+            value = re_status.match(value).groups()[0]
+            source = 'status'
+        elif re_path.match(value):
+            source, value = re_path.match(value).groups()
+        else:
+            source = 'body'
+        # With no regexp, capture the whole header or status
+        if not value and source in ('header', 'status'):
+            value = '.*'
+        # Compile regexps without {...} expressions now, rather than for
+        # every response
+        if source not in ('json', 'xpath') and '{' not in value:
+            pattern, prefix = _capture_pattern(value)
+            if source == 'body' and prefix:
+                prefixes.append(prefix)
+        specs.append((name, source, header, value))
+    # Find the prefixes of several body captures in one pass over the body
+    if len(prefixes) > 1:
+        request.capture_scanner = _PrefixScanner(prefixes)
+    request.capture_specs = specs
+    return specs
+
+
+def _captures_body(request):
+    """Return True if any capture expression in the given
+    `~webtest.parser.Request` searches the response body.
+    """
+    for name, source, header, regexp in _capture_specs(request):
+        if source not in ('header', 'status'):
+            return True
+    return False
+
+
 def get_test_runner(test_sets,
                     variables={},
                     before_set=None,
@@ -330,16 +837,33 @@ def get_test_runner(test_sets,
                     think_time=500,
                     scenario_think_time=500,
                     verbosity='quiet',
-                    macro_class=None):
+                    macro_class=None,
+                    recorder=None,
+                    log_sink=None,
+                    debug_body_limit=pretty.DEFAULT_LIMIT,
+                    failure_dumper=None,
+                    histograms=None,
+                    pacing=None,
+                    phase_timer=None,
+                    profile=None,
+                    saturation_monitor=None,
+                    exporter=None,
+                    tracer=None,
+                    request_stats=True,
+                    discard_bodies=False,
+                    session_pool=None,
+                    variable_scope='runner',
+                    replay_speed=None):
     """Return a `TestRunner` base class that runs ``.webtest`` files in the
     given list of `TestSet`\s. This is the primary wrapper for executing your
     tests.
 
         ``variables``
-            Default variables for all `TestRunner` instances. Each
-            `TestRunner` instance will get their own copy of these, but
-            passing them here lets you define defaults for commonly-used
-            variables like server name, username, or password.
+            Default variables for all `TestRunner` instances. They are shared,
+            not copied; variables set by a `TestRunner` instance override
+            them for that instance only. Passing them here lets you define
+            defaults for commonly-used variables like server name, username,
+            or password.
 
         ``test_sets``
             A list of TestSets, where each `TestSet` contains one or more
@@ -379,6 +903,12 @@ def get_test_runner(test_sets,
         ``scenario_think_time``
             Time in milliseconds to sleep between each scenario.
 
+        ``replay_speed``
+            If given, sleep after each request (or transaction) for its
+            recorded pause divided by this factor, instead of ``think_time``.
+            Requests without a recorded pause still use ``think_time``. See
+            `webtest.parser` for how pauses are recorded.
+
         ``verbosity``
             How chatty to be when logging. May be:
 
@@ -398,6 +928,90 @@ def get_test_runner(test_sets,
             class if you want to define your own macros. See `webtest.macro`
             for how to define your own macros.
 
+        ``recorder``
+            A `webtest.record.Recorder` used to record the responses received
+            in a sample of iterations. If ``None``, nothing is recorded.
+
+        ``log_sink``
+            A `webtest.logsink.LogSink` used to write log output from a
+            background thread. If ``None``, log output is written directly
+            by each worker thread.
+
+        ``debug_body_limit``
+            Maximum number of characters of each response body to log at
+            ``debug`` verbosity. XML and JSON bodies are pretty-printed; the
+            limit applies to the pretty-printed output. Use ``None`` for no
+            limit.
+
+        ``failure_dumper``
+            A `webtest.dump.FailureDumper` used to save the response body
+            when a capture fails. If ``None``, the response body is written
+            to the log.
+
+        ``histograms``
+            A `webtest.histogram.HistogramRecorder` used to record the time
+            taken by each request, in microseconds. If ``None``, only Grinder's
+            own statistics are kept.
+
+        ``pacing``
+            Time in milliseconds between the scheduled start of each request
+            in a thread. If given, this replaces ``think_time``, and response
+            times corrected for coordinated omission are recorded in
+            ``histograms``.
+
+        ``phase_timer``
+            A `webtest.phases.PhaseTimer` used to measure the time spent in
+            each phase of executing a request, including load-generator
+            overhead such as evaluating expressions and captures. A table of
+            the results is logged at the end of the run.
+
+        ``profile``
+            A `webtest.profiler.Profiler` used to run a sample of iterations
+            under a profiler, and write the time spent in each call stack to
+            a flame graph file.
+
+        ``saturation_monitor``
+            A `webtest.saturation.SaturationMonitor` used to measure how late
+            worker threads wake up from their sleeps, and report whether the
+            load generator was overloaded.
+
+        ``exporter``
+            A `webtest.export.MetricsExporter` used to send live per-test
+            metrics to a statsd or InfluxDB server over UDP.
+
+        ``tracer``
+            A `webtest.timeline.TraceWriter` used to write a timeline of the
+            requests and sleeps of a sample of worker threads.
+
+        ``request_stats``
+            If False, requests inside a ``TransactionTimer`` are not recorded
+            as Grinder tests of their own; only the transaction is.
+
+        ``discard_bodies``
+            If True, the response bodies of requests with no ``Capture`` of
+            the body are read and discarded, without being kept or decoded.
+            Bodies are always kept at ``debug`` verbosity, or when there is a
+            ``recorder``, since those need them.
+
+        ``session_pool``
+            A `webtest.session.SessionPool` of sessions created by running the
+            ``before_set``, to be checked out by each iteration. If ``None``,
+            each `WebtestRunner` runs the ``before_set`` once, when created.
+
+        ``variable_scope``
+            How long variables set or captured by a `TestRunner` last.
+            Allowed values:
+
+            'runner'
+                For the life of the `TestRunner` (the thread).
+            'iteration'
+                Until the end of the iteration in which they were set.
+            'test_set'
+                Until the end of the `TestSet` in which they were set.
+
+            Variables set by the ``before_set`` always last for the life of
+            the `TestRunner`. See `webtest.scope` for details.
+
     """
     kwargs = {
         'before_set': before_set,
@@ -407,6 +1021,22 @@ def get_test_runner(test_sets,
         'scenario_think_time': scenario_think_time,
         'verbosity': verbosity,
         'macro_class': macro_class,
+        'recorder': recorder,
+        'log_sink': log_sink,
+        'debug_body_limit': debug_body_limit,
+        'failure_dumper': failure_dumper,
+        'histograms': histograms,
+        'pacing': pacing,
+        'phase_timer': phase_timer,
+        'profile': profile,
+        'saturation_monitor': saturation_monitor,
+        'exporter': exporter,
+        'tracer': tracer,
+        'request_stats': request_stats,
+        'discard_bodies': discard_bodies,
+        'session_pool': session_pool,
+        'variable_scope': variable_scope,
+        'replay_speed': replay_speed,
     }
     WebtestRunner.set_class_attributes(test_sets, **kwargs)
 
@@ -414,11 +1044,14 @@ def get_test_runner(test_sets,
     # instantiation of the class until the Grinder threads run, while still
     # populate the instance with the given variables in the __init__ method.
     class TestRunner (WebtestRunner):
+        # Default variables, for runners created without __init__
+        default_variables = variables
+
         def __init__(self):
             """Create a TestRunner instance initialized with the given
             variables.
             """
-            WebtestRunner.__init__(self, **variables)
+            WebtestRunner.__init__(self)
 
     # Return the class (NOT an instance!)
     return TestRunner
@@ -448,19 +1081,68 @@ class WebtestRunner:
     sequence = 'sequential'
     # Dict of lists of requests, indexed by .webtest filename
     webtest_requests = {}
+    # Dict of lists of steps to execute (requests, or Transactions),
+    # indexed by .webtest filename
+    webtest_steps = {}
+    # Whether requests inside transactions are recorded as tests
+    request_stats = True
+    # Whether response bodies of requests without captures are discarded
+    discard_bodies = False
+    # SessionPool of sessions created by the before_set, if any
+    session_pool = None
+    # Default variables, shared by all instances
+    default_variables = {}
+    # How long variables set by each instance last: 'runner', 'iteration'
+    # or 'test_set'
+    variable_scope = 'runner'
     # Time to sleep between requests
     think_time = 500
     # Verbosity of logging
     verbosity = 'quiet'
+    # Which kinds of log output are enabled, according to verbosity;
+    # these are checked in place of verbosity on the request path
+    log_tests = True
+    log_info = False
+    log_debug = False
+    # Recorder for sampled responses, if any
+    recorder = None
+    # LogSink for background logging, if any
+    log_sink = None
+    # Maximum number of response body characters to log in debug mode
+    debug_body_limit = pretty.DEFAULT_LIMIT
+    # FailureDumper for saving response bodies of failed captures, if any
+    failure_dumper = None
+    # HistogramRecorder for request latencies, if any
+    histograms = None
+    # Time in milliseconds between scheduled request starts, if any
+    pacing = None
+    # Factor to divide recorded pauses between requests by, if replaying them
+    replay_speed = None
+    # PhaseTimer for measuring time spent in execute(), if any
+    phase_timer = None
+    # Profiler for a sample of iterations, if any
+    profile = None
+    # SaturationMonitor for measuring sleep lag, if any
+    saturation_monitor = None
+    # MetricsExporter for live metrics, if any
+    exporter = None
+    # TraceWriter for request timelines, if any
+    tracer = None
 
     # Sequential test numbers, so each request gets a unique number
     # Each webtest's requests will be numbered sequentially starting with
     # this number; the next webtest will start at test_number + test_number_skip
     test_number = 1000
     # How much to increment the test_number for each test
-    # (this is the maximum number of requests that may be in a single webtest)
+    # (this is the maximum number of requests and transactions that may be in
+    # a single webtest)
     test_number_skip = 1000
 
+    # Log lines announcing each test and .webtest file, built once at load
+    # time; indexed by test number and .webtest filename, respectively
+    test_headings = {}
+    file_headings = {}
+
 
     def _add_webtest_file(cls, filename):
         """Add all requests in the given ``.webtest`` filename to the class.
@@ -472,11 +1154,49 @@ class WebtestRunner:
         test_requests = []
         for index, request in enumerate(webtest.requests):
             # First request is test_number+1, then test_number+2 etc.
-            test = Test(cls.test_number + index + 1, str(request))
-            wrapper = test.wrap(HTTPRequest())
+            number = cls.test_number + index + 1
+            summary = str(request)
+            http_request = HTTPRequest()
+            # Don't read bodies that nothing will look at
+            if cls.discard_bodies and not _captures_body(request):
+                http_request.setReadResponseBody(False)
+            # Requests in transactions may go unrecorded
+            if request.transaction and not cls.request_stats:
+                test = UnrecordedTest(number, summary)
+                wrapper = http_request
+            else:
+                test = Test(number, summary)
+                wrapper = test.wrap(http_request)
             test_requests.append((test, wrapper, request))
-        # Add the (test, request) list to class for this filename
+            cls.test_headings[number] = "------ Test %d: %s" % (number, summary)
+
+        # Group consecutive requests in the same transaction; transactions
+        # are numbered after the last request
+        steps = []
+        number = cls.test_number + len(test_requests)
+        for step in test_requests:
+            name = step[2].transaction
+            if not name:
+                steps.append(step)
+            elif steps and isinstance(steps[-1], Transaction) and \
+                 steps[-1].name == name:
+                steps[-1].requests.append(step)
+            else:
+                number += 1
+                steps.append(Transaction(name, Test(number, name), [step]))
+                cls.test_headings[number] = "------ Transaction %d: %s" % \
+                                            (number, name)
+
+        # Test numbers must not run into those of the next webtest
+        if number - cls.test_number > cls.test_number_skip:
+            raise ValueError("%s has %d requests and transactions, more than "
+                             "test_number_skip (%d)" %
+                             (filename, number - cls.test_number,
+                              cls.test_number_skip))
+        # Add the (test, request) list and steps to class for this filename
         cls.webtest_requests[filename] = test_requests
+        cls.webtest_steps[filename] = steps
+        cls.file_headings[filename] = "==== Executing: %s ==========" % filename
         # Skip ahead to the next test_number
         cls.test_number += cls.test_number_skip
 
@@ -492,7 +1212,23 @@ class WebtestRunner:
                              think_time=500,
                              scenario_think_time=500,
                              verbosity='quiet',
-                             macro_class=None):
+                             macro_class=None,
+                             recorder=None,
+                             log_sink=None,
+                             debug_body_limit=pretty.DEFAULT_LIMIT,
+                             failure_dumper=None,
+                             histograms=None,
+                             pacing=None,
+                             phase_timer=None,
+                             profile=None,
+                             saturation_monitor=None,
+                             exporter=None,
+                             tracer=None,
+                             request_stats=True,
+                             discard_bodies=False,
+                             session_pool=None,
+                             variable_scope='runner',
+                             replay_speed=None):
         """Set attributes that affect all `WebtestRunner` instances.
 
         See `get_test_runner` for what the parameters mean.
@@ -514,6 +1250,9 @@ class WebtestRunner:
         # Ensure that sequence matches allowed values
         if sequence not in ('sequential', 'random', 'weighted', 'thread'):
             raise ValueError("sequence must be 'sequential', 'random', 'weighted', or 'thread'.")
+        # Ensure that variable_scope matches allowed values
+        if variable_scope not in ('runner', 'iteration', 'test_set'):
+            raise ValueError("variable_scope must be 'runner', 'iteration', or 'test_set'.")
         # Ensure that verbosity is valid
         if verbosity not in ('debug', 'info', 'quiet', 'error'):
             raise ValueError("verbosity must be 'debug', 'info', 'quiet', or 'error'.")
@@ -522,16 +1261,83 @@ class WebtestRunner:
             if not (type(macro_class) == type(macro.Macro) and \
                     issubclass(macro_class, macro.Macro)):
                 raise ValueError("macro_class must be a subclass of webtest.macro.Macro")
+        # If recorder is provided, ensure that it's a record.Recorder
+        if recorder and not isinstance(recorder, record.Recorder):
+            raise ValueError("recorder must be a webtest.record.Recorder")
+        # If log_sink is provided, ensure that it's a logsink.LogSink
+        if log_sink and not isinstance(log_sink, logsink.LogSink):
+            raise ValueError("log_sink must be a webtest.logsink.LogSink")
+        # If failure_dumper is provided, ensure that it's a dump.FailureDumper
+        if failure_dumper and not isinstance(failure_dumper, dump.FailureDumper):
+            raise ValueError("failure_dumper must be a webtest.dump.FailureDumper")
+        # If histograms is provided, ensure that it's a HistogramRecorder
+        if histograms and not isinstance(histograms, histogram.HistogramRecorder):
+            raise ValueError("histograms must be a webtest.histogram.HistogramRecorder")
+        # If pacing is provided, ensure that it's a positive number
+        if pacing is not None and not pacing > 0:
+            raise ValueError("pacing must be a positive number of milliseconds.")
+        if replay_speed is not None and not replay_speed > 0:
+            raise ValueError("replay_speed must be a positive number.")
+        # If phase_timer is provided, ensure that it's a phases.PhaseTimer
+        if phase_timer and not isinstance(phase_timer, phases.PhaseTimer):
+            raise ValueError("phase_timer must be a webtest.phases.PhaseTimer")
+        # If profile is provided, ensure that it's a profiler.Profiler
+        if profile and not isinstance(profile, profiler.Profiler):
+            raise ValueError("profile must be a webtest.profiler.Profiler")
+        # If saturation_monitor is provided, ensure that it's a SaturationMonitor
+        if saturation_monitor and \
+           not isinstance(saturation_monitor, saturation.SaturationMonitor):
+            raise ValueError("saturation_monitor must be a webtest.saturation.SaturationMonitor")
+        # If exporter is provided, ensure that it's an export.MetricsExporter
+        if exporter and not isinstance(exporter, export.MetricsExporter):
+            raise ValueError("exporter must be a webtest.export.MetricsExporter")
+        # If tracer is provided, ensure that it's a timeline.TraceWriter
+        if tracer and not isinstance(tracer, timeline.TraceWriter):
+            raise ValueError("tracer must be a webtest.timeline.TraceWriter")
+        # If session_pool is provided, ensure that it's a session.SessionPool,
+        # and that there is a before_set to create sessions with
+        if session_pool:
+            if not isinstance(session_pool, session.SessionPool):
+                raise ValueError("session_pool must be a webtest.session.SessionPool")
+            if not before_set:
+                raise ValueError("session_pool needs a before_set to log in with.")
 
         # Initialize all class variables
         cls.test_sets = test_sets
         cls.before_set = before_set
         cls.after_set = after_set
         cls.sequence = sequence
+        cls.variable_scope = variable_scope
         cls.think_time = think_time
         cls.scenario_think_time = scenario_think_time
         cls.verbosity = verbosity
+        cls.log_tests = verbosity != 'error'
+        cls.log_info = verbosity in ('debug', 'info')
+        cls.log_debug = verbosity == 'debug'
         cls.macro_class = macro_class or macro.Macro
+        cls.recorder = recorder
+        cls.log_sink = log_sink
+        cls.debug_body_limit = debug_body_limit
+        cls.failure_dumper = failure_dumper
+        cls.histograms = histograms
+        cls.pacing = pacing
+        cls.replay_speed = replay_speed
+        cls.phase_timer = phase_timer
+        cls.profile = profile
+        cls.saturation_monitor = saturation_monitor
+        cls.exporter = exporter
+        cls.tracer = tracer
+        cls.request_stats = request_stats
+        cls.session_pool = session_pool
+        # Logging and recording responses need their bodies
+        cls.discard_bodies = discard_bodies and verbosity != 'debug' and \
+                             not recorder
+        if saturation_monitor and saturation_monitor.output is None:
+            saturation_monitor.output = log
+        if phase_timer and phase_timer.output is None:
+            phase_timer.output = log
+        if log_sink and log_sink.output is None:
+            log_sink.output = log
 
         # Add all webtest filenames in all test sets
         for test_set in cls.test_sets:
@@ -563,23 +1369,58 @@ class WebtestRunner:
     def __init__(self, **variables):
         """Create a WebtestRunner instance, and run tests in the before_set.
         """
-        # Dictionary of instance variables, indexed by name
-        self.variables = variables
+        # Scope of instance variables, indexed by name
+        self.variables = scope.Scope(self.default_variables, variables)
+        # Whether responses in the current iteration are being recorded
+        self.recording = False
+        # When pacing, the time (in nanoseconds) when the next request is
+        # scheduled to start
+        self.next_start = None
+        # Timeline track for tracer spans, or None for the current thread
+        self.trace_track = None
 
         # Delay reporting, to allow potential errors to be reported
         grinder.statistics.delayReports = True
 
-        # Run tests in the before_set
-        if self.before_set:
+        # Run tests in the before_set, unless sessions come from a pool
+        if self.before_set and not WebtestRunner.session_pool:
             self.run_test_set(WebtestRunner.before_set)
 
 
     def __del__(self):
         """Destructor--run tests in the after_set.
         """
-        # Run tests in the after_set
-        if self.after_set:
+        # Run tests in the after_set, unless sessions come from a pool
+        if self.after_set and not WebtestRunner.session_pool:
             self.run_test_set(WebtestRunner.after_set)
+        self._finish()
+
+
+    def _finish(self):
+        """Write out or report the results kept by any recorders, timers and
+        other helpers, when a worker thread has finished.
+        """
+        # Write out any recorded responses
+        if WebtestRunner.recorder:
+            WebtestRunner.recorder.flush()
+        # Report time spent in each phase, once all threads are done
+        if WebtestRunner.phase_timer:
+            WebtestRunner.phase_timer.thread_finished()
+        # Report sleep lag, once all threads are done
+        if WebtestRunner.saturation_monitor:
+            WebtestRunner.saturation_monitor.thread_finished()
+        # Write out any buffered trace events
+        if WebtestRunner.tracer:
+            WebtestRunner.tracer.flush()
+        # Write out profiled call stacks, once all threads are done
+        if WebtestRunner.profile:
+            WebtestRunner.profile.thread_finished()
+        # Write out latency histograms, once all threads are done
+        if WebtestRunner.histograms:
+            WebtestRunner.histograms.thread_finished()
+        # Write out any buffered log messages
+        if WebtestRunner.log_sink:
+            WebtestRunner.log_sink.flush()
 
 
     def eval_expressions(self, value):
@@ -636,6 +1477,7 @@ class WebtestRunner:
         re_var = re.compile('^([_A-Z0-9]+)$')
 
         macro = WebtestRunner.macro_class()
+        macro.runner = self
 
         # Match and replace until no {...} expressions are found
         to_expand = re_expansion.match(value)
@@ -671,8 +1513,8 @@ class WebtestRunner:
                 raise SyntaxError(
                   "Syntax error '%s' in value '%s'" % (expression, value))
 
-            if WebtestRunner.verbosity in ('debug', 'info'):
-                log("%s => '%s'" % (expression, expanded))
+            if WebtestRunner.log_info:
+                _log("%s => '%s'", expression, expanded)
 
             # Assemble the expanded value and check for another match
             value = before + expanded + after
@@ -746,63 +1588,137 @@ class WebtestRunner:
             {ORDER_DIV = <div id="12345">(.*)</div>}
 
         before matching in the response body.
+
+        Regexps with no ``{VAR_NAME}`` references are compiled only once. Most
+        of them start with some literal text, like ``<SID>`` above; the body
+        is scanned for the literal text of all such captures in a single pass,
+        and each regexp is only tried from where its text first appears. With
+        many captures on a large response, this is much faster than searching
+        the whole body for each regexp in turn.
+
+        To search a response header instead of the body, start the regexp with
+        ``header:`` and the header name; to search the numeric status code,
+        start it with ``status:``::
+
+            {LOCATION = header:Location (.*)}
+            {SESSION = header:Set-Cookie JSESSIONID=([^;]+)}
+            {STATUS = status:}
+
+        Leaving out the regexp captures the whole header or status. Header and
+        status captures never need the response body, so a request with only
+        these captures can still have its body discarded (see
+        ``discard_bodies`` in `get_test_runner`). If the header is missing,
+        the capture fails.
+
+        For large JSON or XML responses, a ``json:`` or ``xpath:`` path can be
+        given instead of a regexp. The value at that path is captured, reading
+        the body only as far as needed to find it (see `webtest.extract` for
+        the paths understood)::
+
+            {ORDER_ID = json:$.orders[0].id}
+            {TOTAL = xpath://Invoice/Total}
+            {NEXT_PAGE = xpath:/feed/link[2]/@href}
+
+        The capture fails if nothing is found at the path, or if the response
+        is not well-formed JSON or XML.
         """
         # Number of successful captures
         captured = 0
 
         # If capture expression is empty, there's nothing to do
-        if not request.captures():
+        if not request.capture:
             return captured
 
-        # Import re here to avoid threading problems
-        # See: http://osdir.com/ml/java.grinder.user/2003-07/msg00030.html
-        import re
-
-        # Match a {VAR_NAME = <regular expression>}
-        re_capture = re.compile('^{([_A-Z0-9]+) ?= ?(.+)}$')
-
-        # Get response body
-        body = str(response.getText())
+        # Response body, decoded only if a capture needs it
+        body = None
+        # Offsets of the literal prefixes of body captures in the body
+        offsets = None
         # Evaluate each {...} expression found in the list of request.captures()
-        for expression in request.captures():
-            # Error if this expression doesn't look like a capture
-            match = re_capture.search(expression)
-            if not match:
-                message = "Syntax error in capture expression '%s'" % expression
-                message += " in request defined on line %d" % request.line_number
-                raise SyntaxError(message)
-
-            # Get the two parts of the capture expression
-            name, value = match.groups()
+        for name, source, header, value in _capture_specs(request):
             # Expand any {VAR} expressions before evaluating the regexp
-            regexp = self.eval_expressions(value)
-
-            if WebtestRunner.verbosity in ('debug', 'info'):
-                log("Looking in response for match to regexp: %s" % regexp)
-
-            # Error if the regexp doesn't match part of the response body
-            match = re.search(regexp, body)
-            if not match:
-                log("!!!!!! No match for %s" % regexp)
-                log("!!!!!! In request defined on line %d" % request.line_number)
-                log("!!!!!! Response body:")
-                log(body)
+            if '{' in value:
+                regexp = self.eval_expressions(value)
+            else:
+                regexp = value
+
+            # Get the text to search
+            if source in ('header', 'status'):
+                if source == 'header':
+                    text = response.getHeader(header)
+                else:
+                    text = str(response.getStatusCode())
+            else:
+                if body is None:
+                    body = str(response.getText())
+                    if request.capture_scanner is not None:
+                        offsets = request.capture_scanner.scan(body)
+                text = body
+
+            if WebtestRunner.log_info:
+                if source in ('json', 'xpath'):
+                    _log("Looking in response for %s path: %s", source, regexp)
+                else:
+                    _log("Looking in %s for match to regexp: %s",
+                         _capture_where(source, header), regexp)
+
+            # Error if the path or regexp doesn't match part of the text
+            match = None
+            if source in ('json', 'xpath'):
+                try:
+                    if source == 'json':
+                        match = extract.json_path(text, regexp)
+                    else:
+                        match = extract.xpath(text, regexp)
+                except ValueError, e:
+                    _log_error("!!!!!! %s", e)
+            elif source == 'body':
+                match = _search(regexp, text, offsets)
+            elif text is not None:
+                match = _search(regexp, text)
+            if match is None:
+                _log_error("!!!!!! No match for %s", regexp)
+                _log_error("!!!!!! In request defined on line %d", request.line_number)
+                if source in ('header', 'status'):
+                    _log_error("!!!!!! Value of %s: %s",
+                               _capture_where(source, header), text)
+                # Save the body separately, or write it to the log
+                elif WebtestRunner.failure_dumper:
+                    _log_error("!!!!!! %s", WebtestRunner.failure_dumper.dump(body,
+                        "No match for %s\nIn request defined on line %d of %s" %
+                        (regexp, request.line_number, request)))
+                else:
+                    _log_error("!!!!!! Response body:")
+                    _log_error(body)
                 raise CaptureFailed("No match for %s" % regexp)
 
+            # Paths give the value to capture directly
+            if source in ('json', 'xpath'):
+                value = match
             # Set the given variable name to the first parenthesized expression
-            if match.groups():
+            elif match.groups():
                 value = match.group(1)
             # or the entire match if there was no parenthesized expression
             else:
                 value = match.group(0)
             captured += 1
-            if WebtestRunner.verbosity in ('debug', 'info'):
-                log("Captured %s = %s" % (name, value))
+            if WebtestRunner.log_info:
+                _log("Captured %s = %s", name, value)
             self.variables[name] = value
 
         return captured
 
 
+    def evaluated_pairs(self, pairs):
+        """Given some (name, value) pairs, return a list of (name, value)
+        pairs, with the ``value`` part of each pair being run through
+        `eval_expressions`.
+        """
+        result = []
+        for name, value in pairs:
+            result.append((name, self.eval_expressions(value)))
+        return result
+
+
     def evaluated_nvpairs(self, pairs):
         """Given some (name, value) pairs, construct an ``NVPair`` list, with
         the ``value`` part of each pair being run through `eval_expressions`.
@@ -819,22 +1735,50 @@ class WebtestRunner:
         """Execute a Grinder `Test` instance, wrapped in ``wrapper``, that
         sends a `~webtest.parser.Request`.
         """
-        if WebtestRunner.verbosity != 'error':
-            log("------ Test %d: %s" % (test.getNumber(), request))
+        # Start of this request's span, if tracing this thread
+        tracing = WebtestRunner.tracer and WebtestRunner.tracer.sampled()
+        if tracing:
+            traced = clock.nanotime()
+
+        # Per-phase counters for this test, if timing phases
+        counters = None
+        if WebtestRunner.phase_timer:
+            counters = WebtestRunner.phase_timer.counters(test.getNumber())
+            counters[phases.COUNT] += 1
+            mark = clock.nanotime()
+
+        if WebtestRunner.log_tests:
+            try:
+                _log(WebtestRunner.test_headings[test.getNumber()])
+            except KeyError:
+                _log("------ Test %d: %s", test.getNumber(), request)
+            if counters:
+                mark = phases.lap(counters, phases.LOGGING, mark)
 
-        # Evaluate any expressions in the request URL
+        # Evaluate any expressions in the request URL, and body
         url = self.eval_expressions(request.url)
+        if request.method == 'POST' and request.body:
+            body = self.eval_expressions(request.body)
+        if counters:
+            mark = phases.lap(counters, phases.EXPRESSIONS, mark)
 
         # Evaluate expressions in parameters and headers, and
         # convert them to NVPairs
         parameters = self.evaluated_nvpairs(request.parameters)
         headers = self.evaluated_nvpairs(request.headers)
+        if counters:
+            mark = phases.lap(counters, phases.NVPAIRS, mark)
+
+        # Time the request, if anything needs to know how long it took
+        timed = self.recording or WebtestRunner.histograms or \
+                WebtestRunner.pacing or WebtestRunner.exporter or tracing
+        if timed:
+            start = clock.nanotime()
 
         # Send a POST or GET to the wrapped HTTPRequest
         if request.method == 'POST':
             # If the request has a body, use that
             if request.body:
-                body = self.eval_expressions(request.body)
                 response = wrapper.POST(url, body, headers)
             # Otherwise, pass the form parameters
             else:
@@ -848,75 +1792,236 @@ class WebtestRunner:
             message += " in request defined on line %d" % request.line_number
             raise BadRequestMethod(message)
 
-        if WebtestRunner.verbosity == 'debug':
-            log("------ Response from %s: ------" % request)
+        if counters:
+            mark = phases.lap(counters, phases.HTTP, mark)
+
+        if timed:
+            self._record_timing(test, response, start, clock.nanotime(),
+                                tracing)
+            if counters:
+                mark = phases.lap(counters, phases.BOOKKEEPING, mark)
+
+        if WebtestRunner.log_debug:
+            _log("------ Response from %s: ------", test.getDescription())
             self.log_response(response)
+            if counters:
+                mark = phases.lap(counters, phases.LOGGING, mark)
 
         # If request has a 'Capture' attribute, parse it
         if request.capture:
             self.eval_capture(request, response)
+            if counters:
+                mark = phases.lap(counters, phases.CAPTURE, mark)
+
+        if tracing:
+            WebtestRunner.tracer.span(test.getDescription(), 'request', traced,
+                clock.nanotime(), {'test': test.getNumber()})
 
         return response
 
 
+    def _record_timing(self, test, response, start, end, tracing=False):
+        """Pass the time taken by a request, from ``start`` to ``end`` (in
+        nanoseconds), to the histograms, pacing schedule, exporter, tracer and
+        recorder, whichever are in use.
+        """
+        elapsed = end - start
+        if WebtestRunner.histograms:
+            WebtestRunner.histograms.record(test.getNumber(), elapsed // 1000)
+        if WebtestRunner.pacing:
+            self._schedule(test, start, end)
+        if WebtestRunner.exporter:
+            WebtestRunner.exporter.record(test.getNumber(), elapsed // 1000,
+                                          response)
+        if tracing:
+            WebtestRunner.tracer.span('http', 'http', start, end,
+                                      track=self.trace_track)
+        if self.recording:
+            WebtestRunner.recorder.record(test.getNumber(),
+                self.thread_number(), time.time() - elapsed / 1e9,
+                elapsed / 1e9, response)
+
+
+    def _schedule(self, test, start, end):
+        """Record the response time of a request that started at ``start`` and
+        ended at ``end`` (in nanoseconds), measured from its scheduled start,
+        and schedule the next request.
+        """
+        interval = long(WebtestRunner.pacing * 1000000)
+        intended = self.next_start
+        if intended is None or intended > start:
+            intended = start
+        if WebtestRunner.histograms:
+            WebtestRunner.histograms.record(test.getNumber(),
+                (end - intended) // 1000, 'response', interval // 1000)
+        # Skip any start times that have already passed; the requests that
+        # would have been sent then were back-filled above
+        self.next_start = intended + interval
+        if self.next_start < end:
+            self.next_start += ((end - self.next_start) // interval + 1) * interval
+
+
+    def _sleep(self, milliseconds, exact=False):
+        """Sleep for the given number of milliseconds; randomly varied by
+        Grinder, unless ``exact`` is True. If there is a saturation monitor,
+        record how long the sleep actually took, and if this thread is being
+        traced, add a span for it.
+        """
+        monitor = WebtestRunner.saturation_monitor
+        tracing = WebtestRunner.tracer and WebtestRunner.tracer.sampled()
+        # Vary the sleep time here, so the monitor knows what it should be
+        if monitor and not exact:
+            milliseconds = monitor.vary(milliseconds)
+            exact = True
+        if monitor or tracing:
+            start = clock.nanotime()
+        if exact:
+            grinder.sleep(milliseconds, 0)
+        else:
+            grinder.sleep(milliseconds)
+        if monitor or tracing:
+            end = clock.nanotime()
+            if monitor:
+                monitor.record_sleep(milliseconds, end - start)
+            if tracing:
+                WebtestRunner.tracer.span('sleep', 'sleep', start, end)
+
+
+    def _think_time(self, step=None):
+        """Return ``(milliseconds, exact)`` for the sleep after the given
+        step; either ``think_time``, to be randomly varied, or, when pacing,
+        the exact time until the next request is scheduled to start, or, when
+        replaying, the step's recorded pause divided by ``replay_speed``.
+        """
+        if WebtestRunner.pacing and self.next_start is not None:
+            return (self.next_start - clock.nanotime()) // 1000000, True
+        if WebtestRunner.replay_speed and step is not None:
+            recorded = _recorded_think_time(step)
+            if recorded is not None:
+                return long(recorded / WebtestRunner.replay_speed), True
+        return WebtestRunner.think_time, False
+
+
+    def _scenario_think_time(self):
+        """Return ``(milliseconds, exact)`` for the sleep between scenarios;
+        ``scenario_think_time``, to be randomly varied. When pacing, the next
+        request's scheduled start is delayed by the same amount, and the exact
+        time until then is returned.
+        """
+        if WebtestRunner.pacing and self.next_start is not None:
+            self.next_start += long(WebtestRunner.scenario_think_time * 1000000)
+            return (self.next_start - clock.nanotime()) // 1000000, True
+        return WebtestRunner.scenario_think_time, False
+
+
+    def _think(self, step=None):
+        """Sleep after the given step; either for ``think_time``, or, when
+        pacing, until the next request is scheduled to start, or, when
+        replaying, for the step's recorded pause.
+        """
+        milliseconds, exact = self._think_time(step)
+        if milliseconds > 0 or not exact:
+            self._sleep(milliseconds, exact)
+
+
+    def _scenario_think(self):
+        """Sleep between scenarios for ``scenario_think_time``. When pacing,
+        the next request's scheduled start is delayed by the same amount.
+        """
+        milliseconds, exact = self._scenario_think_time()
+        if milliseconds > 0 or not exact:
+            self._sleep(milliseconds, exact)
+
+
     def log_response(self, response):
         """Output full response information to the log file.
         """
-        log("HEADERS:")
+        content_type = ''
+        _log("HEADERS:")
         for name in response.listHeaders():
             value = response.getHeader(name)
-            log("  %s: %s" % (name, value))
-
-        log("BODY:")
-        body = response.getText()
-        # Prettify xml
-        if body.startswith('<?xml'):
-            # This helps with making the XML more readable, but gets UTF-8
-            # errors from time to time. If they occur, ignore them and just
-            # skip prettification
-            import xml.dom.minidom
-            try:
-                body = body.replace('\n', '').replace('\r', '').replace('\t', '')
-                body = xml.dom.minidom.parseString(body).toprettyxml()
-            except:
-                pass
-        log(body)
+            _log("  %s: %s", name, value)
+            if name.lower() == 'content-type':
+                content_type = value
+
+        _log("BODY:")
+        # Prettify XML or JSON, up to debug_body_limit characters
+        body = pretty.prettify(response.getText(), content_type,
+                               WebtestRunner.debug_body_limit)
+        _log(body)
 
 
     def _run_webtest_file(self, filename):
         """Execute all requests in the given .webtest filename.
         May raise a `CaptureFailed` or `BadRequestMethod` if errors occur.
         """
-        # Execute all requests in this test set, in order
-        for test, wrapper, request in WebtestRunner.webtest_requests[filename]:
-            # Execute this request
-            try:
-                response = self.execute(test, wrapper, request)
+        # Execute all requests and transactions in this file, in order
+        for step in WebtestRunner.webtest_steps[filename]:
+            if isinstance(step, Transaction):
+                self.run_transaction(step)
+            else:
+                self._run_request(step)
+
+            # Sleep between requests
+            self._think(step)
 
-            # If problems occurred, report an error
-            except (CaptureFailed, BadRequestMethod):
-                grinder.statistics.forLastTest.success = False
-                raise
 
-            # If response was not valid, report an error
-            if response.getStatusCode() >= 400:
-                grinder.statistics.forLastTest.success = False
+    def _run_request(self, step, transaction=None):
+        """Execute a single ``(test, wrapper, request)`` step, and report an
+        error if it fails. If it's part of a `Transaction`, the transaction
+        fails as well.
+        """
+        test, wrapper, request = step
+        # Execute this request
+        try:
+            response = self.execute(test, wrapper, request)
 
-            # Sleep between requests
-            grinder.sleep(WebtestRunner.think_time)
+        # If problems occurred, report an error
+        except (CaptureFailed, BadRequestMethod):
+            self._request_failed(test, transaction)
+            raise
+
+        # If response was not valid, report an error
+        if response.getStatusCode() >= 400:
+            self._request_failed(test, transaction)
+
+
+    def _request_failed(self, test, transaction):
+        """Mark the given request's test, and the transaction it's part of
+        (if any), as failed.
+        """
+        if not isinstance(test, UnrecordedTest):
+            grinder.statistics.forLastTest.success = False
+        # Inside the transaction's wrapped function, it's the current test
+        if transaction:
+            grinder.statistics.forCurrentTest.success = False
+
+
+    def run_transaction(self, transaction):
+        """Execute all requests in the given `Transaction`, timed as a single
+        test, with no think time between them.
+        """
+        if WebtestRunner.log_tests:
+            _log(WebtestRunner.test_headings[transaction.test.getNumber()])
+        if WebtestRunner.histograms:
+            start = clock.nanotime()
+        transaction.wrapper(self, transaction)
+        if WebtestRunner.histograms:
+            WebtestRunner.histograms.record(transaction.test.getNumber(),
+                                            (clock.nanotime() - start) // 1000)
 
 
     def run_test_set(self, test_set):
         """Run all ``.webtest`` files in the given `TestSet`.
         """
         for filename in test_set.filenames:
-            if WebtestRunner.verbosity != 'error':
-                log("==== Executing: %s ==========" % filename)
+            if WebtestRunner.log_tests:
+                _log(WebtestRunner.file_headings[filename])
 
             self._run_webtest_file(filename)
 
         # Sleep between scenarios
-        grinder.sleep(WebtestRunner.scenario_think_time)
+        self._scenario_think()
 
 
 
@@ -925,18 +2030,163 @@ class WebtestRunner:
         waiting ``think_time`` between requests, and ``scenario_think_time``
         between scenarios.
         """
+        # Decide whether to record responses in this iteration
+        if WebtestRunner.recorder:
+            self.recording = WebtestRunner.recorder.sampled()
+
+        # Decide whether to profile this iteration
+        if WebtestRunner.profile and WebtestRunner.profile.sampled():
+            return WebtestRunner.profile.run(self._run_iteration)
+        return self._run_iteration()
+
+
+    def _run_iteration(self):
+        """Run a single iteration of the test sets, according to the class
+        attribute ``sequence``, with a session from the ``session_pool`` if
+        there is one.
+        """
+        pool = WebtestRunner.session_pool
+        if not pool:
+            self._run_test_sets()
+            return True
+
+        pooled = pool.acquire()
+        valid = False
+        try:
+            if pool.needs_login(pooled):
+                # Log out of an expired session first
+                if pooled.logged_in() and WebtestRunner.after_set:
+                    self._restore_session(pooled)
+                    self.run_test_set(WebtestRunner.after_set)
+                self._reset_session()
+                self.run_test_set(WebtestRunner.before_set)
+                self._save_session(pooled)
+                pool.logged_in(pooled)
+            else:
+                self._restore_session(pooled)
+            self._run_test_sets()
+            self._save_session(pooled)
+            valid = True
+        finally:
+            pool.release(pooled, valid)
+        return True
+
+
+    def _run_test_sets(self):
+        """Run the test sets chosen for this iteration, pushing a layer of
+        variables for the iteration, or for each test set, according to the
+        class attribute ``variable_scope``.
+        """
+        self._push_scope('iteration')
+        try:
+            for test_set in self.choose_test_sets(self.thread_number()):
+                self._push_scope('test_set')
+                try:
+                    self.run_test_set(test_set)
+                finally:
+                    self._pop_scope('test_set')
+        finally:
+            self._pop_scope('iteration')
+
+
+    def _push_scope(self, level):
+        """Push a layer of variables, if ``variable_scope`` is ``level``.
+        """
+        if WebtestRunner.variable_scope == level:
+            self.variables.push()
+
+
+    def _pop_scope(self, level):
+        """Pop the layer of variables pushed by `_push_scope`.
+        """
+        if WebtestRunner.variable_scope == level:
+            self.variables.pop()
+
+
+    def _reset_session(self):
+        """Start a new session, with the default variables and no cookies.
+        """
+        self.variables = scope.Scope(self.default_variables)
+        self._set_cookies([])
+
+
+    def _save_session(self, pooled):
+        """Save the current variables and cookies in the given
+        `~webtest.session.Session`.
+        """
+        pooled.variables = self.variables.layers[0].copy()
+        pooled.cookies = self._get_cookies()
+
+
+    def _restore_session(self, pooled):
+        """Continue the given `~webtest.session.Session`, with its variables
+        and cookies.
+        """
+        self.variables = scope.Scope(self.default_variables,
+                                     pooled.variables.copy())
+        self._set_cookies(pooled.cookies)
+
+
+    def _get_cookies(self):
+        """Return a list of the cookies held by this worker thread.
+        """
+        context = HTTPPluginControl.getThreadHTTPClientContext()
+        return list(CookieModule.listAllCookies(context))
+
+
+    def _set_cookies(self, cookies):
+        """Replace the cookies held by this worker thread with the given list.
+        """
+        context = HTTPPluginControl.getThreadHTTPClientContext()
+        for cookie in CookieModule.listAllCookies(context):
+            CookieModule.removeCookie(cookie, context)
+        for cookie in cookies:
+            CookieModule.addCookie(cookie, context)
+
+
+    def thread_number(self):
+        """Return the number of the worker thread running this instance.
+        """
+        return grinder.getThreadNumber()
+
+
+    def worker(self):
+        """Return ``(worker, workers)``, where ``worker`` is the number of the
+        worker thread running this instance among all the worker threads in
+        the test, across all processes and agents, and ``workers`` is the
+        number of them. The number of agents is taken from the
+        ``webtest.agents`` property, and, for agents not started by the
+        console, the agent number from the ``webtest.agent`` property.
+        """
+        properties = grinder.getProperties()
+        threads = properties.getInt('grinder.threads', 1)
+        processes = properties.getInt('grinder.processes', 1)
+        agents = properties.getInt('webtest.agents', 1)
+        # The agent number is -1 when not started by the console
+        agent = grinder.getAgentNumber()
+        if agent < 0:
+            agent = properties.getInt('webtest.agent', 0)
+        agent = agent % agents
+        process = grinder.getProcessNumber() % processes
+        return ((agent * processes + process) * threads + self.thread_number(),
+                agents * processes * threads)
+
+
+    def choose_test_sets(self, thread_number):
+        """Return the list of `TestSet`\s to run in the next iteration,
+        according to the class attribute ``sequence``. ``thread_number`` is
+        used for ``'thread'`` sequencing.
+        """
         # Determine which sequencing to use
         sequence = WebtestRunner.sequence
         # Run a single TestSet at random.
         if sequence == 'random':
-            test_set = random.choice(WebtestRunner.test_sets)
-            self.run_test_set(test_set)
+            return [random.choice(WebtestRunner.test_sets)]
 
         # Run a single TestSet based on the current thread number
         elif sequence == 'thread':
-            index = grinder.getThreadNumber() % len(WebtestRunner.test_sets)
-            test_set = WebtestRunner.test_sets[index]
-            self.run_test_set(test_set)
+            index = thread_number % len(WebtestRunner.test_sets)
+            return [WebtestRunner.test_sets[index]]
 
         # Run a TestSet based on a percentage-based weight
         elif sequence == 'weighted':
@@ -952,13 +2202,10 @@ class WebtestRunner:
                 if left <= pick and pick <= right:
                     break
             # Run the TestSet that was selected
-            self.run_test_set(test_set)
+            return [test_set]
 
         # Run all TestSets sequentially
         else: # assume 'sequential'
-            for test_set in WebtestRunner.test_sets:
-                self.run_test_set(test_set)
-
-        return True
+            return WebtestRunner.test_sets
 
 
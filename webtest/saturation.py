@@ -0,0 +1,311 @@
+# saturation.py
+
+"""This module provides a `SaturationMonitor`, which detects when the load
+generator itself is overloaded.
+
+When an agent machine runs out of CPU, worker threads are not scheduled as
+often as they should be. Sleeps between requests take longer than requested,
+fewer requests are sent, and the time spent waiting to run is counted as part
+of each request's response time. Nothing in Grinder's own statistics shows
+this, so the results look valid when they are not.
+
+To check for this, pass a `SaturationMonitor` to
+`~webtest.runner.get_test_runner`::
+
+    from webtest.saturation import SaturationMonitor
+    TestRunner = get_test_runner(my_tests, think_time=500,
+                                 saturation_monitor=SaturationMonitor())
+
+Every sleep between requests and between scenarios is then timed, and its
+"lag" (how much longer it took than requested) is accumulated in intervals of
+``interval`` seconds. Any interval in which the mean lag exceeds ``threshold``
+milliseconds is reported in the log as it ends. Under Jython, the CPU time used
+by each worker thread is measured as well, using Java's ``ThreadMXBean``.
+
+When all the threads using the monitor have finished, a summary is logged. If
+any interval was over the threshold, it says::
+
+    RESULTS UNTRUSTWORTHY: the load generator could not keep up, so response
+    times may be inflated, and fewer requests sent than intended.
+
+Grinder varies each sleep time randomly, according to the
+``grinder.sleepTimeVariation`` property. To know how long each sleep should
+take, the monitor picks the varied time itself, in the same way, and asks
+Grinder for an exact sleep.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import atexit
+import random
+import thread
+import threading
+import time
+
+import clock
+
+try:
+    from java.lang.management import ManagementFactory
+    _thread_bean = ManagementFactory.getThreadMXBean()
+    if not _thread_bean.isCurrentThreadCpuTimeSupported():
+        _thread_bean = None
+except ImportError:
+    _thread_bean = None
+
+
+def _thread_cpu_time():
+    """Return the CPU time used by the current thread, in nanoseconds, or
+    ``None`` if this is not supported on this platform.
+    """
+    if _thread_bean is None:
+        return None
+    return _thread_bean.getCurrentThreadCpuTime()
+
+
+def _sleep_properties():
+    """Return ``(factor, variation)``, from the ``grinder.sleepTimeFactor``
+    and ``grinder.sleepTimeVariation`` properties.
+    """
+    try:
+        from net.grinder.script.Grinder import grinder
+    except ImportError:
+        return 1.0, 0.2
+    properties = grinder.getProperties()
+    return (properties.getDouble('grinder.sleepTimeFactor', 1.0),
+            properties.getDouble('grinder.sleepTimeVariation', 0.2))
+
+
+class Interval:
+    """Sleep lag and CPU time accumulated over one interval.
+    """
+    def __init__(self, start):
+        # Start of the interval, in seconds since the epoch
+        self.start = start
+        # Number of sleeps, and their total and maximum lag in nanoseconds
+        self.count = 0
+        self.total_lag = 0
+        self.max_lag = 0
+        # CPU time used by the worker threads, and the elapsed time during
+        # which it was measured, summed over all threads, in nanoseconds
+        self.cpu_time = 0
+        self.elapsed = 0
+
+
+    def mean_lag(self):
+        """Return the mean lag, in milliseconds.
+        """
+        if not self.count:
+            return 0.0
+        return self.total_lag / 1000000.0 / self.count
+
+
+    def cpu_percent(self):
+        """Return the CPU time used by an average worker thread, as a
+        percentage of the elapsed time, or ``None`` if it was not measured.
+        """
+        if not self.elapsed:
+            return None
+        return 100.0 * self.cpu_time / self.elapsed
+
+
+class SaturationMonitor:
+    """Measures how late worker threads wake up from their sleeps, and reports
+    intervals in which the load generator was saturated.
+
+    Optional keyword arguments:
+
+        ``threshold``
+            Mean lag, in milliseconds, above which an interval is reported.
+        ``interval``
+            Length of each interval, in seconds.
+        ``output``
+            Function called with warnings and the summary. If ``None``, the
+            runner's log function (normally ``grinder.logger.output``) is used.
+        ``rng``
+            A ``random.Random`` instance used to vary sleep times. If
+            ``None``, a new one is created.
+
+    """
+    def __init__(self, threshold=10, interval=10, output=None, rng=None):
+        """Create a SaturationMonitor.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.output = output
+        self.rng = rng or random.Random()
+        self.factor, self.variation = _sleep_properties()
+        # Finished intervals, oldest first
+        self.intervals = []
+        self.current = None
+        # (elapsed, cpu_time) when each thread last slept,
+        # indexed by thread identifier
+        self._threads = {}
+        # Number of threads that have not yet called thread_finished
+        self._running = 0
+        self._reported = False
+        self._lock = threading.Lock()
+
+
+    def vary(self, milliseconds):
+        """Return a randomly varied sleep time around ``milliseconds``, as
+        Grinder's own ``grinder.sleep`` would use.
+        """
+        if milliseconds <= 0 or self.variation <= 0:
+            return milliseconds
+        # The variation covers three standard deviations
+        varied = self.rng.gauss(milliseconds, milliseconds * self.variation / 3.0)
+        return max(0, long(varied))
+
+
+    def record_sleep(self, milliseconds, elapsed):
+        """Record that the current thread asked for an exact sleep of the given
+        number of ``milliseconds``, and it took ``elapsed`` nanoseconds.
+        """
+        lag = elapsed - long(milliseconds * self.factor * 1000000)
+        if lag < 0:
+            lag = 0
+        now = clock.nanotime()
+        cpu_time = _thread_cpu_time()
+        start = int(time.time() // self.interval) * self.interval
+        finished = None
+        self._lock.acquire()
+        try:
+            ident = thread.get_ident()
+            if ident not in self._threads:
+                self._running += 1
+                if len(self._threads) == 0:
+                    atexit.register(self.report)
+                previous = None
+            else:
+                previous = self._threads[ident]
+            self._threads[ident] = (now, cpu_time)
+
+            if self.current is None or self.current.start != start:
+                finished = self.current
+                if finished is not None:
+                    self.intervals.append(finished)
+                self.current = Interval(start)
+            current = self.current
+            current.count += 1
+            current.total_lag += lag
+            current.max_lag = max(current.max_lag, lag)
+            if cpu_time is not None and previous is not None:
+                current.elapsed += now - previous[0]
+                current.cpu_time += cpu_time - previous[1]
+        finally:
+            self._lock.release()
+        if finished is not None and self.saturated(finished):
+            self._warn(finished)
+
+
+    def saturated(self, interval):
+        """Return True if the mean lag in the given `Interval` was over the
+        threshold.
+        """
+        return interval.mean_lag() > self.threshold
+
+
+    def _warn(self, interval):
+        """Write a warning about a saturated `Interval` to ``output``.
+        """
+        if self.output is None:
+            return
+        message = "WARNING: load generator lagging in the %ds from %s: " \
+                  "mean sleep lag %.1f ms, max %.1f ms, over %d sleeps" % \
+                  (self.interval,
+                   time.strftime('%H:%M:%S', time.localtime(interval.start)),
+                   interval.mean_lag(), interval.max_lag / 1000000.0,
+                   interval.count)
+        cpu_percent = interval.cpu_percent()
+        if cpu_percent is not None:
+            message += "; worker threads used %.1f%% CPU" % cpu_percent
+        self.output(message)
+
+
+    def thread_finished(self):
+        """Note that the current thread has finished using the monitor. When
+        all threads have finished, the summary is written.
+        """
+        self._lock.acquire()
+        try:
+            if thread.get_ident() not in self._threads:
+                return
+            self._running -= 1
+            finished = self._running <= 0
+        finally:
+            self._lock.release()
+        if finished:
+            self.report()
+
+
+    def all_intervals(self):
+        """Return a list of all `Interval`\s so far, including the current one.
+        """
+        self._lock.acquire()
+        try:
+            intervals = self.intervals[:]
+            if self.current is not None:
+                intervals.append(self.current)
+        finally:
+            self._lock.release()
+        return intervals
+
+
+    def summary(self):
+        """Return a summary of the lag and CPU time measured, and whether the
+        results can be trusted.
+        """
+        intervals = self.all_intervals()
+        count = 0
+        total_lag = 0
+        max_lag = 0
+        cpu_time = 0
+        elapsed = 0
+        saturated = 0
+        for interval in intervals:
+            count += interval.count
+            total_lag += interval.total_lag
+            max_lag = max(max_lag, interval.max_lag)
+            cpu_time += interval.cpu_time
+            elapsed += interval.elapsed
+            if self.saturated(interval):
+                saturated += 1
+        if count:
+            mean_lag = total_lag / 1000000.0 / count
+        else:
+            mean_lag = 0.0
+        lines = ["Load generator sleep lag: mean %.1f ms, max %.1f ms, "
+                 "over %d sleeps" % (mean_lag, max_lag / 1000000.0, count)]
+        if elapsed:
+            lines.append("Worker thread CPU time: %.1f%% of elapsed time" %
+                         (100.0 * cpu_time / elapsed))
+        else:
+            lines.append("Worker thread CPU time: not available")
+        if saturated:
+            lines.append("%d of %d intervals had a mean sleep lag over %s ms" %
+                         (saturated, len(intervals), self.threshold))
+            lines.append("RESULTS UNTRUSTWORTHY: the load generator could not "
+                         "keep up, so response\ntimes may be inflated, and "
+                         "fewer requests sent than intended.")
+        else:
+            lines.append("No intervals had a mean sleep lag over %s ms" %
+                         self.threshold)
+        return '\n'.join(lines)
+
+
+    def report(self):
+        """Write any warning about the current interval, and the summary, to
+        ``output``, unless they have been written already.
+        """
+        self._lock.acquire()
+        try:
+            if self._reported or not self._threads or self.output is None:
+                return
+            self._reported = True
+            current = self.current
+        finally:
+            self._lock.release()
+        if current is not None and self.saturated(current):
+            self._warn(current)
+        self.output(self.summary())
+
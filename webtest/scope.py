@@ -0,0 +1,155 @@
+# scope.py
+
+"""This module provides `Scope`, the layered store of variables used by each
+`~webtest.runner.WebtestRunner`.
+
+A `Scope` holds the default variables passed to
+`~webtest.runner.get_test_runner`, shared by all runners and never copied or
+changed, and a stack of layers of the runner's own variables. Looking up a
+name searches the layers from the innermost out, and then the defaults;
+setting a name always sets it in the innermost layer::
+
+    >>> variables = Scope({'SERVER': 'localhost', 'USERNAME': 'phil'})
+    >>> variables['SID'] = '1234'
+    >>> variables.push()
+    >>> variables['USERNAME'] = 'sarah'
+    >>> variables['USERNAME'], variables['SID']
+    ('sarah', '1234')
+    >>> variables.pop()
+    {'USERNAME': 'sarah'}
+    >>> variables['USERNAME']
+    'phil'
+
+The outermost layer belongs to the runner, and holds the variables set by the
+``before_set``. With the ``variable_scope`` keyword to
+`~webtest.runner.get_test_runner`, a layer is pushed for each iteration, or
+for each `~webtest.runner.TestSet`, and popped when it finishes; variables set
+or captured in it are discarded with it, all at once, so they do not pile up
+over a long test.
+
+Otherwise, a `Scope` behaves like a dictionary of all of its variables, with
+the innermost value of each name.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+class Scope:
+    """Variables in a stack of layers, over a dictionary of defaults.
+    """
+    def __init__(self, defaults=None, variables=None):
+        """Create a Scope with the given ``defaults``, which are not copied,
+        and an outermost layer containing ``variables``.
+        """
+        if defaults is None:
+            defaults = {}
+        if variables is None:
+            variables = {}
+        self.defaults = defaults
+        # Dictionaries of variables, outermost first
+        self.layers = [variables]
+
+
+    def push(self):
+        """Add a new, empty innermost layer.
+        """
+        self.layers.append({})
+
+
+    def pop(self):
+        """Remove and return the innermost layer, discarding the variables
+        set in it. The outermost layer cannot be removed.
+        """
+        if len(self.layers) == 1:
+            raise IndexError("Cannot pop the outermost layer of a Scope.")
+        return self.layers.pop()
+
+
+    def __getitem__(self, name):
+        index = len(self.layers) - 1
+        while index >= 0:
+            layer = self.layers[index]
+            if name in layer:
+                return layer[name]
+            index -= 1
+        return self.defaults[name]
+
+
+    def __setitem__(self, name, value):
+        self.layers[-1][name] = value
+
+
+    def __delitem__(self, name):
+        """Remove ``name`` from the innermost layer that has it. Defaults
+        cannot be removed.
+        """
+        index = len(self.layers) - 1
+        while index >= 0:
+            layer = self.layers[index]
+            if name in layer:
+                del layer[name]
+                return
+            index -= 1
+        raise KeyError(name)
+
+
+    def __contains__(self, name):
+        for layer in self.layers:
+            if name in layer:
+                return True
+        return name in self.defaults
+
+
+    def has_key(self, name):
+        return name in self
+
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+    def copy(self):
+        """Return a dictionary of all variables, with the innermost value of
+        each name.
+        """
+        variables = self.defaults.copy()
+        for layer in self.layers:
+            variables.update(layer)
+        return variables
+
+
+    def keys(self):
+        return self.copy().keys()
+
+
+    def items(self):
+        return self.copy().items()
+
+
+    def values(self):
+        return self.copy().values()
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __len__(self):
+        return len(self.copy())
+
+
+    def __eq__(self, other):
+        if isinstance(other, Scope):
+            other = other.copy()
+        return self.copy() == other
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __repr__(self):
+        return 'Scope(%r)' % self.copy()
+
@@ -0,0 +1,160 @@
+# session.py
+
+"""This module provides a `SessionPool`, which lets many iterations share a
+smaller number of logged-in sessions, so that logging in does not dominate
+the load.
+
+Without a pool, each `~webtest.runner.WebtestRunner` (each worker thread)
+runs the ``before_set`` once, when it is created, and keeps the variables and
+cookies it captured for the rest of the run. To have a fixed number of
+distinct users cycle through the scenarios instead, pass a `SessionPool`
+along with the ``before_set``::
+
+    from webtest.session import SessionPool
+    login = TestSet('login.webtest')
+    TestRunner = get_test_runner(my_tests, before_set=login, sequence='random',
+                                 session_pool=SessionPool(size=50, max_age=900))
+
+The ``before_set`` is then not run when a runner is created. Instead, each
+iteration checks out a `Session` from the pool: the variables and cookies
+captured by running the ``before_set``. The iteration runs with them, and
+returns them to the pool at the end, with any changes made during the
+iteration.
+
+Sessions are created when they are needed, by the thread that checks them
+out, until there are ``size`` of them; so the first logins are spread across
+the threads, and run in parallel. After that, a thread that finds no idle
+session waits for one to be returned. A session is logged in again when it
+expires, after ``max_age`` seconds or ``max_uses`` iterations; if there is an
+``after_set`` (such as logging out), it is run with the old session first. So
+logins happen at a rate set by the size of the pool and the lifetime of its
+sessions, however many iterations are run. If an iteration fails, its session
+is discarded, and a new one is created in its place.
+
+Under Grinder, the cookies in a session are those of the worker thread's
+HTTP client context; in the standalone `webtest.engine`, they are those of
+the virtual user.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import threading
+import time
+
+
+class Session:
+    """The variables and cookies of a single logged-in session.
+    """
+    def __init__(self, number):
+        # Number of the session, counting from 1 in each pool
+        self.number = number
+        # Dictionary of variables, and list of cookies, or None if the
+        # session has not been logged in yet
+        self.variables = None
+        self.cookies = None
+        # Time of the last login, in seconds since the epoch
+        self.login_time = None
+        # Number of iterations since the last login
+        self.uses = 0
+
+
+    def logged_in(self):
+        """Return True if the session has been logged in.
+        """
+        return self.variables is not None
+
+
+class SessionPool:
+    """A pool of `Session`\s, shared by all worker threads.
+
+    Optional keyword arguments:
+
+        ``size``
+            Maximum number of sessions.
+        ``max_age``
+            Time in seconds after which a session is logged in again, or
+            ``None`` to keep it for the whole run.
+        ``max_uses``
+            Number of iterations after which a session is logged in again, or
+            ``None`` for no limit. This is an upper bound: a login may be used
+            for fewer iterations, if the run ends first.
+
+    """
+    def __init__(self, size=10, max_age=None, max_uses=None):
+        """Create a SessionPool.
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1.")
+        self.size = size
+        self.max_age = max_age
+        self.max_uses = max_uses
+        # Number of logins, and of sessions discarded after failures
+        self.logins = 0
+        self.discarded = 0
+        # Idle sessions, in the order they were returned
+        self.idle = []
+        # Number of sessions, idle or checked out
+        self.sessions = 0
+        self._number = 0
+        self._condition = threading.Condition()
+
+
+    def acquire(self, block=True):
+        """Check out an idle `Session`, or create a new one if there are fewer
+        than ``size``. If there are none to be had, wait until one is
+        returned; or if ``block`` is False, return ``None``.
+        """
+        self._condition.acquire()
+        try:
+            while True:
+                if self.idle:
+                    return self.idle.pop(0)
+                if self.sessions < self.size:
+                    self.sessions += 1
+                    self._number += 1
+                    return Session(self._number)
+                if not block:
+                    return None
+                self._condition.wait()
+        finally:
+            self._condition.release()
+
+
+    def release(self, session, valid=True):
+        """Return a `Session` checked out with `acquire`, after using it for
+        an iteration. If the iteration failed, pass ``valid=False`` to discard
+        the session.
+        """
+        self._condition.acquire()
+        try:
+            if valid:
+                session.uses += 1
+                self.idle.append(session)
+            else:
+                self.sessions -= 1
+                self.discarded += 1
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+
+    def needs_login(self, session):
+        """Return True if the given `Session` has not been logged in, or has
+        expired.
+        """
+        if not session.logged_in():
+            return True
+        if self.max_age is not None and \
+           time.time() - session.login_time >= self.max_age:
+            return True
+        return self.max_uses is not None and session.uses >= self.max_uses
+
+
+    def logged_in(self, session):
+        """Note that the given `Session` has just been logged in.
+        """
+        session.login_time = time.time()
+        session.uses = 0
+        self._condition.acquire()
+        self.logins += 1
+        self._condition.release()
@@ -42,7 +42,14 @@ class Test:
     def getNumber(self):
         return self.number
 
-    def wrap(self, *args):
+    def getDescription(self):
+        return self.description
+
+    def wrap(self, target=None):
+        # Wrapped functions are called directly; anything else is assumed
+        # to be an HTTPRequest
+        if callable(target) and not isinstance(target, Stub):
+            return target
         return Wrapper()
 
 class Response:
@@ -63,7 +70,8 @@ class Response:
         return self.headers.keys()
 
     def getHeader(self, name):
-        return self.headers[name]
+        # Like Grinder, return None for missing headers
+        return self.headers.get(name)
 
 class StatisticsForTest:
     def __init__(self):
@@ -72,8 +80,16 @@ class StatisticsForTest:
 class Statistics:
     def __init__(self):
         self.forLastTest = StatisticsForTest()
+        self.forCurrentTest = StatisticsForTest()
         self.delayReports = False
 
+class Properties:
+    def getInt(self, name, default):
+        return default
+
+    def getDouble(self, name, default):
+        return default
+
 class Grinder:
     __shared_state = {}
     def __init__(self):
@@ -86,6 +102,43 @@ class Grinder:
     def getThreadNumber(self, *args):
         return 0
 
+    def getProcessNumber(self):
+        return 0
+
+    def getAgentNumber(self):
+        return -1
+
+    def getProperties(self):
+        return Properties()
+
+class HTTPClientContext:
+    def __init__(self):
+        self.cookies = []
+
+class HTTPPluginControl:
+    # Contexts, indexed by thread identifier
+    contexts = {}
+    def getThreadHTTPClientContext():
+        import thread
+        ident = thread.get_ident()
+        if ident not in HTTPPluginControl.contexts:
+            HTTPPluginControl.contexts[ident] = HTTPClientContext()
+        return HTTPPluginControl.contexts[ident]
+    getThreadHTTPClientContext = staticmethod(getThreadHTTPClientContext)
+
+class CookieModule:
+    def listAllCookies(context):
+        return context.cookies[:]
+    listAllCookies = staticmethod(listAllCookies)
+
+    def addCookie(cookie, context):
+        context.cookies.append(cookie)
+    addCookie = staticmethod(addCookie)
+
+    def removeCookie(cookie, context):
+        context.cookies.remove(cookie)
+    removeCookie = staticmethod(removeCookie)
+
 grinder = Grinder()
 NVPair = Stub()
 HTTPRequest = Stub()
@@ -0,0 +1,203 @@
+# timeline.py
+
+"""This module provides a `TraceWriter`, which writes a timeline of the
+requests and sleeps of sampled worker threads, for viewing in Chrome's
+``chrome://tracing`` page or in Perfetto.
+
+To write a trace, pass a `TraceWriter` to `~webtest.runner.get_test_runner`::
+
+    from webtest.timeline import TraceWriter
+    TestRunner = get_test_runner(my_tests, tracer=TraceWriter(sample=0.1))
+
+Each worker thread is sampled (here, with a probability of 10%) when it first
+executes a request. Under the `webtest.engine`, where all virtual users share
+one thread, each virtual user is sampled instead, and gets its own row on the
+timeline. For sampled threads, every request is written as a span
+named after the request, with the HTTP call itself as a nested ``http`` span,
+and every sleep between requests as a ``sleep`` span. On the timeline, the
+``http`` spans show time spent waiting for the server, the rest of each request
+span shows client overhead (evaluating expressions, captures and logging), and
+the ``sleep`` spans show think time.
+
+Spans are written in the Chrome trace event format, as "complete" (``X``)
+events with times in microseconds. Events are buffered per process, and
+appended to the file in batches of ``buffer_size``. The closing ``]`` of the
+event array is never written, which the trace viewers allow, so the file can be
+loaded at any time during the run. Each process should write its own file;
+by default, it is named ``trace-<process>.json``, after the Grinder process.
+"""
+
+# Everything in this script should be compatible with Jython 2.2.1.
+
+import atexit
+import os
+import random
+import thread
+import threading
+
+import profiler
+
+# Characters that must be escaped in JSON strings
+_JSON_ESCAPES = {'"': '\\"', '\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def _json_string(text):
+    """Return ``text`` as a quoted JSON string.
+    """
+    chars = []
+    for char in text:
+        if char in _JSON_ESCAPES:
+            chars.append(_JSON_ESCAPES[char])
+        elif char < ' ' or (char > '~' and isinstance(char, unicode)):
+            chars.append('\\u%04x' % ord(char))
+        else:
+            chars.append(char)
+    return '"' + ''.join(chars) + '"'
+
+
+class TraceWriter:
+    """Writes spans for sampled worker threads to a Chrome trace event file.
+
+    Optional keyword arguments:
+
+        ``filename``
+            File to write the trace to. If ``None``, the file is named
+            ``trace-<process>.json``, after the Grinder process.
+        ``sample``
+            Fraction of worker threads to trace, between 0.0 and 1.0.
+        ``buffer_size``
+            Number of events to buffer before appending them to the file.
+
+    """
+    def __init__(self, filename=None, sample=0.1, buffer_size=1000):
+        """Create a TraceWriter. The file is created when the first event is
+        written.
+        """
+        self.process_name = profiler._process_name()
+        if filename is None:
+            filename = 'trace-%s.json' % self.process_name
+        self.filename = filename
+        self.sample = sample
+        self.buffer_size = buffer_size
+        if hasattr(os, 'getpid'):
+            self.pid = os.getpid()
+        else:
+            self.pid = 0
+        # Whether each track is sampled, indexed by track (normally the
+        # thread identifier)
+        self._sampled = {}
+        self._registered = False
+        # Formatted events not yet written
+        self._buffer = []
+        self._started = False
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+
+
+    def sampled(self, track=None, name=None):
+        """Return True if the given track is being traced. A track is a row
+        on the timeline, identified by an integer; by default, it is the
+        current thread. The first call for each track decides whether it is
+        traced, and gives the track its ``name`` (by default, the name of the
+        current thread).
+        """
+        if track is None:
+            track = thread.get_ident()
+        try:
+            return self._sampled[track]
+        except KeyError:
+            return self._add_track(track, name)
+
+
+    def _add_track(self, track, name):
+        """Decide whether to trace the given track, and return the result.
+        """
+        sampled = self.sample >= 1.0 or random.random() < self.sample
+        self._sampled[track] = sampled
+        if sampled:
+            if name is None:
+                name = threading.currentThread().getName()
+            self._append(self._metadata('thread_name', track, name))
+            if not self._registered:
+                self._registered = True
+                atexit.register(self.flush)
+        return sampled
+
+
+    def _metadata(self, kind, tid, name):
+        """Return a formatted metadata event, naming a process or thread.
+        """
+        return '{"name":"%s","ph":"M","pid":%d,"tid":%d,"args":{"name":%s}}' % \
+               (kind, self.pid, tid, _json_string(name))
+
+
+    def span(self, name, category, start, end, args=None, track=None):
+        """Add a span to the given track (by default, the current thread),
+        from ``start`` to ``end`` (in nanoseconds, from
+        `webtest.clock.nanotime`). ``args`` is an optional dict of integers,
+        shown when the span is selected.
+        """
+        if track is None:
+            track = thread.get_ident()
+        event = '{"name":%s,"cat":"%s","ph":"X","pid":%d,"tid":%d,' \
+                '"ts":%.3f,"dur":%.3f' % \
+                (_json_string(name), category, self.pid, track,
+                 start / 1000.0, (end - start) / 1000.0)
+        if args:
+            items = args.items()
+            items.sort()
+            fields = []
+            for key, value in items:
+                fields.append('"%s":%d' % (key, value))
+            event += ',"args":{%s}' % ','.join(fields)
+        self._append(event + '}')
+
+
+    def _append(self, event):
+        """Buffer a formatted event, writing the buffer if it is full.
+        """
+        self._lock.acquire()
+        try:
+            self._buffer.append(event)
+            if len(self._buffer) < self.buffer_size:
+                return
+            events = self._buffer
+            self._buffer = []
+        finally:
+            self._lock.release()
+        self._write(events)
+
+
+    def flush(self):
+        """Append all buffered events to the file now.
+        """
+        self._lock.acquire()
+        try:
+            events = self._buffer
+            self._buffer = []
+        finally:
+            self._lock.release()
+        self._write(events)
+
+
+    def _write(self, events):
+        """Append the given formatted events to the file, creating it if
+        needed.
+        """
+        if not events:
+            return
+        self._file_lock.acquire()
+        try:
+            if not self._started:
+                outfile = open(self.filename, 'w')
+                outfile.write('[\n')
+                outfile.write(self._metadata('process_name', 0,
+                                             self.process_name) + ',\n')
+                self._started = True
+            else:
+                outfile = open(self.filename, 'a')
+            outfile.write(',\n'.join(events) + ',\n')
+            outfile.close()
+        finally:
+            self._file_lock.release()
+